@@ -0,0 +1,276 @@
+import fitz  # PyMuPDF
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+
+import extract_text_info
+import image_extraction
+import pdf_download
+from extract_text_info import iter_highlighted_pages
+
+logger = logging.getLogger('uvicorn.error')
+
+
+DEFAULT_OUTPUT = 'batch.jsonl'
+DEFAULT_IMAGE_DIR = 'batch_images'
+DEFAULT_WORKERS = os.cpu_count() or 1
+FETCH_TIMEOUT = 30  # seconds, per read of a download
+DEFAULT_MAX_DOWNLOAD_SIZE = pdf_download.DEFAULT_MAX_SIZE  # bytes
+# times a document is tried when worker processes die while it is in flight
+MAX_ATTEMPTS = 2
+
+
+def is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def collect_inputs(inputs, manifest=None):
+    """Return the PDFs to process, in order and without duplicates.
+
+    Args:
+        inputs: PDF files or URLs, directories (searched recursively for
+            .pdf files) and glob patterns.
+        manifest: path of a file listing one PDF file or URL per line.
+            Blank lines and lines starting with '#' are skipped.
+    """
+    sources = []
+    if manifest is not None:
+        with open(manifest, encoding='utf-8') as f:
+            sources.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith('#'))
+    for item in inputs:
+        if is_url(item):
+            sources.append(item)
+        elif os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                sources.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith('.pdf'))
+        elif glob.has_magic(item):
+            sources.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            sources.append(item)
+    return list(dict.fromkeys(sources))
+
+
+def process_document(source, extract_args, max_download_size=DEFAULT_MAX_DOWNLOAD_SIZE):
+    """Extract the pages of a PDF file or URL.
+
+    Errors are returned rather than raised, so that one bad document does
+    not stop the batch. A URL is downloaded into a SpooledPdf of at most
+    `max_download_size` bytes.
+
+    Returns:
+        The record of the document: its source, page count, processing
+        time and pages, or its source, processing time and error.
+    """
+    t0 = time.perf_counter()
+    spool = None
+    try:
+        if is_url(source):
+            spool = pdf_download.download(source, pdf_download.SpooledPdf(max_size=max_download_size), FETCH_TIMEOUT)
+            _, pdf_source = spool.finish()
+        else:
+            pdf_source = source
+        pdf_document = fitz.open(pdf_source) if isinstance(pdf_source, str) else fitz.Document(stream=pdf_source)
+        try:
+            pages = list(iter_highlighted_pages(pdf_document, **extract_args))
+        finally:
+            pdf_document.close()
+        return {"source": source, "page_count": len(pages), "elapsed": time.perf_counter() - t0, "pages": pages}
+    except Exception as e:
+        return {"source": source, "elapsed": time.perf_counter() - t0, "error": f"{type(e).__name__}: {e}"}
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+def iter_batch(sources, workers=DEFAULT_WORKERS, max_download_size=DEFAULT_MAX_DOWNLOAD_SIZE, **extract_args):
+    """Process the documents across `workers` processes.
+
+    Args:
+        sources: PDF files or URLs.
+        workers: number of worker processes, each handling one document at
+            a time. With 1, documents are processed in this process.
+        max_download_size: size in bytes above which a download fails.
+        extract_args: keyword arguments of iter_highlighted_pages().
+
+    Yields:
+        The record of each document (see process_document()), in the order
+        they complete. At most two documents per worker are in flight. If a
+        worker dies, the pool is started again and the documents that were
+        in flight are retried one at a time, so that only the one killing
+        its worker fails.
+    """
+    if workers <= 1:
+        for source in sources:
+            yield process_document(source, extract_args, max_download_size)
+        return
+
+    sources = deque(sources)
+    suspects = deque()  # documents in flight when a worker died
+    attempts = {}
+    while sources or suspects:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            try:
+                while sources or suspects or pending:
+                    if suspects:
+                        if not pending:
+                            source = suspects.popleft()
+                            pending[executor.submit(process_document, source, extract_args, max_download_size)] = source
+                    else:
+                        while sources and len(pending) < 2 * workers:
+                            source = sources.popleft()
+                            pending[executor.submit(process_document, source, extract_args, max_download_size)] = source
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        e = future.exception()
+                        if e is None:
+                            del pending[future]
+                            yield future.result()
+                        elif not isinstance(e, BrokenProcessPool):
+                            # not raised by process_document(), like a record which does not pickle
+                            yield {"source": pending.pop(future), "elapsed": 0.0, "error": f"{type(e).__name__}: {e}"}
+                    if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                        raise BrokenProcessPool()
+            except BrokenProcessPool:
+                # the pool is unusable: retry the documents in flight with a new one
+                for source in pending.values():
+                    attempts[source] = attempts.get(source, 0) + 1
+                    if attempts[source] >= MAX_ATTEMPTS:
+                        yield {"source": source, "elapsed": 0.0, "error": "BrokenProcessPool: a worker process died while processing the document"}
+                    else:
+                        suspects.append(source)
+                pending = {}
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class BatchStats:
+    """Counts and throughput of a batch."""
+
+    def __init__(self, skipped=0):
+        self.documents = 0
+        self.pages = 0
+        self.errors = 0
+        self.skipped = skipped
+        self.t0 = time.perf_counter()
+
+    def add(self, record):
+        if "error" in record:
+            self.errors += 1
+        else:
+            self.documents += 1
+            self.pages += record["page_count"]
+
+    def report(self):
+        elapsed = time.perf_counter() - self.t0
+        return {
+            "documents": self.documents,
+            "pages": self.pages,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "elapsed": elapsed,
+            "docs_per_s": self.documents / elapsed if elapsed else 0.0,
+            "pages_per_s": self.pages / elapsed if elapsed else 0.0,
+        }
+
+
+def run_batch(sources, output=DEFAULT_OUTPUT, completed=None, workers=DEFAULT_WORKERS, max_download_size=DEFAULT_MAX_DOWNLOAD_SIZE, **extract_args):
+    """Process the documents, appending their records to the `output` JSONL file.
+
+    Args:
+        completed: path of the completed-set file. Documents listed there
+            are skipped, and documents processed without error are added
+            to it, so that an interrupted batch can be resumed.
+
+    Returns:
+        The BatchStats report.
+    """
+    done = set()
+    if completed is not None and os.path.exists(completed):
+        with open(completed, encoding='utf-8') as f:
+            done = {line.rstrip('\n') for line in f if line.strip()}
+    todo = [source for source in sources if source not in done]
+    stats = BatchStats(skipped=len(sources) - len(todo))
+
+    with open(output, 'a', encoding='utf-8') as out, (open(completed, 'a', encoding='utf-8') if completed else nullcontext()) as completed_file:
+        for record in iter_batch(todo, workers=workers, max_download_size=max_download_size, **extract_args):
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+            stats.add(record)
+            if "error" in record:
+                logger.warning(f"{record['source']}: {record['error']}")
+            elif completed_file is not None:
+                completed_file.write(record["source"] + '\n')
+                completed_file.flush()
+            logger.info(f"{record['source']}: {record.get('page_count', 0)} pages in {record['elapsed']:.2f}s")
+
+    return stats.report()
+
+
+def main():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description='Extract the text blocks of many PDF files in one job.')
+    parser.add_argument('inputs', nargs='*', help='PDF files or URLs, directories or glob patterns.')
+    parser.add_argument('--manifest', help='File listing one PDF file or URL per line.')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f'JSONL file the document records are appended to. Defaults to "{DEFAULT_OUTPUT}".')
+    parser.add_argument('--completed', help='Completed-set file: documents listed there are skipped, processed ones are added to it.')
+    parser.add_argument('--report', help='JSON file the throughput report is written to.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Number of worker processes. Defaults to {DEFAULT_WORKERS}.')
+    parser.add_argument('--max_download_size', type=int, default=DEFAULT_MAX_DOWNLOAD_SIZE, help=f'Size in bytes above which the download of a URL fails. Defaults to {DEFAULT_MAX_DOWNLOAD_SIZE}.')
+    parser.add_argument('--pages', default=extract_text_info.DEFAULT_PAGES, help=f'Pages to process, e.g. "1-3,5,8-". Defaults to "{extract_text_info.DEFAULT_PAGES}".')
+    parser.add_argument('--use_clustered_blocks', action='store_true', help='Cluster the text blocks.')
+    parser.add_argument('--use_clustered_spans', action=argparse.BooleanOptionalAction, default=extract_text_info.DEFAULT_USE_CLUSTERED_SPANS, help='Cluster the text spans.')
+    parser.add_argument('--x_tolerance', type=float, default=extract_text_info.DEFAULT_X_TOLERANCE)
+    parser.add_argument('--y_tolerance', type=float, default=extract_text_info.DEFAULT_Y_TOLERANCE)
+    parser.add_argument('--auto_clustering', action='store_true', help='Choose the clustering and tolerances of each page from its text.')
+    parser.add_argument('--ocr', action='store_true', help='OCR the scanned pages with Tesseract.')
+    parser.add_argument('--ocr_language', default=extract_text_info.DEFAULT_OCR_LANGUAGE, help=f'Tesseract languages of the OCR. Defaults to "{extract_text_info.DEFAULT_OCR_LANGUAGE}".')
+    parser.add_argument('--images', choices=extract_text_info.IMAGE_LEVELS, default=extract_text_info.DEFAULT_IMAGES, help=f'Image handling. Defaults to "{extract_text_info.DEFAULT_IMAGES}".')
+    parser.add_argument('--image_dir', default=DEFAULT_IMAGE_DIR, help=f'Directory the extracted images of all the documents are saved to, as "<sha256>.<ext>". Defaults to "{DEFAULT_IMAGE_DIR}".')
+
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s')
+    logger.setLevel(logging.INFO)
+
+    sources = collect_inputs(args.inputs, manifest=args.manifest)
+    if not sources:
+        parser.error('no input PDF found')
+
+    report = run_batch(
+        sources,
+        output=args.output,
+        completed=args.completed,
+        workers=args.workers,
+        max_download_size=args.max_download_size,
+        use_clustered_blocks=args.use_clustered_blocks,
+        use_clustered_spans=args.use_clustered_spans,
+        x_tolerance=args.x_tolerance,
+        y_tolerance=args.y_tolerance,
+        use_auto_clustering=args.auto_clustering,
+        use_ocr=args.ocr,
+        ocr_language=args.ocr_language,
+        pages=args.pages,
+        images=args.images,
+        image_store=image_extraction.ImageStore(args.image_dir) if args.images == 'extraction' else None,
+    )
+
+    print()
+    print(f"Documents: {report['documents']}  pages: {report['pages']}  errors: {report['errors']}  skipped: {report['skipped']}")
+    print(f"Elapsed: {report['elapsed']:.2f}s  ({report['docs_per_s']:.2f} docs/s, {report['pages_per_s']:.2f} pages/s)")
+    print(f"Records saved as: {args.output}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved as: {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare annotate_page() with the legacy per-annotation PyMuPDF calls.
+
+Both must add the same annotations (type, rect, contents, colors, opacity,
+name) and render the pages to the same pixels.
+
+Usage:
+    python benchmarks/bench_annotation.py [input_pdf ...]
+"""
+import argparse
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_text_info  # noqa: E402
+from synthetic import synthetic_pdf  # noqa: E402
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'AITranslate_1_1723115119.pdf')
+DEFAULT_SYNTHETIC_LINES = [20, 60, 240]
+DEFAULT_SYNTHETIC_PAGES = 4
+
+
+def legacy_annotate_page(page, annotations):
+    """annotate_page() as it was: two annotations and two update() per block."""
+    for block_bbox, block_text in annotations:
+        bbox = list(block_bbox)
+        for k in range(len(bbox)): bbox[k] += -1 if k < 2 else +1  # expand bbox
+        highlight = page.add_rect_annot(bbox)
+        highlight.set_colors(stroke=[0, .8, 0])
+        highlight.update()
+        text_annot = page.add_text_annot((bbox[0]-18, bbox[1]-18), block_text, icon="Paragraph")
+        text_annot.set_colors(stroke=[0, 1, 0])
+        text_annot.update(opacity=.7)
+
+
+def annotated(pdf_bytes, annotate):
+    """Return the annotated document, reloaded, and the time spent annotating."""
+    pdf_document = fitz.open(stream=pdf_bytes, filetype='pdf')
+    elapsed = 0
+    for page in pdf_document:
+        _, annotations = extract_text_info.extract_page(page)
+        t0 = time.perf_counter()
+        annotate(page, annotations)
+        elapsed += time.perf_counter() - t0
+    return fitz.open(stream=pdf_document.tobytes(), filetype='pdf'), elapsed
+
+
+def annots_of(page):
+    return [
+        (annot.type[1], tuple(round(v, 3) for v in annot.rect), annot.info['content'], annot.info['name'], annot.colors['stroke'], annot.opacity)
+        for annot in page.annots()
+    ]
+
+
+def run(name, pdf_bytes, failures):
+    legacy_document, legacy_elapsed = annotated(pdf_bytes, legacy_annotate_page)
+    pdf_document, elapsed = annotated(pdf_bytes, extract_text_info.annotate_page)
+    n_annots = 0
+    for legacy_page, page in zip(legacy_document, pdf_document):
+        n_annots += len(annots_of(page))
+        legacy_pixels = np.frombuffer(legacy_page.get_pixmap().samples, dtype=np.uint8)
+        pixels = np.frombuffer(page.get_pixmap().samples, dtype=np.uint8)
+        if annots_of(legacy_page) != annots_of(page) or not np.array_equal(legacy_pixels, pixels):
+            failures.append((name, page.number))
+            print(f"  {name} page {page.number + 1}: MISMATCH")
+    print(f"  {name:28s} annots: {n_annots:5d}  legacy: {legacy_elapsed:7.3f}s  annotate_page: {elapsed:7.3f}s  ({legacy_elapsed / elapsed:5.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the annotation of the text blocks.')
+    parser.add_argument('input_pdf', nargs='*', default=[SAMPLE_PDF], help='PDF files to process. Defaults to the bundled sample.')
+    parser.add_argument('--synthetic_lines', type=int, nargs='*', default=DEFAULT_SYNTHETIC_LINES, help='Lines per page of the synthetic documents.')
+    parser.add_argument('--synthetic_pages', type=int, default=DEFAULT_SYNTHETIC_PAGES)
+    args = parser.parse_args()
+
+    logging_level = extract_text_info.logger.level
+    extract_text_info.logger.setLevel('INFO')
+    failures = []
+    for input_pdf in args.input_pdf:
+        with open(input_pdf, 'rb') as f:
+            run(os.path.basename(input_pdf), f.read(), failures)
+    for n_lines in args.synthetic_lines:
+        pdf_bytes = synthetic_pdf(args.synthetic_pages, n_lines).tobytes()
+        run(f"synthetic {n_lines} lines/page", pdf_bytes, failures)
+    extract_text_info.logger.setLevel(logging_level)
+
+    if failures:
+        print(f"\n{len(failures)} mismatch(es) found")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
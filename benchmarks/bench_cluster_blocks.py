@@ -0,0 +1,190 @@
+"""Benchmark cluster_blocks() on synthetic pages and check it against the
+previous (quadratic) implementation.
+
+Pages are laid out as text in columns, or as a single row of spans, which
+puts every span in the same horizontal band.
+
+Usage:
+    python benchmarks/bench_cluster_blocks.py [--sizes 1000 5000 ...] [--layouts text row]
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_text_info  # noqa: E402
+
+
+DEFAULT_SIZES = [1000, 2000, 5000, 10000, 20000, 50000]
+DEFAULT_LEGACY_MAX_SIZE = 5000
+DEFAULT_TOLERANCES = [(1, 1), (0, 3), (3, 3)]
+DEFAULT_SEED = 0
+
+
+def legacy_cluster_blocks(page, clip=None, blocks=None, x_tolerance=3, y_tolerance=3):
+    """The rescan-loop implementation cluster_blocks() was adapted from."""
+    parea = page.rect
+    if clip is not None:
+        parea = fitz.Rect(clip)
+    delta_x = x_tolerance
+    delta_y = y_tolerance
+
+    def are_neighbors(r1, r2):
+        rr1_x0, rr1_x1 = (r1.x0, r1.x1) if r1.x1 > r1.x0 else (r1.x1, r1.x0)
+        rr1_y0, rr1_y1 = (r1.y0, r1.y1) if r1.y1 > r1.y0 else (r1.y1, r1.y0)
+        rr2_x0, rr2_x1 = (r2.x0, r2.x1) if r2.x1 > r2.x0 else (r2.x1, r2.x0)
+        rr2_y0, rr2_y1 = (r2.y0, r2.y1) if r2.y1 > r2.y0 else (r2.y1, r2.y0)
+        return not (
+            rr1_x1 < rr2_x0 - delta_x
+            or rr1_x0 > rr2_x1 + delta_x
+            or rr1_y1 < rr2_y0 - delta_y
+            or rr1_y0 > rr2_y1 + delta_y
+        )
+
+    rects = [fitz.Rect(b['bbox']) for b in blocks]
+    prects = sorted(
+        [r for r in rects if r.x0 >= parea.x0 and r.x1 <= parea.x1 and r.y0 >= parea.y0 and r.y1 <= parea.y1],
+        key=lambda r: (r.y1, r.x0),
+    )
+
+    new_rects = []
+    while prects:
+        r = +prects[0]
+        repeat = True
+        while repeat:
+            repeat = False
+            for i in range(len(prects) - 1, 0, -1):
+                if are_neighbors(prects[i], r):
+                    r |= prects[i].tl
+                    r |= prects[i].br
+                    del prects[i]
+                    repeat = True
+
+        new_rects.append(r)
+        del prects[0]
+        prects = sorted(set(prects), key=lambda r: (r.y1, r.x0))
+
+    new_rects = sorted(set(new_rects), key=lambda r: (r.y1, r.x0))
+    return [r for r in new_rects if r.width > delta_x and r.height > delta_y]
+
+
+def _q(v):
+    # keep coordinates exactly representable in single precision, like MuPDF's
+    return round(v * 64) / 64
+
+
+def synthetic_spans(n_spans, seed=DEFAULT_SEED):
+    """Build a page size and `n_spans` span-like dicts laid out as text.
+
+    Spans are arranged in one to four columns of paragraphs made of lines of
+    words, with a sprinkle of table-like cells and stray marks.
+    """
+    rng = random.Random(seed)
+    n_columns = rng.choice([1, 2, 2, 3, 4])
+    font_size = rng.choice([6, 7, 8, 9, 10])
+    line_height = font_size * 1.2
+    column_width = 250
+    words_per_line = max(1, int(column_width / (font_size * 3.5)))
+    lines_per_column = max(1, -(-n_spans // (words_per_line * n_columns)))
+    width = 40 + n_columns * (column_width + 20)
+    height = 40 + lines_per_column * line_height * 1.15
+
+    spans = []
+    for column in range(n_columns):
+        x_start = 20 + column * (column_width + 20)
+        y = 20.0
+        while len(spans) < n_spans * (column + 1) / n_columns:
+            x = x_start
+            if rng.random() < 0.08:  # paragraph break
+                y += line_height * rng.uniform(0.3, 1.5)
+            for _ in range(words_per_line):
+                word_width = font_size * rng.uniform(1.0, 5.0)
+                if x + word_width > x_start + column_width:
+                    break
+                gap = font_size * rng.choice([0.0, 0.3, 0.3, 0.3, 2.0])
+                bbox = (_q(x), _q(y), _q(x + word_width), _q(y + font_size * 1.15))
+                spans.append({'bbox': bbox, 'text': 'x'})
+                x += word_width + gap
+            y += line_height
+    return width, height, spans[:n_spans]
+
+
+def synthetic_row(n_spans, seed=DEFAULT_SEED):
+    """Build a page size and `n_spans` span-like dicts laid out in a single row."""
+    rng = random.Random(seed)
+    spans = []
+    x = 20.0
+    for _ in range(n_spans):
+        word_width = rng.uniform(5.0, 30.0)
+        spans.append({'bbox': (_q(x), 20.0, _q(x + word_width), 30.0), 'text': 'x'})
+        x += word_width + rng.choice([0.0, 0.5, 2.0, 5.0])
+    return x + 20, 50, spans
+
+
+LAYOUTS = {'text': synthetic_spans, 'row': synthetic_row}
+
+
+def _as_tuples(rects):
+    return [tuple(r) for r in rects]
+
+
+def check_equivalence(sizes, tolerances, layouts, seed=DEFAULT_SEED):
+    doc = fitz.open()
+    failures = 0
+    for layout, n_spans in itertools.product(layouts, sizes):
+        for s in range(seed, seed + 3):
+            width, height, spans = LAYOUTS[layout](n_spans, seed=s)
+            page = doc.new_page(width=width, height=height)
+            for x_tolerance, y_tolerance in tolerances:
+                expected = legacy_cluster_blocks(page, blocks=spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
+                actual = extract_text_info.cluster_blocks(page, blocks=spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
+                ok = sorted(_as_tuples(expected)) == sorted(_as_tuples(actual))
+                failures += not ok
+                print(f"  {layout:4s}  spans: {n_spans:6d}  seed: {s}  tol: {x_tolerance}/{y_tolerance}  clusters: {len(actual):5d}  {'OK' if ok else 'MISMATCH'}")
+    return failures
+
+
+def run_benchmark(sizes, tolerances, layouts, legacy_max_size, seed=DEFAULT_SEED):
+    doc = fitz.open()
+    for layout, n_spans in itertools.product(layouts, sizes):
+        width, height, spans = LAYOUTS[layout](n_spans, seed=seed)
+        page = doc.new_page(width=width, height=height)
+        for x_tolerance, y_tolerance in tolerances:
+            t0 = time.perf_counter()
+            rects = extract_text_info.cluster_blocks(page, blocks=spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
+            new_time = time.perf_counter() - t0
+            legacy = '       -'
+            if n_spans <= legacy_max_size:
+                t0 = time.perf_counter()
+                legacy_cluster_blocks(page, blocks=spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
+                legacy = f"{time.perf_counter() - t0:8.3f}"
+            print(f"  {layout:4s}  spans: {n_spans:6d}  tol: {x_tolerance}/{y_tolerance}  clusters: {len(rects):5d}  cluster_blocks: {new_time:8.3f}s  legacy: {legacy}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cluster_blocks() on synthetic pages.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Number of spans per synthetic page.')
+    parser.add_argument('--legacy_max_size', type=int, default=DEFAULT_LEGACY_MAX_SIZE, help='Largest page to also time with the legacy implementation.')
+    parser.add_argument('--check_sizes', type=int, nargs='*', default=[10, 100, 500, 2000], help='Page sizes to check against the legacy implementation.')
+    parser.add_argument('--layouts', nargs='+', choices=sorted(LAYOUTS), default=list(LAYOUTS), help='Layouts of the synthetic pages.')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    print("Equivalence with the legacy implementation:")
+    failures = check_equivalence(args.check_sizes, DEFAULT_TOLERANCES, args.layouts, seed=args.seed)
+    print()
+    print("Timings:")
+    run_benchmark(args.sizes, DEFAULT_TOLERANCES, args.layouts, args.legacy_max_size, seed=args.seed)
+
+    if failures:
+        print(f"\n{failures} mismatch(es) found")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compare how clustered blocks are built: clipping the page text again for
+each clustered rect, or assigning the already extracted spans to them.
+
+Both ways must give the same output. The number of get_text() calls per page
+goes from K+1 (K clustered rects) to 1, plus one for each rect that cannot be
+built from the page spans.
+
+Usage:
+    python benchmarks/bench_cluster_extraction.py [input_pdf ...]
+"""
+import argparse
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_text_info  # noqa: E402
+from synthetic import synthetic_pdf  # noqa: E402
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'AITranslate_1_1723115119.pdf')
+DEFAULT_SYNTHETIC_LINES = [20, 60, 120, 240]
+DEFAULT_SYNTHETIC_PAGES = 4
+MODES = {
+    'blocks 0/3': dict(use_clustered_blocks=True, use_clustered_spans=False, x_tolerance=0, y_tolerance=3),
+    'spans 0/0': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=0, y_tolerance=0),
+    'spans 0/1': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=0, y_tolerance=1),
+    'spans 0/3': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=0, y_tolerance=3),
+    'spans .5/.5': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=0.5, y_tolerance=0.5),
+    'spans 1/1': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=1, y_tolerance=1),
+    'spans 3/3': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=3, y_tolerance=3),
+}
+
+
+class GetTextCounter:
+    """Count the calls to Page.get_text() while active."""
+
+    def __init__(self):
+        self.calls = 0
+        self._get_text = fitz.Page.get_text
+
+    def __enter__(self):
+        counter = self
+
+        def get_text(page, *args, **kwargs):
+            counter.calls += 1
+            return counter._get_text(page, *args, **kwargs)
+
+        fitz.Page.get_text = get_text
+        return self
+
+    def __exit__(self, *exc_info):
+        fitz.Page.get_text = self._get_text
+
+
+def run(name, pdf_bytes, failures):
+    for mode_name, mode in MODES.items():
+        results = {}
+        for reuse_extracted_text in (False, True):
+            pdf_document = fitz.open(stream=pdf_bytes, filetype='pdf')
+            with GetTextCounter() as counter:
+                t0 = time.perf_counter()
+                pdf_data, _ = extract_text_info.highlight_sentences_in_pdf(pdf_document, reuse_extracted_text=reuse_extracted_text, **mode)
+                elapsed = time.perf_counter() - t0
+            results[reuse_extracted_text] = pdf_data
+            n_pages = len(pdf_data)
+            print(
+                f"  {name:24s} {mode_name:11s} reuse_extracted_text: {str(reuse_extracted_text):5s}"
+                f"  get_text/page: {counter.calls / n_pages:7.2f}  time: {elapsed:7.3f}s"
+            )
+        if results[False] != results[True]:
+            failures.append((name, mode_name))
+            print(f"  {name} {mode_name}: OUTPUT MISMATCH")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the construction of clustered blocks.')
+    parser.add_argument('input_pdf', nargs='*', default=[SAMPLE_PDF], help='PDF files to process. Defaults to the bundled sample.')
+    parser.add_argument('--synthetic_lines', type=int, nargs='*', default=DEFAULT_SYNTHETIC_LINES, help='Lines per page of the synthetic documents.')
+    parser.add_argument('--synthetic_pages', type=int, default=DEFAULT_SYNTHETIC_PAGES)
+    args = parser.parse_args()
+
+    logging_level = extract_text_info.logger.level
+    extract_text_info.logger.setLevel('INFO')
+    failures = []
+    for input_pdf in args.input_pdf:
+        with open(input_pdf, 'rb') as f:
+            run(os.path.basename(input_pdf), f.read(), failures)
+    for n_lines in args.synthetic_lines:
+        pdf_bytes = synthetic_pdf(args.synthetic_pages, n_lines).tobytes()
+        run(f"synthetic {n_lines} lines/page", pdf_bytes, failures)
+    extract_text_info.logger.setLevel(logging_level)
+
+    if failures:
+        print(f"\n{len(failures)} mismatch(es) found")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
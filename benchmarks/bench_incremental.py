@@ -0,0 +1,92 @@
+"""Time the extraction of a new version of a document, with and without
+the page results of the previous version.
+
+The new version amends one page of the document and is saved again with
+its objects renumbered and deduplicated, like an editor would. With the
+page results of the first version (see extract_text_info.iter_highlighted_pages()),
+only the amended page is extracted again. Both runs must give the same
+output, annotations included.
+
+Usage:
+    python benchmarks/bench_incremental.py [--pages 300] [--lines 60] [--amended_page 17]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_text_info  # noqa: E402
+from result_cache import ResultCache  # noqa: E402
+from synthetic import synthetic_pdf  # noqa: E402
+
+
+DEFAULT_PAGES = 300
+DEFAULT_LINES = 60
+DEFAULT_AMENDED_PAGE = 17
+
+
+def amend(pdf_bytes, page_number):
+    """Return a new version of a document, with a line added to one page."""
+    pdf_document = fitz.open(stream=pdf_bytes, filetype='pdf')
+    pdf_document[page_number].insert_text((72, 40), 'Amendment 1: this page was revised.', fontname='helv', fontsize=9)
+    return pdf_document.tobytes(garbage=3)
+
+
+def extract(pdf_bytes, page_results):
+    pdf_document = fitz.open(stream=pdf_bytes, filetype='pdf')
+    timings = {}
+    t0 = time.perf_counter()
+    pdf_data, _ = extract_text_info.highlight_sentences_in_pdf(pdf_document, pages=None, annotate=True, page_results=page_results, timings=timings)
+    elapsed = time.perf_counter() - t0
+    # serialized like the API does, and rendered, to compare the annotations too
+    output = json.dumps(pdf_data, sort_keys=True)
+    pixmaps = [page.get_pixmap(dpi=36).samples for page in fitz.open(stream=pdf_document.tobytes(), filetype='pdf')]
+    pdf_document.close()
+    return (output, pixmaps), elapsed, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the extraction of a new version of a document with the page results of the previous one.')
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES, help='Pages of the synthetic document.')
+    parser.add_argument('--lines', type=int, default=DEFAULT_LINES, help='Lines per page of the synthetic document.')
+    parser.add_argument('--amended_page', type=int, default=DEFAULT_AMENDED_PAGE, help='0-based page changed by the new version.')
+    args = parser.parse_args()
+
+    logging_level = extract_text_info.logger.level
+    extract_text_info.logger.setLevel('INFO')
+    v1 = synthetic_pdf(args.pages, args.lines).tobytes()
+    v2 = amend(v1, args.amended_page)
+
+    page_results = ResultCache()
+    _, first_elapsed, _ = extract(v1, page_results)
+    print(f"  v1 {args.pages} pages, no page results:   {first_elapsed:7.3f}s")
+    output, elapsed, _ = extract(v2, None)
+    print(f"  v2 {args.pages} pages, no page results:   {elapsed:7.3f}s")
+    hits = page_results.info()['hits']
+    incremental_output, incremental_elapsed, timings = extract(v2, page_results)
+    hits = page_results.info()['hits'] - hits
+    print(
+        f"  v2 {args.pages} pages, v1 page results:   {incremental_elapsed:7.3f}s  ({elapsed / incremental_elapsed:4.1f}x)"
+        f"  {hits} pages reused  fingerprints: {timings.get('fingerprint', 0):.3f}s"
+    )
+    extract_text_info.logger.setLevel(logging_level)
+
+    failures = []
+    if hits != args.pages - 1:
+        failures.append(f"{hits} pages reused instead of {args.pages - 1}")
+    if incremental_output[0] != output[0]:
+        failures.append("OUTPUT MISMATCH")
+    if incremental_output[1] != output[1]:
+        failures.append("ANNOTATIONS MISMATCH")
+    if failures:
+        print('\n' + '\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Time a sweep of clustering params over the same document, with and
+without a PageCache.
+
+Without the cache every combination runs get_text("dict") and
+get_image_info() on every page again; with it only the first one does, and
+the others rerun the clustering and the model building alone. Both must
+give the same output.
+
+Usage:
+    python benchmarks/bench_page_cache.py [input_pdf ...] [--workers 1]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_text_info  # noqa: E402
+from synthetic import synthetic_pdf  # noqa: E402
+
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'AITranslate_1_1723115119.pdf')
+DEFAULT_SYNTHETIC_LINES = [60, 240]
+DEFAULT_SYNTHETIC_PAGES = 8
+SWEEP = (
+    [dict(use_clustered_blocks=False, use_clustered_spans=False, x_tolerance=0, y_tolerance=0)]
+    + [dict(use_clustered_blocks=True, use_clustered_spans=False, x_tolerance=x, y_tolerance=y) for x, y in ((0, 3), (1, 1), (3, 3))]
+    + [dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=x, y_tolerance=y) for x in (0, 1, 2, 3) for y in (1, 3)]
+)
+
+
+def sweep(pdf_bytes, page_cache, workers):
+    doc_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    outputs = []
+    t0 = time.perf_counter()
+    for params in SWEEP:
+        pdf_document = fitz.open(stream=pdf_bytes, filetype='pdf')
+        pdf_data, _ = extract_text_info.highlight_sentences_in_pdf(pdf_document, workers=workers, pdf_source=pdf_bytes, pages=None, page_cache=page_cache, doc_hash=doc_hash, **params)
+        pdf_document.close()
+        outputs.append(pdf_data)
+    return outputs, time.perf_counter() - t0
+
+
+def run(name, pdf_bytes, workers, failures):
+    outputs, elapsed = sweep(pdf_bytes, None, workers)
+    page_cache = extract_text_info.PageCache()
+    cached_outputs, cached_elapsed = sweep(pdf_bytes, page_cache, workers)
+    print(
+        f"  {name:28s} {len(SWEEP)} combinations  no cache: {elapsed:7.3f}s"
+        f"  page cache: {cached_elapsed:7.3f}s  ({elapsed / cached_elapsed:4.1f}x)  {page_cache.info()}"
+    )
+    if outputs != cached_outputs:
+        failures.append(name)
+        print(f"  {name}: OUTPUT MISMATCH")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a clustering params sweep with and without a page cache.')
+    parser.add_argument('input_pdf', nargs='*', default=[SAMPLE_PDF], help='PDF files to process. Defaults to the bundled sample.')
+    parser.add_argument('--synthetic_lines', type=int, nargs='*', default=DEFAULT_SYNTHETIC_LINES, help='Lines per page of the synthetic documents.')
+    parser.add_argument('--synthetic_pages', type=int, default=DEFAULT_SYNTHETIC_PAGES)
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes used by each run.')
+    args = parser.parse_args()
+
+    logging_level = extract_text_info.logger.level
+    extract_text_info.logger.setLevel('INFO')
+    failures = []
+    for input_pdf in args.input_pdf:
+        with open(input_pdf, 'rb') as f:
+            run(os.path.basename(input_pdf), f.read(), args.workers, failures)
+    for n_lines in args.synthetic_lines:
+        pdf_bytes = synthetic_pdf(args.synthetic_pages, n_lines).tobytes()
+        run(f"synthetic {n_lines} lines/page", pdf_bytes, args.workers, failures)
+    extract_text_info.logger.setLevel(logging_level)
+
+    if failures:
+        print(f"\n{len(failures)} mismatch(es) found")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
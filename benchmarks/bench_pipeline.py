@@ -0,0 +1,188 @@
+"""Benchmark suite of the extraction pipeline, stage by stage.
+
+Times each stage of highlight_sentences_in_pdf() (see
+extract_text_info.STAGES): image info, get_text, cluster_blocks, per-cluster
+text re-extraction, model building and annotation, across clustering modes
+and tolerances, on the bundled PDF and on synthetic PDFs of increasing span
+density and page count.
+
+Usage:
+    # run the suite, writing the results as JSON
+    python benchmarks/bench_pipeline.py run [--output results.json] [--repeat 3] [--quick]
+
+    # flag the stages slower in new.json than in base.json by more than 10%
+    python benchmarks/bench_pipeline.py compare base.json new.json [--threshold 0.1]
+
+    # profile a single run, dumping pstats output (snakeviz, gprof2dot, flameprof...)
+    python benchmarks/bench_pipeline.py profile [--document synthetic-4x240] [--mode "spans 1/1"] [--output pipeline.prof]
+"""
+import argparse
+import cProfile
+import datetime
+import json
+import os
+import platform
+import pstats
+import subprocess
+import sys
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_text_info  # noqa: E402
+from synthetic import synthetic_pdf  # noqa: E402
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PDF = os.path.join(ROOT, 'AITranslate_1_1723115119.pdf')
+MODES = {
+    'plain': dict(use_clustered_blocks=False, use_clustered_spans=False),
+    'blocks 0/3': dict(use_clustered_blocks=True, use_clustered_spans=False, x_tolerance=0, y_tolerance=3),
+    'blocks 3/3': dict(use_clustered_blocks=True, use_clustered_spans=False, x_tolerance=3, y_tolerance=3),
+    'spans 1/1': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=1, y_tolerance=1),
+    'spans 3/3': dict(use_clustered_blocks=False, use_clustered_spans=True, x_tolerance=3, y_tolerance=3),
+    'auto': dict(use_auto_clustering=True),
+}
+# synthetic documents, as (pages, lines per page)
+SYNTHETIC_DOCUMENTS = [(4, 20), (4, 60), (4, 240), (16, 60)]
+QUICK_SYNTHETIC_DOCUMENTS = [(2, 60)]
+QUICK_MODES = ['plain', 'blocks 0/3', 'spans 1/1', 'auto']
+# a stage is only flagged when slower by this many seconds as well
+DEFAULT_MIN_DELTA = 0.005
+
+
+def document(name):
+    """Return the bytes of 'sample' or of a 'synthetic-<pages>x<lines per page>' document."""
+    if name == 'sample':
+        with open(SAMPLE_PDF, 'rb') as f:
+            return f.read()
+    n_pages, n_lines = name.removeprefix('synthetic-').split('x')
+    return synthetic_pdf(int(n_pages), int(n_lines)).tobytes()
+
+
+def documents(quick=False):
+    """Return the names of the benchmarked documents."""
+    return ['sample'] + [f'synthetic-{n_pages}x{n_lines}' for n_pages, n_lines in (QUICK_SYNTHETIC_DOCUMENTS if quick else SYNTHETIC_DOCUMENTS)]
+
+
+def run_once(pdf_bytes, mode):
+    pdf_document = fitz.open(stream=pdf_bytes, filetype='pdf')
+    timings = {}
+    t0 = time.perf_counter()
+    pdf_data, _ = extract_text_info.highlight_sentences_in_pdf(pdf_document, pages=None, timings=timings, annotate=True, images='metadata', **mode)
+    timings['total'] = time.perf_counter() - t0
+    n_spans = sum(len(page['texts_models_list']) for page in pdf_data)
+    pdf_document.close()
+    return timings, len(pdf_data), n_spans
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "date": datetime.datetime.now().isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run(args):
+    modes = QUICK_MODES if args.quick else list(MODES)
+    results = []
+    for doc_name in documents(args.quick):
+        pdf_bytes = document(doc_name)
+        for mode_name in modes:
+            runs = [run_once(pdf_bytes, MODES[mode_name]) for _ in range(args.repeat)]
+            # the fastest of the runs, stage by stage
+            stages = {stage: min(timings.get(stage, 0.0) for timings, _, _ in runs) for stage in extract_text_info.STAGES + ('total',)}
+            _, n_pages, n_spans = runs[0]
+            results.append({"document": doc_name, "mode": mode_name, "pages": n_pages, "spans": n_spans, "stages": stages})
+            print(f"  {doc_name:20s} {mode_name:11s} pages: {n_pages:3d}  spans: {n_spans:6d}  " + "  ".join(f"{stage}: {seconds:7.3f}s" for stage, seconds in stages.items()))
+
+    with open(args.output, 'w') as f:
+        json.dump({"environment": environment(), "repeat": args.repeat, "results": results}, f, indent=2)
+    print(f"Results saved as: {args.output}")
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = {(r["document"], r["mode"]): r["stages"] for r in json.load(f)["results"]}
+    with open(args.new) as f:
+        new = {(r["document"], r["mode"]): r["stages"] for r in json.load(f)["results"]}
+
+    regressions = []
+    for key in sorted(base.keys() & new.keys()):
+        for stage, base_seconds in base[key].items():
+            new_seconds = new[key].get(stage)
+            if new_seconds is None:
+                continue
+            ratio = new_seconds / base_seconds if base_seconds else float('inf')
+            flagged = new_seconds - base_seconds > args.min_delta and ratio > 1 + args.threshold
+            if flagged or args.verbose:
+                print(f"  {'REGRESSION' if flagged else '':10s} {key[0]:20s} {key[1]:11s} {stage:14s} {base_seconds:8.3f}s -> {new_seconds:8.3f}s  ({ratio:5.2f}x)")
+            if flagged:
+                regressions.append((key, stage))
+    for key in sorted(base.keys() ^ new.keys()):
+        print(f"  skipped {key[0]} {key[1]}: only in {'base' if key in base else 'new'}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+    print(f"No regression beyond {args.threshold:.0%}")
+
+
+def profile(args):
+    pdf_bytes = document(args.document)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    timings, n_pages, n_spans = run_once(pdf_bytes, MODES[args.mode])
+    profiler.disable()
+    profiler.dump_stats(args.output)
+    print(f"{args.document} {args.mode}: pages: {n_pages}  spans: {n_spans}  " + "  ".join(f"{stage}: {seconds:.3f}s" for stage, seconds in timings.items()))
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(args.top)
+    print(f"Profile saved as: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the extraction pipeline stage by stage.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the suite.')
+    run_parser.add_argument('--output', default='bench_pipeline.json', help='JSON file the results are written to.')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs of each case; the fastest is kept.')
+    run_parser.add_argument('--quick', action='store_true', help='Fewer documents and modes.')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files.')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='Slowdown ratio above which a stage is flagged.')
+    compare_parser.add_argument('--min_delta', type=float, default=DEFAULT_MIN_DELTA, help='Slowdown in seconds below which a stage is never flagged.')
+    compare_parser.add_argument('--verbose', action='store_true', help='Print all the stages, not only the regressions.')
+    compare_parser.set_defaults(func=compare)
+
+    profile_parser = subparsers.add_parser('profile', help='Profile a single run with cProfile.')
+    profile_parser.add_argument('--document', default='sample', help="'sample' or one of the synthetic documents, like 'synthetic-4x240'.")
+    profile_parser.add_argument('--mode', default='spans 1/1', choices=list(MODES))
+    profile_parser.add_argument('--output', default='bench_pipeline.prof', help='pstats file the profile is written to.')
+    profile_parser.add_argument('--top', type=int, default=25, help='Functions printed, by cumulative time.')
+    profile_parser.set_defaults(func=profile)
+
+    args = parser.parse_args()
+    logging_level = extract_text_info.logger.level
+    extract_text_info.logger.setLevel('INFO')
+    args.func(args)
+    extract_text_info.logger.setLevel(logging_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Compare the serialization of the output with the legacy json.dumps() and HTML concatenation.
+
+The documents are made of the page_data of a synthetic PDF, repeated up to
+a number of text models (10k and more). JSON outputs must load to the same
+data, and HTML outputs be the legacy ones with the block text escaped.
+
+Usage:
+    python benchmarks/bench_serialization.py [--models 1000 10000 100000] [--synthetic_lines 240]
+"""
+import argparse
+import html
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_text_info  # noqa: E402
+import serialization  # noqa: E402
+from synthetic import synthetic_pdf  # noqa: E402
+
+
+DEFAULT_MODELS = [1000, 10000, 100000]
+DEFAULT_SYNTHETIC_LINES = 240
+DEFAULT_SYNTHETIC_PAGES = 4
+DEFAULT_REPEAT = 5
+
+
+def legacy_html_page(page):
+    """The HTML of a page as it was: concatenated and unescaped."""
+    output_data = f'<div class="page">Page {page["page_number"]}</div>'
+    for text_idx, block in enumerate(page["blocks"]):
+        output_data += f'<div class="text-caption">#{text_idx + 1}</div>'
+        output_data += f'<div class="text">{block["text"]}</div>'
+    return output_data
+
+
+def repeated_pages(pages_data, n_models):
+    """Return the pages of `pages_data`, repeated and numbered in sequence, up to `n_models` text models."""
+    pages = []
+    while sum(len(page["texts_models_list"]) for page in pages) < n_models:
+        page = pages_data[len(pages) % len(pages_data)]
+        pages.append(dict(page, page_number=len(pages) + 1))
+    return pages
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return result, min(times)
+
+
+def stdlib_dumps(obj):
+    """serialization.dumps() without orjson."""
+    orjson, serialization.orjson = serialization.orjson, None
+    try:
+        return serialization.dumps(obj)
+    finally:
+        serialization.orjson = orjson
+
+
+def run(name, pages_data, repeat, failures):
+    n_models = sum(len(page["texts_models_list"]) for page in pages_data)
+    legacy_json, legacy_json_time = best_time(lambda: json.dumps(pages_data), repeat)
+    stdlib_json, stdlib_json_time = best_time(lambda: stdlib_dumps(pages_data), repeat)
+    fast_json, fast_json_time = best_time(lambda: serialization.dumps(pages_data), repeat)
+    if not json.loads(legacy_json) == json.loads(stdlib_json) == json.loads(fast_json):
+        failures.append((name, 'json'))
+        print(f"  {name} json: MISMATCH")
+
+    legacy_html, legacy_html_time = best_time(lambda: ''.join(legacy_html_page(page) for page in pages_data), repeat)
+    new_html, html_time = best_time(lambda: ''.join(serialization.html_page(page) for page in pages_data), repeat)
+    escaped_pages = [dict(page, blocks=[dict(block, text=html.escape(block["text"])) for block in page["blocks"]]) for page in pages_data]
+    if new_html != ''.join(legacy_html_page(page) for page in escaped_pages):
+        failures.append((name, 'html'))
+        print(f"  {name} html: MISMATCH")
+
+    print(
+        f"  {name:10s} models: {n_models:6d}  json.dumps: {legacy_json_time:7.4f}s  stdlib dumps: {stdlib_json_time:7.4f}s"
+        f"  {'orjson' if serialization.orjson else 'dumps'}: {fast_json_time:7.4f}s ({legacy_json_time / fast_json_time:5.1f}x)"
+        f"  legacy html: {legacy_html_time:7.4f}s  html_page: {html_time:7.4f}s ({legacy_html_time / html_time:5.1f}x)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the serialization of the extraction output.')
+    parser.add_argument('--models', type=int, nargs='*', default=DEFAULT_MODELS, help='Text models of the documents.')
+    parser.add_argument('--synthetic_lines', type=int, default=DEFAULT_SYNTHETIC_LINES, help='Lines per page of the synthetic PDF.')
+    parser.add_argument('--synthetic_pages', type=int, default=DEFAULT_SYNTHETIC_PAGES, help='Pages of the synthetic PDF.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs of each case; the fastest is kept.')
+    args = parser.parse_args()
+
+    logging_level = extract_text_info.logger.level
+    extract_text_info.logger.setLevel('INFO')
+    if serialization.orjson is None:
+        print("orjson is not installed: only the stdlib path is benchmarked")
+    failures = []
+    pdf_document = synthetic_pdf(args.synthetic_pages, args.synthetic_lines)
+    pages_data, _ = extract_text_info.highlight_sentences_in_pdf(pdf_document, pages=None)
+    for n_models in args.models:
+        pages = repeated_pages(pages_data, n_models)
+        run(f"{len(pages)} pages", pages, args.repeat, failures)
+    extract_text_info.logger.setLevel(logging_level)
+
+    if failures:
+        print(f"\n{len(failures)} mismatch(es) found")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Time command line extractions of small PDFs, cold and on warm workers.
+
+A cold run starts `python extract_text_info.py`, paying for the interpreter
+and the imports of PyMuPDF and numpy on each file. A warm run sends the
+file to a `warm_worker.py serve` started once, with the client of
+warm_worker.py, and the files are extracted again on a second round, with
+their documents still open in the workers. Every run must write the same
+JSON data.
+
+Usage:
+    python benchmarks/bench_warm_worker.py [--files 10] [--pages 2] [--lines 40] [--workers 2]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic import synthetic_pdf  # noqa: E402
+
+
+DEFAULT_FILES = 10
+DEFAULT_PAGES = 2
+DEFAULT_LINES = 40
+DEFAULT_WORKERS = 2
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_TIMEOUT = 30  # seconds
+
+
+def run(*args):
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+
+def read_outputs(paths):
+    outputs = []
+    for path in paths:
+        with open(os.path.splitext(path)[0] + '_highlighted.json', 'rb') as f:
+            outputs.append(f.read())
+        os.remove(os.path.splitext(path)[0] + '_highlighted.json')
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold command line extractions against the warm worker pool.')
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES, help='Number of PDF files extracted.')
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES, help='Pages of each synthetic document.')
+    parser.add_argument('--lines', type=int, default=DEFAULT_LINES, help='Lines per page of each synthetic document.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Warm worker processes.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(args.files):
+            paths.append(os.path.join(directory, f'doc{i}.pdf'))
+            synthetic_pdf(args.pages, args.lines, seed=i).save(paths[-1])
+
+        cold = sum(run('extract_text_info.py', path, '--pages', '1-') for path in paths)
+        cold_outputs = read_outputs(paths)
+        print(f"  {f'{args.files} files, cold CLI:':34s}{cold:7.3f}s  ({cold / args.files * 1000:6.1f}ms per file)")
+
+        socket_path = os.path.join(directory, 'warm.sock')
+        t0 = time.perf_counter()
+        server = subprocess.Popen([sys.executable, 'warm_worker.py', '--socket', socket_path, 'serve', '--workers', str(args.workers)], cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                if server.poll() is not None or time.perf_counter() - t0 > STARTUP_TIMEOUT:
+                    sys.exit("The warm worker server did not start")
+                time.sleep(0.05)
+            print(f"  {'server startup:':34s}{time.perf_counter() - t0:7.3f}s")
+
+            results = []
+            for round_name in ('warm', 'warm, documents open'):
+                elapsed = sum(run('warm_worker.py', '--socket', socket_path, 'extract', path, '--pages', '1-') for path in paths)
+                results.append(read_outputs(paths))
+                print(f"  {f'{args.files} files, {round_name}:':34s}{elapsed:7.3f}s  ({elapsed / args.files * 1000:6.1f}ms per file, {cold / elapsed:4.1f}x)")
+        finally:
+            server.terminate()
+            server.wait()
+
+    failures = [f"OUTPUT MISMATCH ({round_name})" for round_name, outputs in zip(('warm', 'documents open'), results) if outputs != cold_outputs]
+    if failures:
+        print('\n' + '\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
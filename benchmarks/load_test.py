@@ -0,0 +1,133 @@
+"""Load test of the /extract_text endpoint against a local stub file server.
+
+Starts a stub HTTP server serving the PDF (with an optional delay before
+each response, to simulate slow downloads) and the FastAPI app with
+uvicorn, then fires concurrent requests at it. Latency percentiles are
+reported for /extract_text and for the / health check polled meanwhile.
+
+Usage:
+    python benchmarks/load_test.py [--requests 40] [--concurrency 8] [--delay 0.5] [--cache]
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import os
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_PDF = os.path.join(ROOT, 'AITranslate_1_1723115119.pdf')
+STUB_PORT = 8701
+APP_PORT = 8702
+
+
+class StubHandler(http.server.SimpleHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(directory, delay):
+    handler = functools.partial(type('Handler', (StubHandler,), {'delay': delay}), directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', STUB_PORT), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app_server():
+    import main
+    main.logger.setLevel('INFO')
+    server = uvicorn.Server(uvicorn.Config(main.app, host='127.0.0.1', port=APP_PORT, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentiles(values):
+    if not values:
+        return "-"
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p / 100 * len(values)))]
+    return f"p50: {pick(50) * 1000:8.1f}ms  p90: {pick(90) * 1000:8.1f}ms  p99: {pick(99) * 1000:8.1f}ms  max: {values[-1] * 1000:8.1f}ms"
+
+
+async def run_load(n_requests, concurrency, params):
+    url = f"http://127.0.0.1:{APP_PORT}/extract_text"
+    file_url = f"http://127.0.0.1:{STUB_PORT}/{os.path.basename(SAMPLE_PDF)}"
+    latencies = {}
+    health_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(timeout=600) as client:
+        async def one_request():
+            async with semaphore:
+                t0 = time.perf_counter()
+                response = await client.get(url, params=dict(file_url=file_url, **params))
+                latencies.setdefault(response.status_code, []).append(time.perf_counter() - t0)
+
+        async def health_check():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await client.get(f"http://127.0.0.1:{APP_PORT}/")
+                health_latencies.append(time.perf_counter() - t0)
+                await asyncio.sleep(0.05)
+
+        health = asyncio.create_task(health_check())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(n_requests)))
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await health
+
+    return latencies, health_latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /extract_text against a local stub file server.')
+    parser.add_argument('--requests', type=int, default=40, help='Total number of requests.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of requests in flight.')
+    parser.add_argument('--delay', type=float, default=0.5, help='Seconds the stub server waits before answering.')
+    parser.add_argument('--output_type', type=int, default=0)
+    parser.add_argument('--pages', default='1-')
+    parser.add_argument('--cache', action='store_true', help='Keep the result cache on (every request after the first is then a hit).')
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ['PDF_RESULT_CACHE_SIZE'] = '0'
+        os.environ.pop('PDF_RESULT_CACHE_DIR', None)
+
+    start_stub_server(os.path.dirname(SAMPLE_PDF), args.delay)
+    app_server = start_app_server()
+    import main as app_main
+    print(f"max concurrency: {getattr(app_main, 'MAX_CONCURRENCY', '-')}  max queue: {getattr(app_main, 'MAX_QUEUE', '-')}")
+
+    latencies, health_latencies, elapsed = asyncio.run(run_load(
+        args.requests, args.concurrency, dict(output_type=args.output_type, pages=args.pages)))
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent, stub delay {args.delay}s: {elapsed:.2f}s")
+    for status, values in sorted(latencies.items()):
+        print(f"  /extract_text {status}: {len(values):4d}  {percentiles(values)}")
+    print(f"  / (health)        {len(health_latencies):4d}  {percentiles(health_latencies)}")
+    if len(latencies.get(200, [])) > 1:
+        print(f"  mean /extract_text 200 latency: {statistics.mean(latencies[200]) * 1000:.1f}ms")
+
+    app_server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
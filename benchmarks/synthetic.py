@@ -0,0 +1,63 @@
+"""Synthetic PDF documents for the benchmarks."""
+import random
+
+import fitz  # PyMuPDF
+
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud "
+    "exercitation ullamco laboris nisi aliquip ex ea commodo consequat 2023 42.5% "
+    "Innovation Index (GII) India's"
+).split()
+FONTS = ['helv', 'tiro', 'cour', 'hebo']
+
+DEFAULT_PAGE_SIZE = (595, 842)  # A4
+DEFAULT_SEED = 0
+
+
+def synthetic_page(page, n_lines, rng):
+    """Fill `page` with about `n_lines` lines of text.
+
+    Lines are laid out in one to three columns of paragraphs, with headings,
+    runs of mixed fonts on the same line and table-like rows.
+    """
+    n_columns = rng.choice([1, 2, 2, 3])
+    margin = 30
+    gutter = 15
+    column_width = (page.rect.width - 2 * margin - (n_columns - 1) * gutter) / n_columns
+    lines_per_column = max(1, -(-n_lines // n_columns))
+    line_height = max(4.0, (page.rect.height - 2 * margin) / lines_per_column)
+    font_size = min(11.0, line_height / 1.25)
+
+    for column in range(n_columns):
+        x_start = margin + column * (column_width + gutter)
+        y = margin + font_size
+        for line in range(lines_per_column):
+            if y > page.rect.height - margin:
+                break
+            x = x_start + (font_size if rng.random() < 0.1 else 0)
+            is_table_row = rng.random() < 0.1
+            while x < x_start + column_width:
+                fontname = rng.choice(FONTS) if rng.random() < 0.2 else FONTS[0]
+                n_words = 1 if is_table_row else rng.randint(1, 6)
+                text = " ".join(rng.choice(WORDS) for _ in range(n_words))
+                if rng.random() < 0.05:
+                    text = " " + text
+                text_width = fitz.get_text_length(text, fontname=fontname, fontsize=font_size)
+                if x + text_width > x_start + column_width:
+                    break
+                page.insert_text((x, y), text, fontname=fontname, fontsize=font_size)
+                x += text_width + (font_size * 2 if is_table_row else font_size * 0.3)
+            y += line_height * (1.6 if rng.random() < 0.08 else 1)
+
+
+def synthetic_pdf(n_pages, n_lines, seed=DEFAULT_SEED, page_size=DEFAULT_PAGE_SIZE):
+    """Return a new in-memory document of `n_pages` synthetic text pages."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(n_pages):
+        page = doc.new_page(width=page_size[0], height=page_size[1])
+        synthetic_page(page, n_lines, rng)
+    # reload, so that pages are parsed from their content streams
+    return fitz.open(stream=doc.tobytes(), filetype='pdf')
@@ -0,0 +1,153 @@
+"""Compact columnar encoding of the page_data returned by extract_text_info.
+
+In a page_data, each text model repeats its font family, style and color
+(as an int and as hex) and the bbox of its line. The compact form replaces
+`texts_models_list` with a "texts" entry holding one array per column,
+fonts and styles interned in tables, and line bboxes in a table the spans
+refer to:
+
+    "texts": {
+        "fonts": ["Helvetica-Bold", ...],
+        "styles": ["bold", ...],
+        "lines": [[left, top, end_left, end_top], ...],
+        "columns": {
+            "block": [...], "text": [...], "size": [...], "font": [...],
+            "color": [...], "style": [...], "line": [...],
+        },
+    }
+
+Everything else in a page_data is kept as is. decode() expands a compact
+document back to the list of page_data, identical to the original one.
+to_msgpack() / from_msgpack() give the binary form, where numeric columns
+are packed as little-endian arrays.
+"""
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # binary output unavailable
+    msgpack = None
+
+
+FORMAT = 'columnar-v1'
+
+
+def encode_page(page_data):
+    """Return the compact form of a page_data."""
+    fonts, styles, lines = {}, {}, {}
+    columns = {"block": [], "text": [], "size": [], "font": [], "color": [], "style": [], "line": []}
+    for text_model in page_data["texts_models_list"]:
+        line_bbox = (text_model["left"], text_model["top"], text_model["end_left"], text_model["end_top"])
+        columns["block"].append(text_model["parent_block_number"])
+        columns["text"].append(text_model["original_text"])
+        columns["size"].append(text_model["font_size"])
+        columns["font"].append(fonts.setdefault(text_model["font_family"], len(fonts)))
+        columns["color"].append(text_model["font_color"])
+        columns["style"].append(styles.setdefault(text_model["font_style"], len(styles)))
+        columns["line"].append(lines.setdefault(line_bbox, len(lines)))
+
+    texts = {
+        "fonts": list(fonts),
+        "styles": list(styles),
+        "lines": [list(line_bbox) for line_bbox in lines],
+        "columns": columns,
+    }
+    return {key: (texts if key == "texts" else value) for key, value in _renamed(page_data, "texts_models_list", "texts")}
+
+
+def decode_page(compact_page):
+    """Return the page_data a compact page was encoded from."""
+    texts = compact_page["texts"]
+    fonts, styles, lines, columns = texts["fonts"], texts["styles"], texts["lines"], texts["columns"]
+    text_models = []
+    for block, text, size, font, color, style, line in zip(columns["block"], columns["text"], columns["size"], columns["font"], columns["color"], columns["style"], columns["line"]):
+        left, top, end_left, end_top = lines[line]
+        text_models.append({
+            "parent_block_number": block,
+            "original_text": text,
+            "font_size": size,
+            "font_family": fonts[font],
+            "font_color": color,
+            "font_color_hex": "#" + '{0:06X}'.format(color),  # as extract_page() does
+            "font_style": styles[style],
+            "left": left,
+            "top": top,
+            "end_left": end_left,
+            "end_top": end_top,
+        })
+    return {key: (text_models if key == "texts_models_list" else value) for key, value in _renamed(compact_page, "texts", "texts_models_list")}
+
+
+def _renamed(page, old_key, new_key):
+    """Yield the items of `page`, with `old_key` renamed `new_key` in place."""
+    for key, value in page.items():
+        yield (new_key if key == old_key else key), value
+
+
+def encode(pages_data):
+    """Return the compact document of a list of page_data."""
+    return {"format": FORMAT, "pages": [encode_page(page_data) for page_data in pages_data]}
+
+
+def decode(document):
+    """Return the list of page_data of a compact document."""
+    if document.get("format") != FORMAT:
+        raise ValueError(f"Unknown compact format: '{document.get('format')}'")
+    return [decode_page(compact_page) for compact_page in document["pages"]]
+
+
+# binary form
+
+def _pack_floats(values):
+    array = np.asarray(values, dtype=np.float64)
+    single = array.astype(np.float32)
+    # float32 when exact, which MuPDF coordinates and sizes always are
+    if np.array_equal(single, array):
+        return {"dtype": "<f4", "data": single.astype('<f4').tobytes()}
+    return {"dtype": "<f8", "data": array.astype('<f8').tobytes()}
+
+
+def _pack_ints(values):
+    return {"dtype": "<i4", "data": np.asarray(values, dtype='<i4').tobytes()}
+
+
+def _unpack(packed):
+    return np.frombuffer(packed["data"], dtype=packed["dtype"]).tolist()
+
+
+def to_msgpack(document):
+    """Return the MessagePack bytes of a compact document."""
+    if msgpack is None:
+        raise RuntimeError("MessagePack output needs the 'msgpack' package")
+    pages = []
+    for compact_page in document["pages"]:
+        texts = compact_page["texts"]
+        columns = texts["columns"]
+        packed_texts = dict(
+            texts,
+            lines=_pack_floats([value for line_bbox in texts["lines"] for value in line_bbox]),
+            columns={
+                "block": _pack_ints(columns["block"]),
+                "text": columns["text"],
+                "size": _pack_floats(columns["size"]),
+                "font": _pack_ints(columns["font"]),
+                "color": _pack_ints(columns["color"]),
+                "style": _pack_ints(columns["style"]),
+                "line": _pack_ints(columns["line"]),
+            },
+        )
+        pages.append(dict(compact_page, texts=packed_texts))
+    return msgpack.packb(dict(document, pages=pages))
+
+
+def from_msgpack(data):
+    """Return the compact document of MessagePack bytes."""
+    if msgpack is None:
+        raise RuntimeError("MessagePack input needs the 'msgpack' package")
+    document = msgpack.unpackb(data)
+    for compact_page in document["pages"]:
+        texts = compact_page["texts"]
+        flat_lines = _unpack(texts["lines"])
+        texts["lines"] = [flat_lines[i:i + 4] for i in range(0, len(flat_lines), 4)]
+        texts["columns"] = {name: (column if name == "text" else _unpack(column)) for name, column in texts["columns"].items()}
+    return document
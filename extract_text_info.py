@@ -1,11 +1,19 @@
 import fitz  # PyMuPDF
-import pathlib
 import argparse
 import os
 import re
+import itertools
 import json
-import PIL
 import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+import worker_documents
+
+# numpy, the modules of the optional stages (OCR, images, page results,
+# compact output) and ProcessPoolExecutor are imported where used, so that
+# importing this module, as each run of the CLI does, costs PyMuPDF only
 
 logger = logging.getLogger('uvicorn.error')
 logger.setLevel(logging.DEBUG)
@@ -22,10 +30,47 @@ DEFAULT_USE_CLUSTERED_BLOCKS = False # x:0 y:3
 DEFAULT_USE_CLUSTERED_SPANS = True # x:1 y:1
 DEFAULT_X_TOLERANCE = 1
 DEFAULT_Y_TOLERANCE = 1
+# build clustered blocks from the page text instead of clipping it again
+DEFAULT_REUSE_EXTRACTED_TEXT = True
+
+# auto clustering params: the clustering and tolerances of each page are
+# derived from its text, see auto_clustering()
+DEFAULT_USE_AUTO_CLUSTERING = False
+DEFAULT_AUTO_MAX_SPANS = 1000  # spans per page above which the plain blocks are kept
+
+# pages to process, as a 1-based page range (None for all pages)
+DEFAULT_PAGES = '1-8'
+
+# page-parallel extraction params
+DEFAULT_WORKERS = 1  # no worker processes
+DEFAULT_CHUNK_SIZE = 4
+
+# draw the blocks as annotations on the document pages
+DEFAULT_ANNOTATE = False
+
+# image handling: 'none', 'metadata' (bbox and size of each image) or
+# 'extraction' (metadata, plus the image extracted to an ImageStore)
+IMAGE_LEVELS = ('none', 'metadata', 'extraction')
+DEFAULT_IMAGES = 'none'
+
+# OCR of the scanned pages, with Tesseract (see ocr.py): off by default
+DEFAULT_USE_OCR = False
+# same as ocr.DEFAULT_LANGUAGE, ocr.DEFAULT_DPI and ocr.DEFAULT_WORKERS
+DEFAULT_OCR_LANGUAGE = 'eng'
+DEFAULT_OCR_DPI = 300
+DEFAULT_OCR_WORKERS = 1
+
+# pages kept by PageCache
+DEFAULT_PAGE_CACHE_SIZE = 256
+# documents kept open by DocumentCache
+DEFAULT_DOCUMENT_CACHE_SIZE = 8
+
+# stages timed in the `timings` dict of extract_page() and annotate_page()
+STAGES = ('fingerprint', 'ocr_triage', 'ocr', 'image_info', 'get_text', 'cluster_blocks', 'cluster_text', 'models', 'image_extraction', 'annotation')
 
 # Adapted from cluster_drawings()
 def cluster_blocks(
-    page, clip=None, blocks=None, x_tolerance: float = 3, y_tolerance: float = 3
+    page, clip=None, blocks=None, x_tolerance: float = 3, y_tolerance: float = 3, bboxes=None
 ) -> list:
     """Join rectangles of neighboring vector graphic items.
 
@@ -34,6 +79,8 @@ def cluster_blocks(
         blocks: (optional) output of a previous "get_drawings()".
         x_tolerance: horizontal neighborhood threshold.
         y_tolerance: vertical neighborhood threshold.
+        bboxes: (optional) N x 4 array of the blocks bboxes, e.g. from a
+            PageGeometry. If given, `blocks` is not used.
 
     Notes:
         Vector graphics (also called line-art or blocks) usually consist
@@ -47,82 +94,415 @@ def cluster_blocks(
         Only "significant" rectangles will be returned, i.e. having both,
         width and height larger than the tolerance values.
     """
+    import numpy as np
+
     parea = page.rect  # the default clipping area
     if clip is not None:
-        parea = Rect(clip)
+        parea = fitz.Rect(clip)
     delta_x = x_tolerance  # shorter local name
     delta_y = y_tolerance  # shorter local name
-    if blocks is None:  # if we cannot re-use a previous output
+    if blocks is None and bboxes is None:  # if we cannot re-use a previous output
         blocks = page.get_text('dict', flags=DEFAULT_FLAGS, sort=DEFAULT_SORT)['blocks']
 
-    def are_neighbors(r1, r2):
-        """Detect whether r1, r2 are "neighbors".
-
-        Items r1, r2 are called neighbors if the minimum distance between
-        their points is less-equal delta.
-
-        Both parameters must be (potentially invalid) rectangles.
-        """
-        # normalize rectangles as needed
-        rr1_x0, rr1_x1 = (r1.x0, r1.x1) if r1.x1 > r1.x0 else (r1.x1, r1.x0)
-        rr1_y0, rr1_y1 = (r1.y0, r1.y1) if r1.y1 > r1.y0 else (r1.y1, r1.y0)
-        rr2_x0, rr2_x1 = (r2.x0, r2.x1) if r2.x1 > r2.x0 else (r2.x1, r2.x0)
-        rr2_y0, rr2_y1 = (r2.y0, r2.y1) if r2.y1 > r2.y0 else (r2.y1, r2.y0)
-        if (
-            0
-            or rr1_x1 < rr2_x0 - delta_x
-            or rr1_x0 > rr2_x1 + delta_x
-            or rr1_y1 < rr2_y0 - delta_y
-            or rr1_y0 > rr2_y1 + delta_y
-        ):
-            # Rects do not overlap.
-            return False
+    if bboxes is None:
+        bboxes = _as_bbox_array([b['bbox'] for b in blocks])
+
+    # bboxes of the items contained in the clip, in reading order
+    x0, y0, x1, y1 = bboxes.T
+    prects = bboxes[(x0 >= parea.x0) & (x1 <= parea.x1) & (y0 >= parea.y0) & (y1 <= parea.y1)]
+    prects = prects[np.lexsort((prects[:, 0], prects[:, 3]))]
+
+    new_rects, merged = _cluster_rects(prects, delta_x, delta_y)
+    # joined rects are computed by MuPDF in single precision
+    new_rects[merged] = new_rects[merged].astype(np.float32)
+
+    # drop duplicates, sort and keep the "significant" rects only
+    _, first_index = np.unique(new_rects, axis=0, return_index=True)
+    new_rects = new_rects[np.sort(first_index)]
+    new_rects = new_rects[np.lexsort((new_rects[:, 0], new_rects[:, 3]))]
+    x0, y0, x1, y1 = new_rects.T
+    new_rects = new_rects[(np.maximum(x1 - x0, 0) > delta_x) & (np.maximum(y1 - y0, 0) > delta_y)]
+    return [fitz.Rect(r) for r in new_rects.tolist()]
+
+
+def _as_bbox_array(bboxes):
+    import numpy as np
+    return np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+
+
+class PageGeometry:
+    """Array-backed bboxes of the text blocks of a page.
+
+    Built once from the text blocks of `page.get_text("dict")`, it holds
+    one N x 4 float array per level (spans, lines, blocks) plus the index
+    arrays mapping each span to its line and each line to its block, and
+    the number of spans and of superscript spans of each line.
+    """
+
+    def __init__(self, blocks):
+        import numpy as np
+
+        block_bboxes, line_bboxes, span_bboxes = [], [], []
+        line_block, span_line = [], []
+        for block_index, block in enumerate(blocks):
+            block_bboxes.append(block['bbox'])
+            for line in block['lines']:
+                line_block.append(block_index)
+                for span in line['spans']:
+                    span_line.append(len(line_bboxes))
+                    span_bboxes.append(span['bbox'])
+                line_bboxes.append(line['bbox'])
+
+        self.blocks = blocks
+        self.lines = [line for block in blocks for line in block['lines']]
+        self.spans = [span for line in self.lines for span in line['spans']]
+        self.block_bboxes = _as_bbox_array(block_bboxes)
+        self.line_bboxes = _as_bbox_array(line_bboxes)
+        self.span_bboxes = _as_bbox_array(span_bboxes)
+        self.line_block = np.array(line_block, dtype=np.intp)
+        self.span_line = np.array(span_line, dtype=np.intp)
+        self.span_block = self.line_block[self.span_line]
+        superscript = np.array([span['flags'] & fitz.TEXT_FONT_SUPERSCRIPT for span in self.spans], dtype=bool)
+        self.line_spans = np.bincount(self.span_line, minlength=len(self.lines))
+        self.line_superscripts = np.bincount(self.span_line[superscript], minlength=len(self.lines))
+
+
+# number of candidate pairs tested at once by _cluster_rects()
+CLUSTER_PAIRS_CHUNK_SIZE = 1 << 20
+# cells of the grid index of _cluster_rects(), per rectangle at most
+CLUSTER_GRID_CELLS_PER_RECT = 4
+# margin added to the cells a rectangle covers, against rounding errors
+CLUSTER_GRID_MARGIN = 1e-6
+
+
+class _RectGrid:
+    """Uniform grid index of rectangles grown by the neighborhood thresholds.
+
+    Each rectangle is entered in every cell its grown box covers, so that
+    neighboring rectangles always share a cell. The cells are about the
+    median size of the rectangles, so a cell holds a few of them whether
+    they are spread over the page or lined up in one band.
+    """
+
+    def __init__(self, nx0, ny0, nx1, ny1, pad_x, pad_y):
+        import numpy as np
+
+        self.pad_x, self.pad_y = pad_x, pad_y
+        self.origin_x, self.origin_y = float(nx0.min()), float(ny0.min())
+        # rects of no width or height, with no threshold, are points
+        extent_x = max(float(nx1.max()) + pad_x - self.origin_x, CLUSTER_GRID_MARGIN)
+        extent_y = max(float(ny1.max()) + pad_y - self.origin_y, CLUSTER_GRID_MARGIN)
+        columns = extent_x / max(float(np.median(nx1 - nx0)) + pad_x, CLUSTER_GRID_MARGIN)
+        rows = extent_y / max(float(np.median(ny1 - ny0)) + pad_y, CLUSTER_GRID_MARGIN)
+        shrink = max(1.0, np.sqrt(columns * rows / (CLUSTER_GRID_CELLS_PER_RECT * len(nx0))))
+        self.columns = max(1, int(columns / shrink))
+        self.rows = max(1, int(rows / shrink))
+        self.cell_width = extent_x / self.columns
+        self.cell_height = extent_y / self.rows
+
+        self.gx0, self.gx1 = self.cell_range_x(nx0, nx1)
+        self.gy0, self.gy1 = self.cell_range_y(ny0, ny1)
+        widths = self.gx1 - self.gx0 + 1
+        counts = widths * (self.gy1 - self.gy0 + 1)
+        rects = np.repeat(np.arange(len(nx0)), counts)
+        offsets = np.arange(len(rects)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (self.gy0[rects] + offsets // widths[rects]) * self.columns + self.gx0[rects] + offsets % widths[rects]
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]  # cell of each entry, sorted
+        self.rects = rects[order]  # rect of each entry
+        self.cell_start = np.searchsorted(self.cells, np.arange(self.columns * self.rows + 1))
+
+    @staticmethod
+    def _cells(v, origin, size, count):
+        import numpy as np
+        return np.clip(((v - origin) / size).astype(np.intp), 0, count - 1)
+
+    @staticmethod
+    def _cell(v, origin, size, count):
+        return min(max(int((v - origin) / size), 0), count - 1)
+
+    def cell_range_x(self, x0, x1):
+        """Return the first and last columns covered by [x0, x1], grown by the threshold."""
+        return (self._cells(x0 - CLUSTER_GRID_MARGIN, self.origin_x, self.cell_width, self.columns),
+                self._cells(x1 + self.pad_x + CLUSTER_GRID_MARGIN, self.origin_x, self.cell_width, self.columns))
+
+    def cell_range_y(self, y0, y1):
+        """Return the first and last rows covered by [y0, y1], grown by the threshold."""
+        return (self._cells(y0 - CLUSTER_GRID_MARGIN, self.origin_y, self.cell_height, self.rows),
+                self._cells(y1 + self.pad_y + CLUSTER_GRID_MARGIN, self.origin_y, self.cell_height, self.rows))
+
+    def query(self, x0, y0, x1, y1):
+        """Return the rects entered in the cells covering (x0, y0, x1, y1), grown by the thresholds on all sides."""
+        import numpy as np
+
+        cell = self._cell
+        gx0 = cell(x0 - self.pad_x - CLUSTER_GRID_MARGIN, self.origin_x, self.cell_width, self.columns)
+        gx1 = cell(x1 + self.pad_x + CLUSTER_GRID_MARGIN, self.origin_x, self.cell_width, self.columns)
+        gy0 = cell(y0 - self.pad_y - CLUSTER_GRID_MARGIN, self.origin_y, self.cell_height, self.rows)
+        gy1 = cell(y1 + self.pad_y + CLUSTER_GRID_MARGIN, self.origin_y, self.cell_height, self.rows)
+        if gy0 == gy1:  # the entries of contiguous cells are contiguous
+            entries = self.rects[self.cell_start[gy0 * self.columns + gx0]:self.cell_start[gy0 * self.columns + gx1 + 1]]
         else:
-            # Rects overlap.
-            return True
-
-    # add bbox converted to rect
-    for b in blocks:
-        bbox = b['bbox']
-        b['rect'] = fitz.Rect(x0=bbox[0], y0=bbox[1], x1=bbox[2], y1=bbox[3])
-
-    # exclude graphics not contained in the clip
-    paths = [
-        p
-        for p in blocks
-        if 1
-        and p["rect"].x0 >= parea.x0
-        and p["rect"].x1 <= parea.x1
-        and p["rect"].y0 >= parea.y0
-        and p["rect"].y1 <= parea.y1
-    ]
-
-    # list of all vector graphic rectangles
-    prects = sorted([p["rect"] for p in paths], key=lambda r: (r.y1, r.x0))
-
-    new_rects = []  # the final list of the joined rectangles
-
-    # -------------------------------------------------------------------------
-    # The strategy is to identify and join all rects that are neighbors
-    # -------------------------------------------------------------------------
-    while prects:  # the algorithm will empty this list
-        r = +prects[0]  # copy of first rectangle
-        repeat = True
-        while repeat:
-            repeat = False
-            for i in range(len(prects) - 1, 0, -1):  # from back to front
-                if are_neighbors(prects[i], r):
-                    r |= prects[i].tl  # include in first rect
-                    r |= prects[i].br  # include in first rect
-                    del prects[i]  # delete this rect
-                    repeat = True
-
-        new_rects.append(r)
-        del prects[0]
-        prects = sorted(set(prects), key=lambda r: (r.y1, r.x0))
-
-    new_rects = sorted(set(new_rects), key=lambda r: (r.y1, r.x0))
-    return [r for r in new_rects if r.width > delta_x and r.height > delta_y]
+            row_cells = np.arange(gy0, gy1 + 1) * self.columns
+            starts = self.cell_start[row_cells + gx0]
+            sizes = self.cell_start[row_cells + gx1 + 1] - starts
+            entries = self.rects[np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())]
+        return np.unique(entries)
+
+
+def _cluster_rects(prects, delta_x, delta_y):
+    """Join neighboring rectangles, using a grid index.
+
+    Args:
+        prects: N x 4 array of (x0, y0, x1, y1) rows, sorted by (y1, x0).
+        delta_x: horizontal neighborhood threshold.
+        delta_y: vertical neighborhood threshold.
+
+    Notes:
+        Starting from the first rectangle not yet assigned, a cluster grows by
+        including every remaining rectangle that is a neighbor of the cluster
+        bbox, until no more are found. Rectangles that are neighbors of each
+        other always end up in the same cluster, so they are first grouped into
+        connected components and then included as a whole. This yields the
+        same clusters as rescanning the whole list after every inclusion.
+
+    Returns:
+        A K x 4 array of cluster bboxes, in order of creation, and a boolean
+        array telling which of them joined more than their seed rectangle.
+    """
+    import numpy as np
+
+    n = len(prects)
+    if n == 0:
+        return np.empty((0, 4)), np.empty(0, dtype=bool)
+
+    # normalize rectangles once
+    nx0 = np.minimum(prects[:, 0], prects[:, 2])
+    nx1 = np.maximum(prects[:, 0], prects[:, 2])
+    ny0 = np.minimum(prects[:, 1], prects[:, 3])
+    ny1 = np.maximum(prects[:, 1], prects[:, 3])
+
+    # candidate neighbors of a rect share a cell with it
+    grid = _RectGrid(nx0, ny0, nx1, ny1, max(delta_x, 0), max(delta_y, 0))
+
+    def are_neighbors(i, x0, y0, x1, y1):
+        # same test as the former are_neighbors(prects[i], r), for arrays of i
+        return (
+            (nx1[i] >= x0 - delta_x)
+            & (nx0[i] <= x1 + delta_x)
+            & (ny1[i] >= y0 - delta_y)
+            & (ny0[i] <= y1 + delta_y)
+        )
+
+    # connected components of mutual neighbors: each entry of the grid is
+    # paired with the next entries of its cell
+    window_size = grid.cell_start[grid.cells + 1] - np.arange(1, len(grid.cells) + 1)
+    window_end = np.cumsum(window_size)
+    pairs = []
+    start = 0
+    while start < len(window_size):
+        limit = window_end[start] - window_size[start] + CLUSTER_PAIRS_CHUNK_SIZE
+        stop = max(start + 1, int(np.searchsorted(window_end, limit, side='right')))
+        sizes = window_size[start:stop]
+        k = np.repeat(np.arange(start, stop), sizes)
+        offsets = np.arange(len(k)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        i, j = grid.rects[k], grid.rects[k + 1 + offsets]
+        # a pair sharing several cells is tested in the first of them only
+        first_cell = np.maximum(grid.gy0[i], grid.gy0[j]) * grid.columns + np.maximum(grid.gx0[i], grid.gx0[j])
+        hit = (
+            (first_cell == grid.cells[k])
+            & are_neighbors(j, nx0[i], ny0[i], nx1[i], ny1[i])
+            & are_neighbors(i, nx0[j], ny0[j], nx1[j], ny1[j])
+        )
+        pairs.append((i[hit], j[hit]))
+        start = stop
+    pair_i = np.concatenate([p[0] for p in pairs])
+    pair_j = np.concatenate([p[1] for p in pairs])
+
+    label = np.arange(n)
+    while True:
+        previous = label.copy()
+        np.minimum.at(label, pair_i, label[pair_j])
+        np.minimum.at(label, pair_j, label[pair_i])
+        label = label[label]  # pointer jumping
+        if np.array_equal(label, previous):
+            break
+
+    # component bboxes, including all corner points
+    component_x0 = np.full(n, np.inf)
+    component_y0 = np.full(n, np.inf)
+    component_x1 = np.full(n, -np.inf)
+    component_y1 = np.full(n, -np.inf)
+    np.minimum.at(component_x0, label, nx0)
+    np.minimum.at(component_y0, label, ny0)
+    np.maximum.at(component_x1, label, nx1)
+    np.maximum.at(component_y1, label, ny1)
+    component_size = np.bincount(label, minlength=n)
+
+    absorbed = np.zeros(n, dtype=bool)  # indexed by component label
+    clusters = []
+    merged = []
+    # the seed of a component is its first rect in (y1, x0) order
+    seeds = np.sort(np.unique(label, return_index=True)[1])
+    for seed in seeds.tolist():
+        if absorbed[label[seed]]:
+            continue
+        x0, y0, x1, y1 = prects[seed].tolist()
+        new_labels = np.array([label[seed]])
+        is_merged = bool(component_size[label[seed]] > 1)
+        while len(new_labels):
+            absorbed[new_labels] = True
+            x0 = min(x0, component_x0[new_labels].min())
+            y0 = min(y0, component_y0[new_labels].min())
+            x1 = max(x1, component_x1[new_labels].max())
+            y1 = max(y1, component_y1[new_labels].max())
+            if not is_merged:
+                break  # the neighbors of a lone rect would be in its component
+
+            # look for remaining neighbors of the (normalized) cluster bbox
+            rx0, rx1 = (x0, x1) if x1 > x0 else (x1, x0)
+            ry0, ry1 = (y0, y1) if y1 > y0 else (y1, y0)
+            candidates = grid.query(rx0, ry0, rx1, ry1)
+            candidates = candidates[~absorbed[label[candidates]]]
+            candidates = candidates[are_neighbors(candidates, rx0, ry0, rx1, ry1)]
+            new_labels = np.unique(label[candidates])
+            is_merged = is_merged or len(new_labels) > 0
+
+        clusters.append((float(x0), float(y0), float(x1), float(y1)))
+        merged.append(is_merged)
+
+    return np.array(clusters, dtype=np.float64), np.array(merged, dtype=bool)
+
+def merge_blocks(blocks):
+    """Merge text blocks into the first one, joining lines and bboxes."""
+    merged_block = blocks[0]
+    for other_block in blocks[1:]:
+        merged_block['lines'] += other_block['lines']
+        merged_rect = fitz.Rect(merged_block['bbox']) | fitz.Rect(other_block['bbox'])
+        merged_block['bbox'] = [merged_rect.x0, merged_rect.y0, merged_rect.x1, merged_rect.y1]
+    return merged_block
+
+
+def _union_bbox(bboxes):
+    x0s, y0s, x1s, y1s = zip(*bboxes)
+    return (min(x0s), min(y0s), max(x1s), max(y1s))
+
+
+def assign_clustered_blocks(geometry, rect):
+    """Build the blocks found in `rect` from an already extracted page.
+
+    Args:
+        geometry: PageGeometry of the page text blocks.
+        rect: a clustered rect, as returned by cluster_blocks().
+
+    Notes:
+        Spans contained in `rect` are kept, grouped in their lines and blocks,
+        whose bboxes are recomputed. This is what `page.get_text("dict",
+        clip=rect)` returns, as long as MuPDF keeps all the characters of
+        those spans and gives them the same flags. It does not when a span
+        is cut by `rect`, or starts with a whitespace on its left border;
+        nor when `rect` holds only part of a line with superscript spans,
+        as MuPDF sets that flag relative to the preceding text of the line.
+        None is returned instead and the caller has to clip the page itself.
+
+    Returns:
+        The list of text blocks, sorted like get_text() does, or None.
+    """
+    import numpy as np
+
+    x0, y0, x1, y1 = geometry.span_bboxes.T
+    contained = (x0 >= rect.x0) & (y0 >= rect.y0) & (x1 <= rect.x1) & (y1 <= rect.y1)
+    overlapping = (x0 < rect.x1) & (y0 < rect.y1) & (x1 > rect.x0) & (y1 > rect.y0)
+    empty = (x0 >= x1) | (y0 >= y1)
+    if np.any(overlapping & ~contained) or np.any(contained & empty):
+        return None
+    for span_index in np.flatnonzero(contained & (x0 <= rect.x0)).tolist():
+        if geometry.spans[span_index]['text'][:1].isspace():
+            return None
+    contained_spans = np.bincount(geometry.span_line[contained], minlength=len(geometry.lines))
+    if np.any((contained_spans > 0) & (contained_spans < geometry.line_spans) & (geometry.line_superscripts > 0)):
+        return None
+
+    blocks = {}
+    lines = {}
+    for span_index in np.flatnonzero(contained).tolist():
+        line_index = int(geometry.span_line[span_index])
+        line = lines.get(line_index)
+        if line is None:
+            block_index = int(geometry.line_block[line_index])
+            block = blocks.get(block_index)
+            if block is None:
+                source = geometry.blocks[block_index]
+                block = {k: v for k, v in source.items() if k != 'lines'}
+                block['lines'] = []
+                blocks[block_index] = block
+            line = lines[line_index] = {'spans': []}
+            block['lines'].append((line_index, line))
+        line['spans'].append(geometry.spans[span_index])
+
+    for block_index, block in blocks.items():
+        block_lines = []
+        complete = len(block['lines']) == len(geometry.blocks[block_index]['lines'])
+        for line_index, line in block['lines']:
+            source = geometry.lines[line_index]
+            if len(line['spans']) == len(source['spans']):
+                line = source
+            else:
+                line = dict(source, spans=line['spans'])
+                line['bbox'] = _union_bbox([span['bbox'] for span in line['spans']])
+                complete = False
+            block_lines.append(line)
+        block['lines'] = block_lines
+        if not complete:
+            block['bbox'] = _union_bbox([line['bbox'] for line in block_lines])
+
+    return sorted(blocks.values(), key=lambda b: (b['bbox'][3], b['bbox'][0], b['number']))
+
+
+def auto_clustering(geometry, max_spans=DEFAULT_AUTO_MAX_SPANS):
+    """Choose how to cluster a page from the statistics of its text.
+
+    Spans are clustered, with an x_tolerance of a quarter of the median
+    font size (about a space), so that the words of a line join but not
+    the columns, and a y_tolerance of the median gap between the lines of
+    a block, so that the lines of a paragraph join. y_tolerance is kept
+    between 1 and half the median line height, so that paragraphs one
+    line apart stay apart. The time to cluster spans grows faster than
+    their number, so pages with more than `max_spans` spans keep their
+    plain blocks.
+
+    Args:
+        geometry: PageGeometry of the page.
+
+    Returns:
+        A dict with the "strategy" ('spans' or 'blocks') and the number of
+        "spans", plus the "x_tolerance", "y_tolerance" and the statistics
+        they come from with 'spans'.
+    """
+    import numpy as np
+
+    n_spans = len(geometry.spans)
+    if n_spans == 0 or n_spans > max_spans:
+        return {"strategy": "blocks", "spans": n_spans}
+
+    font_size = float(np.median([span['size'] for span in geometry.spans]))
+    line_heights = geometry.line_bboxes[:, 3] - geometry.line_bboxes[:, 1]
+    line_height = float(np.median(line_heights))
+    # gaps between consecutive lines of the same block, 0 when they overlap
+    same_block = geometry.line_block[1:] == geometry.line_block[:-1]
+    line_gaps = np.maximum(geometry.line_bboxes[1:, 1] - geometry.line_bboxes[:-1, 3], 0)[same_block]
+    line_gap = float(np.median(line_gaps)) if len(line_gaps) else 0.0
+
+    return {
+        "strategy": "spans",
+        "spans": n_spans,
+        "x_tolerance": round(max(1.0, font_size / 4), 2),
+        "y_tolerance": round(min(max(1.0, line_gap), max(1.0, line_height / 2)), 2),
+        "font_size": font_size,
+        "line_height": line_height,
+        "line_gap": line_gap,
+    }
+
 
 def get_texts_in_block(block, as_spans=False):
     texts = []
@@ -157,215 +537,808 @@ def flags_decomposer(flags):
 
 
 
-def highlight_sentences_in_pdf(pdf_document, use_clustered_blocks=DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans=DEFAULT_USE_CLUSTERED_SPANS, x_tolerance=DEFAULT_X_TOLERANCE, y_tolerance=DEFAULT_Y_TOLERANCE):
+def add_timing(timings, stage, t0):
+    """Add the time elapsed since `t0` to `timings[stage]`, if timings is a dict.
+
+    Returns:
+        The current time, to start timing the next stage.
+    """
+    t1 = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + t1 - t0
+    return t1
 
-    pdf_data = []
 
-    # Iterate through each page in the PDF
-    for page_number in range(min(8, pdf_document.page_count)):
-        page = pdf_document[page_number]
+class RawPage:
+    """What MuPDF extracts from a page, before any clustering.
 
-        text_models = []
-        image_models = []
-        block_models = []
-        page_data = {
-            "page_number": page_number + 1,
-            "page_width": page.rect[2] - page.rect[0],
-            "page_height": page.rect[3] - page.rect[1],
-            "texts_models_list": text_models,
-            "blocks": block_models,
-            "images_models_list": image_models,
-        }
+    Holds the text blocks of `page.get_text("dict")`, plus their
+    PageGeometry and the image info of the page, both built on first use.
+    None of them depends on the clustering params, so a RawPage can be
+    reused by any number of extract_page() calls on the same page. Apart
+    from filling these two, it is never modified.
 
-        # breakpoint()
-        # ocred_page = page.get_textpage_ocr()
-
-        # Drawings
-        #drawings = page.get_drawings()
-        #drawings = page.cluster_drawings(drawings=drawings, x_tolerance=5, y_tolerance=3)
-        #for rect_index, rect in enumerate(drawings):
-        ## for rect_index, drawing in enumerate(drawings[:]):
-        #    # rect = drawing["rect"]
-        #    try:
-        #        highlight = page.add_rect_annot(rect)
-        #    except ValueError as e:
-        #        print(f"{e}")
-        #        pass;
-        #    highlight.set_colors(stroke=[1, .8, 0])  # Orange rectangle
-        #    highlight.update()
-        #    if rect_index == 0 or (rect_index + 1) % 10 == 0:
-        #        print(f"drawing rect {rect_index + 1}/{len(drawings)}")
-        #    # page.add_redact_annot(rect)
-        ## page.apply_redactions(0,2,1)  # potentially set options for any of images, drawings, text
-
-        # Draw rectangles around each image
-        for image_index, image_info in enumerate(page.get_image_info(xrefs=True)):
-            # breakpoint()
-            bbox = list(image_info['bbox'])
-
-            image_model = {
-                "left": bbox[0],
-                "top": bbox[1],
-                "end_left": bbox[2],
-                "end_top": bbox[3],
-                "image_width": image_info['width'],
-                "image_height": image_info['height'],
-            }
-            image_models.append(image_model)
-
-            # Save image
-            #if image_info['xref']:
-            #    image_data = pdf_document.extract_image(image_info['xref'])
-            #    imgout = open(f"image{page_number}-{image_index}.{image_data['ext']}", "wb")
-            #    imgout.write(image_data["image"])
-            #    imgout.close()
-
-            # for k in range(len(bbox)): bbox[k] += 2 if k < 2 else -2  # shrink bbox
-            #highlight = page.add_rect_annot(bbox)
-            #highlight.set_colors(stroke=[0, .2, 1])  # Blue rectangle
-            #highlight.update()
-
-        # Extract text with formatting information
-        all_text_blocks = [block for block in page.get_text("dict", flags=DEFAULT_FLAGS, sort=DEFAULT_SORT)["blocks"] if block['type'] == 0]
-
-        if use_clustered_blocks or use_clustered_spans:
-            if use_clustered_blocks:
-                page_data["use_clustered_blocks"] = {
-                    "x_tolerance": x_tolerance,
-                    "y_tolerance": y_tolerance,
-                }
-                clustered_rects = cluster_blocks(page, blocks=all_text_blocks, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
-            else: # use_clustered_spans
-                page_data["use_clustered_spans"] = {
-                    "x_tolerance": x_tolerance,
-                    "y_tolerance": y_tolerance,
-                }
-                all_spans = []
-                for block in all_text_blocks:
-                    for lines in block["lines"]:
-                        all_spans.extend(lines["spans"])
-                clustered_rects = cluster_blocks(page, blocks=all_spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
-
-            blocks = []
-            logger.debug(f"  Page: {page_data['page_number']}")
-            logger.debug(f"    all_text_blocks: {len(all_text_blocks)}  clustered_rects: {len(clustered_rects)}")
-            for rect in clustered_rects:
-                merged_blocks = [clipped_block for clipped_block in page.get_text("dict", clip=rect, flags=DEFAULT_FLAGS, sort=DEFAULT_SORT)["blocks"] if clipped_block['type'] == 0]
-                # breakpoint()
-                if len(merged_blocks) >= 1:
-                    merged_block = merged_blocks[0]
-                    for other_block in merged_blocks[1:]:
-                        merged_block['lines'] += other_block['lines']
-                        # breakpoint()
-                        merged_rect = fitz.Rect(merged_block['bbox']) | fitz.Rect(other_block['bbox'])
-                        merged_block['bbox'] = [merged_rect.x0, merged_rect.y0, merged_rect.x1, merged_rect.y1]
-                    blocks.append(merged_block)
+    A scanned page is given its `ocr_pdf`, as returned by ocr.ocr_page()
+    with `ocr_args`: its text blocks are then those of the OCR text layer,
+    and so are the ones of clip_text_blocks().
+    """
+
+    def __init__(self, page, timings=None, ocr_pdf=None, ocr_args=None):
+        self.ocr_pdf = ocr_pdf
+        self.ocr_args = ocr_args if ocr_pdf is not None else None
+        self._ocr_document = None
+        t0 = time.perf_counter()
+        if ocr_pdf is None:
+            self.text_blocks = [block for block in page.get_text("dict", flags=DEFAULT_FLAGS, sort=DEFAULT_SORT)["blocks"] if block['type'] == 0]
         else:
-            page_data["use_clustered_blocks"] = False
-            page_data["use_clustered_spans"] = False
-            blocks = all_text_blocks
+            import ocr
+            self.text_blocks = ocr.text_blocks(self.ocr_document, page, flags=DEFAULT_FLAGS, sort=DEFAULT_SORT)
+        add_timing(timings, 'get_text', t0)
+        self._geometry = None
+        self.image_info = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_ocr_document'] = None
+        return state
+
+    @property
+    def ocr_document(self):
+        if self._ocr_document is None:
+            self._ocr_document = fitz.open(stream=self.ocr_pdf, filetype='pdf')
+        return self._ocr_document
+
+    def clip_text_blocks(self, page, rect):
+        """Return the text blocks of `page` in `rect`, like `page.get_text("dict", clip=rect)` does."""
+        if self.ocr_pdf is None:
+            return [block for block in page.get_text("dict", clip=rect, flags=DEFAULT_FLAGS, sort=DEFAULT_SORT)["blocks"] if block['type'] == 0]
+        import ocr
+        return ocr.text_blocks(self.ocr_document, page, clip=rect, flags=DEFAULT_FLAGS, sort=DEFAULT_SORT)
+
+    def load_image_info(self, page, timings=None):
+        """Return the image info of `page`, getting it from MuPDF on first use."""
+        if self.image_info is None:
+            t0 = time.perf_counter()
+            self.image_info = page.get_image_info(xrefs=True)
+            add_timing(timings, 'image_info', t0)
+        return self.image_info
+
+    @property
+    def geometry(self):
+        if self._geometry is None:
+            self._geometry = PageGeometry(self.text_blocks)
+        return self._geometry
+
+
+class PageCache:
+    """LRU of the RawPage of the pages of recently processed documents.
+
+    Keyed by (document hash, page number), so that requests on the same
+    document with other clustering params or output type only rerun the
+    clustering and the model building.
+    """
+
+    def __init__(self, max_pages=DEFAULT_PAGE_CACHE_SIZE):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_hash, page_number):
+        with self._lock:
+            raw_page = self._pages.get((doc_hash, page_number))
+            if raw_page is None:
+                self.misses += 1
+            else:
+                self._pages.move_to_end((doc_hash, page_number))
+                self.hits += 1
+            return raw_page
+
+    def put(self, doc_hash, page_number, raw_page):
+        with self._lock:
+            self._pages[(doc_hash, page_number)] = raw_page
+            self._pages.move_to_end((doc_hash, page_number))
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "pages": len(self._pages), "max_pages": self.max_pages}
 
-        logger.debug(f"    processing blocks: {len(blocks)}")
+
+class DocumentCache:
+    """LRU of open documents, keyed by content hash.
+
+    MuPDF documents are not thread-safe, so a document is checked out with
+    take() and given back with put() once done: a document asked for while
+    checked out is not found, and the caller opens another copy. Documents
+    evicted are closed.
+    """
+
+    def __init__(self, max_documents=DEFAULT_DOCUMENT_CACHE_SIZE):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, doc_hash):
+        """Return the document of `doc_hash`, removed from the cache until put() back, or None."""
+        with self._lock:
+            pdf_document = self._documents.pop(doc_hash, None)
+            if pdf_document is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return pdf_document
+
+    def put(self, doc_hash, pdf_document):
+        evicted = []
+        with self._lock:
+            if doc_hash in self._documents:
+                evicted.append(self._documents.pop(doc_hash))
+            self._documents[doc_hash] = pdf_document
+            while len(self._documents) > self.max_documents:
+                evicted.append(self._documents.popitem(last=False)[1])
+        for document in evicted:
+            document.close()
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "documents": len(self._documents), "max_documents": self.max_documents}
+
+
+def extract_page(page, use_clustered_blocks=DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans=DEFAULT_USE_CLUSTERED_SPANS, x_tolerance=DEFAULT_X_TOLERANCE, y_tolerance=DEFAULT_Y_TOLERANCE, reuse_extracted_text=DEFAULT_REUSE_EXTRACTED_TEXT, images=DEFAULT_IMAGES, use_auto_clustering=DEFAULT_USE_AUTO_CLUSTERING, raw_page=None, timings=None):
+    """Extract the text and image models of a page, without modifying it.
+
+    Args:
+        use_auto_clustering: choose the clustering and tolerances of the
+            page with auto_clustering(), instead of `use_clustered_blocks`,
+            `use_clustered_spans`, `x_tolerance` and `y_tolerance`. The
+            choice is recorded as page_data["auto_clustering"].
+        images: one of IMAGE_LEVELS. With 'none', the image models list is
+            left empty. With 'extraction', image models also have the
+            "xref" of their image, for ImageExtractor.add_images().
+        raw_page: RawPage of `page`, if already extracted. The page data of
+            an OCRed RawPage records the OCR params as page_data["ocr"].
+        timings: dict to which the seconds spent in each of STAGES are added.
+
+    Returns:
+        The page data and the list of (bbox, text) annotations to add to
+        the page blocks with annotate_page().
+    """
+    if raw_page is None:
+        raw_page = RawPage(page, timings=timings)
+    page_images = raw_page.load_image_info(page, timings=timings) if images != 'none' else []
+    t0 = time.perf_counter()
+    page_number = page.number
+
+    text_models = []
+    image_models = []
+    block_models = []
+    annotations = []
+    page_data = {
+        "page_number": page_number + 1,
+        "page_width": page.rect[2] - page.rect[0],
+        "page_height": page.rect[3] - page.rect[1],
+        "texts_models_list": text_models,
+        "blocks": block_models,
+        "images_models_list": image_models,
+    }
+    if raw_page.ocr_pdf is not None:
+        page_data["ocr"] = dict(raw_page.ocr_args)
+
+    # Drawings
+    #drawings = page.get_drawings()
+    #drawings = page.cluster_drawings(drawings=drawings, x_tolerance=5, y_tolerance=3)
+    #for rect_index, rect in enumerate(drawings):
+    ## for rect_index, drawing in enumerate(drawings[:]):
+    #    # rect = drawing["rect"]
+    #    try:
+    #        highlight = page.add_rect_annot(rect)
+    #    except ValueError as e:
+    #        print(f"{e}")
+    #        pass;
+    #    highlight.set_colors(stroke=[1, .8, 0])  # Orange rectangle
+    #    highlight.update()
+    #    if rect_index == 0 or (rect_index + 1) % 10 == 0:
+    #        print(f"drawing rect {rect_index + 1}/{len(drawings)}")
+    #    # page.add_redact_annot(rect)
+    ## page.apply_redactions(0,2,1)  # potentially set options for any of images, drawings, text
+
+    # Draw rectangles around each image
+    for image_index, image_info in enumerate(page_images):
         # breakpoint()
+        bbox = list(image_info['bbox'])
 
-        # output.json
-        #json_output = json.loads(page.get_text("json", sort=True))
-        #with open('output.json', 'w') as f:
-        #    json.dump(json_output, f, indent=2)
+        image_model = {
+            "left": bbox[0],
+            "top": bbox[1],
+            "end_left": bbox[2],
+            "end_top": bbox[3],
+            "image_width": image_info['width'],
+            "image_height": image_info['height'],
+        }
+        if images == 'extraction':
+            image_model["xref"] = image_info['xref']
+        image_models.append(image_model)
+
+        # Save image
+        #if image_info['xref']:
+        #    image_data = page.parent.extract_image(image_info['xref'])
+        #    imgout = open(f"image{page_number}-{image_index}.{image_data['ext']}", "wb")
+        #    imgout.write(image_data["image"])
+        #    imgout.close()
+
+        # for k in range(len(bbox)): bbox[k] += 2 if k < 2 else -2  # shrink bbox
+        #highlight = page.add_rect_annot(bbox)
+        #highlight.set_colors(stroke=[0, .2, 1])  # Blue rectangle
+        #highlight.update()
+
+    t0 = add_timing(timings, 'models', t0)
+
+    # Extract text with formatting information
+    all_text_blocks = raw_page.text_blocks
+
+    if use_auto_clustering:
+        auto = auto_clustering(raw_page.geometry)
+        page_data["auto_clustering"] = auto
+        use_clustered_blocks = False
+        use_clustered_spans = auto["strategy"] == "spans"
+        if use_clustered_spans:
+            x_tolerance, y_tolerance = auto["x_tolerance"], auto["y_tolerance"]
+
+    if use_clustered_blocks or use_clustered_spans:
+        geometry = raw_page.geometry
+        if use_clustered_blocks:
+            page_data["use_clustered_blocks"] = {
+                "x_tolerance": x_tolerance,
+                "y_tolerance": y_tolerance,
+            }
+            clustered_rects = cluster_blocks(page, bboxes=geometry.block_bboxes, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
+        else: # use_clustered_spans
+            page_data["use_clustered_spans"] = {
+                "x_tolerance": x_tolerance,
+                "y_tolerance": y_tolerance,
+            }
+            clustered_rects = cluster_blocks(page, bboxes=geometry.span_bboxes, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
+
+        t0 = add_timing(timings, 'cluster_blocks', t0)
+
+        blocks = []
+        logger.debug(f"  Page: {page_data['page_number']}")
+        logger.debug(f"    all_text_blocks: {len(all_text_blocks)}  clustered_rects: {len(clustered_rects)}")
+        for rect in clustered_rects:
+            merged_blocks = None
+            if reuse_extracted_text:
+                merged_blocks = assign_clustered_blocks(geometry, rect)
+            if merged_blocks is None:
+                merged_blocks = raw_page.clip_text_blocks(page, rect)
+            if len(merged_blocks) >= 1:
+                blocks.append(merge_blocks(merged_blocks))
+        t0 = add_timing(timings, 'cluster_text', t0)
+    else:
+        page_data["use_clustered_blocks"] = False
+        page_data["use_clustered_spans"] = False
+        blocks = all_text_blocks
+
+    logger.debug(f"    processing blocks: {len(blocks)}")
+    # breakpoint()
+
+    # output.json
+    #json_output = json.loads(page.get_text("json", sort=True))
+    #with open('output.json', 'w') as f:
+    #    json.dump(json_output, f, indent=2)
+
+    for block_index, block in enumerate(blocks):
+        if block['type'] == 0:  # Text block
+            lines = block['lines']
+            block_texts = []
+
+            # Draw rectangles around each line
+            for line_index, line in enumerate(lines):
+                spans = [span for span in line['spans'] if span['text']]
+                text = ''.join([span['text'] for span in spans])
+                # print(f"[page {page_number}] spans text in block {block_index} line {line_index}: '{text}'")
+                bbox = line['bbox']
+
+                # highlight = page.add_rect_annot(bbox)
+                # highlight.set_colors(stroke=[1, 0, 0])  # Red rectangle
+                # highlight.update()
+                ##Add annotation with line text
+                # text_annot = page.add_text_annot((bbox[2]-2, bbox[3]-2), text, icon="Comment")
+                # text_annot.set_colors(stroke=[1, 0, 0])  # Red
+                # text_annot.update(opacity=.7)
+
+                for span in spans:
+                    # breakpoint()
+                    text_model = {
+                        "parent_block_number": block_index,
+                        "original_text": span['text'],
+                        "font_size": span['size'],
+                        "font_family": span['font'],
+                        "font_color": span['color'],
+                        "font_color_hex": "#" + '{0:06X}'.format(span['color']),
+                        "font_style": flags_decomposer(span['flags']),
+                        "left": bbox[0],
+                        "top": bbox[1],
+                        "end_left": bbox[2],
+                        "end_top": bbox[3],
+                    }
+                    text_models.append(text_model)
+
+                block_texts.append(text)
+
+            block_text = "\n".join(block_texts)
+
+            block_model = {
+                "number": block_index,
+                "text": block_text,
+                "boundingBox": ",".join([str(value) for value in block['bbox']])
+            }
+            block_models.append(block_model)
+
+            annotations.append((block['bbox'], block_text))
+
+    add_timing(timings, 'models', t0)
+
+    return page_data, annotations
+
+
+def _new_annot(pdf_page, annot_type, color, name):
+    annot = fitz.mupdf.pdf_create_annot(pdf_page, annot_type)
+    fitz.mupdf.pdf_set_annot_color(annot, color)
+    fitz.mupdf.pdf_dict_puts(fitz.mupdf.pdf_annot_obj(annot), "NM", fitz.mupdf.pdf_new_text_string(name))
+    return annot
+
+
+def annotate_page(page, annotations, timings=None):
+    """Draw the (bbox, text) annotations returned by extract_page().
+
+    Notes:
+        The annotations are the ones `page.add_rect_annot()` and
+        `page.add_text_annot()` followed by `annot.update()` would add, but
+        they are created with MuPDF directly, and their appearance streams
+        are generated all at once for the page. Per annotation, PyMuPDF
+        would regenerate them twice and list all the page annotations to
+        name the new one.
+    """
+    t0 = time.perf_counter()
+    old_rotation = page.rotation
+    if old_rotation != 0:
+        page.set_rotation(0)
+    try:
+        pdf_page = fitz.mupdf.pdf_page_from_fz_page(page.this)
+        # unique /NM names, like PyMuPDF gives them
+        stem = fitz.TOOLS.set_annot_stem()
+        names = set(page.annot_names())
+        ids = (f'{stem}-A{i}' for i in itertools.count())
+        ids = (name for name in ids if name not in names)
+
+        for block_bbox, block_text in annotations:
+            # Draw rectangles around each block
+            bbox = list(block_bbox)
+            for k in range(len(bbox)): bbox[k] += -1 if k < 2 else +1  # expand bbox
+            highlight = _new_annot(pdf_page, fitz.mupdf.PDF_ANNOT_SQUARE, [0, .8, 0], next(ids))  # Green rectangle
+            fitz.mupdf.pdf_set_annot_rect(highlight, fitz.mupdf.FzRect(*bbox))
+            # Add annotation with block text
+            text_annot = _new_annot(pdf_page, fitz.mupdf.PDF_ANNOT_TEXT, [0, 1, 0], next(ids))  # Green
+            icon = fitz.mupdf.pdf_annot_rect(text_annot)  # default icon size
+            x, y = bbox[0]-18, bbox[1]-18
+            fitz.mupdf.pdf_set_annot_rect(text_annot, fitz.mupdf.FzRect(x, y, x + icon.x1 - icon.x0, y + icon.y1 - icon.y0))
+            fitz.mupdf.pdf_set_annot_contents(text_annot, block_text)
+            fitz.mupdf.pdf_set_annot_icon_name(text_annot, "Paragraph")
+            fitz.mupdf.pdf_set_annot_opacity(text_annot, .7)
+
+        fitz.mupdf.pdf_update_page(pdf_page)
+    finally:
+        if old_rotation != 0:
+            page.set_rotation(old_rotation)
+    add_timing(timings, 'annotation', t0)
+
+
+def _extract_pages_worker(page_numbers, extract_args, return_raw=False, collect_timings=False, ocr_page_numbers=(), ocr_args=None):
+    results = []
+    timings = {} if collect_timings else None
+    for page_number in page_numbers:
+        page = worker_documents.document[page_number]
+        ocr_pdf = None
+        if page_number in ocr_page_numbers:
+            import ocr
+            t0 = time.perf_counter()
+            ocr_pdf = ocr.ocr_page(page, **ocr_args)
+            add_timing(timings, 'ocr', t0)
+        raw_page = RawPage(page, timings=timings, ocr_pdf=ocr_pdf, ocr_args=ocr_args)
+        page_data, annotations = extract_page(page, raw_page=raw_page, timings=timings, **extract_args)
+        results.append((page_data, annotations, raw_page) if return_raw else (page_data, annotations))
+    return results, timings
 
-        for block_index, block in enumerate(blocks):
-            if block['type'] == 0:  # Text block
-                lines = block['lines']
-                block_texts = []
-
-                # Draw rectangles around each line
-                for line_index, line in enumerate(lines):
-                    spans = [span for span in line['spans'] if span['text']]
-                    text = ''.join([span['text'] for span in spans])
-                    # print(f"[page {page_number}] spans text in block {block_index} line {line_index}: '{text}'")
-                    bbox = line['bbox']
-
-                    # highlight = page.add_rect_annot(bbox)
-                    # highlight.set_colors(stroke=[1, 0, 0])  # Red rectangle
-                    # highlight.update()
-                    ##Add annotation with line text
-                    # text_annot = page.add_text_annot((bbox[2]-2, bbox[3]-2), text, icon="Comment")
-                    # text_annot.set_colors(stroke=[1, 0, 0])  # Red
-                    # text_annot.update(opacity=.7)
-
-                    for span in spans:
-                        # breakpoint()
-                        text_model = {
-                            "parent_block_number": block_index,
-                            "original_text": span['text'],
-                            "font_size": span['size'],
-                            "font_family": span['font'],
-                            "font_color": span['color'],
-                            "font_color_hex": "#" + '{0:06X}'.format(span['color']),
-                            "font_style": flags_decomposer(span['flags']),
-                            "left": bbox[0],
-                            "top": bbox[1],
-                            "end_left": bbox[2],
-                            "end_top": bbox[3],
-                        }
-                        text_models.append(text_model)
-
-                    block_texts.append(text)
-
-                block_text = "\n".join(block_texts)
-
-                block_model = {
-                    "number": block_index,
-                    "text": block_text,
-                    "boundingBox": ",".join([str(value) for value in block['bbox']])
-                }
-                block_models.append(block_model)
-
-                # Draw rectangles around each block
-                # breakpoint()
-                bbox = list(block['bbox'])
-                for k in range(len(bbox)): bbox[k] += -1 if k < 2 else +1  # expand bbox
-                highlight = page.add_rect_annot(bbox)
-                highlight.set_colors(stroke=[0, .8, 0])  # Green rectangle
-                highlight.update()
-                # Add annotation with block text
-                text_annot = page.add_text_annot((bbox[0]-18, bbox[1]-18), block_text, icon="Paragraph")
-                text_annot.set_colors(stroke=[0, 1, 0])  # Green
-                text_annot.update(opacity=.7)
-
-        pdf_data.append(page_data)
 
+def extract_pages_parallel(pdf_source, page_numbers, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, return_raw=False, timings=None, ocr_page_numbers=(), ocr_args=None, **extract_args):
+    """Run extract_page() on `page_numbers`, sharded across worker processes.
+
+    Args:
+        pdf_source: path or bytes of the PDF, opened once by each worker.
+        page_numbers: 0-based numbers of the pages to extract.
+        workers: number of worker processes.
+        chunk_size: number of consecutive pages handed to a worker at once.
+        return_raw: also send back the RawPage of each page.
+        timings: dict to which the seconds spent by the workers in each of
+            STAGES are added.
+        ocr_page_numbers: pages OCRed by the workers first, with the
+            ocr.ocr_page() keyword arguments `ocr_args`.
+        extract_args: keyword arguments of extract_page().
+
+    Yields:
+        The (page_data, annotations) of the pages, in order, or their
+        (page_data, annotations, raw_page) with `return_raw`. At most two
+        chunks per worker are in flight, so memory does not grow with the
+        number of pages.
+    """
+    def chunk_results(future):
+        results, chunk_timings = future.result()
+        if timings is not None:
+            for stage, seconds in chunk_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return results
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    page_numbers = list(page_numbers)
+    chunks = [page_numbers[i:i + chunk_size] for i in range(0, len(page_numbers), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=worker_documents.init_worker, initargs=(pdf_source,)) as executor:
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(_extract_pages_worker, chunk, extract_args, return_raw, timings is not None, [page_number for page_number in chunk if page_number in ocr_page_numbers], ocr_args))
+                if len(pending) >= 2 * workers:
+                    yield from chunk_results(pending.popleft())
+            while pending:
+                yield from chunk_results(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def parse_page_range(pages, page_count):
+    """Return the 0-based page numbers selected by a page range.
+
+    Args:
+        pages: 1-based page range like "1-3,5,8-" ("-3" and "8-" are open
+            ranges), or None for all pages. Pages past the end of the
+            document are ignored, and pages selected again, like in
+            "1-3,2", are kept at their first place.
+        page_count: number of pages of the document.
+
+    Raises:
+        ValueError: if `pages` is not a valid page range.
+    """
+    if pages is None:
+        return list(range(page_count))
+
+    page_numbers = []
+    for part in str(pages).split(','):
+        part = part.strip()
+        match = re.fullmatch(r'(\d*)\s*(-?)\s*(\d*)', part)
+        if not part or match is None or not (match[1] or match[3]) or (match[3] and not match[2]):
+            raise ValueError(f"Invalid page range: '{pages}'")
+        first = int(match[1]) if match[1] else 1
+        last = int(match[3]) if match[3] else (page_count if match[2] else first)
+        if first < 1 or (match[3] and last < first):
+            raise ValueError(f"Invalid page range: '{pages}'")
+        page_numbers.extend(range(first - 1, min(last, page_count)))
+    return list(dict.fromkeys(page_numbers))
+
+
+def iter_highlighted_pages(pdf_document, use_clustered_blocks=DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans=DEFAULT_USE_CLUSTERED_SPANS, x_tolerance=DEFAULT_X_TOLERANCE, y_tolerance=DEFAULT_Y_TOLERANCE, reuse_extracted_text=DEFAULT_REUSE_EXTRACTED_TEXT, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, pdf_source=None, pages=DEFAULT_PAGES, page_cache=None, doc_hash=None, timings=None, annotate=DEFAULT_ANNOTATE, images=DEFAULT_IMAGES, image_store=None, use_auto_clustering=DEFAULT_USE_AUTO_CLUSTERING, page_results=None, use_ocr=DEFAULT_USE_OCR, ocr_language=DEFAULT_OCR_LANGUAGE, ocr_dpi=DEFAULT_OCR_DPI, ocr_workers=DEFAULT_OCR_WORKERS):
+    """Yield the page_data of the selected pages one at a time, annotating
+    them in `pdf_document` too if `annotate`.
+
+    Same arguments as highlight_sentences_in_pdf(). With a PageCache and
+    the `doc_hash` of the document, the RawPage of each page is taken from
+    `page_cache` when there, and added to it otherwise. The seconds spent in
+    each of STAGES are added to the `timings` dict, if given.
+
+    With images='extraction', the images of the pages are extracted to
+    `image_store` as they go, each xref once, and the image models get the
+    "image_id" of their image in the store.
+
+    With `page_results`, a ResultCache, the results of each page are stored
+    under its content fingerprint (see fingerprints.page_fingerprint()) and
+    the extraction params. Pages whose results are there, like the pages a
+    new version of a document did not change, are not extracted again:
+    their page_data is taken from `page_results`, and their annotations too.
+    Pages are fingerprinted and looked up as the loop reaches them, except
+    those the worker processes or the OCR would otherwise handle ahead.
+
+    With `use_ocr`, the pages that look scanned (see ocr.needs_ocr()) are
+    OCRed in `ocr_language` at `ocr_dpi` before being extracted, by up to
+    `ocr_workers` processes, or by the extraction workers when there are
+    any. The text of these pages comes from their OCR text layer.
+
+    Raises:
+        ValueError: if `pages` is not a valid page range, `images` not one
+            of IMAGE_LEVELS, or `image_store` missing for 'extraction'.
+    """
+    if images not in IMAGE_LEVELS:
+        raise ValueError(f"Invalid images level: '{images}', not one of {', '.join(IMAGE_LEVELS)}")
+    if images == 'extraction' and image_store is None:
+        raise ValueError("Image extraction needs an image store")
+    extract_args = dict(
+        use_clustered_blocks=use_clustered_blocks,
+        use_clustered_spans=use_clustered_spans,
+        x_tolerance=x_tolerance,
+        y_tolerance=y_tolerance,
+        reuse_extracted_text=reuse_extracted_text,
+        images=images,
+        use_auto_clustering=use_auto_clustering,
+    )
+    page_numbers = parse_page_range(pages, pdf_document.page_count)
+
+    ocr_args = dict(language=ocr_language, dpi=ocr_dpi) if use_ocr else None
+    result_params = dict(extract_args, ocr=ocr_args) if use_ocr else extract_args
+
+    memo = {}  # object hashes of the document, see fingerprints.page_fingerprint()
+    result_keys = {}
+
+    def page_result_key(page_number):
+        """Return the page_results key of a page, fingerprinting it on first use."""
+        key = result_keys.get(page_number)
+        if key is None:
+            import fingerprints
+            from result_cache import result_key
+            t0 = time.perf_counter()
+            key = result_keys[page_number] = result_key(fingerprints.page_fingerprint(pdf_document[page_number], memo), **result_params)
+            add_timing(timings, 'fingerprint', t0)
+        return key
+
+    # pages looked up in page_results before the page loop, and those found there;
+    # the others are looked up in the loop, so that the first page comes out at once
+    checked = set()
+    stored = set()
+    if page_results is not None and workers > 1 and len(page_numbers) > chunk_size:
+        # the workers are handed the pages missing from page_results
+        checked.update(page_numbers)
+        stored.update(page_number for page_number in page_numbers if page_results.contains(page_result_key(page_number)))
+    extracted_numbers = [page_number for page_number in page_numbers if page_number not in stored]
+
+    use_cache = page_cache is not None and doc_hash is not None
+    raw_pages = {page_number: page_cache.get(doc_hash, page_number) for page_number in extracted_numbers} if use_cache else {}
+    for page_number, raw_page in list(raw_pages.items()):
+        if raw_page is not None and raw_page.ocr_pdf is not None and raw_page.ocr_args != ocr_args:
+            del raw_pages[page_number]  # OCRed by a request with other OCR params, or without OCR
+    # scanned pages, OCRed before being extracted
+    ocr_numbers = []
+    if use_ocr:
+        import ocr
+        t0 = time.perf_counter()
+        for page_number in extracted_numbers:
+            raw_page = raw_pages.get(page_number)
+            if raw_page is not None and raw_page.ocr_pdf is not None:
+                continue
+            if ocr.needs_ocr(pdf_document[page_number]):
+                ocr_numbers.append(page_number)
+                raw_pages.pop(page_number, None)  # extracted without OCR
+        add_timing(timings, 'ocr_triage', t0)
+        if page_results is not None:
+            # OCR runs ahead of the page loop: not on the pages in page_results
+            unchecked = [page_number for page_number in ocr_numbers if page_number not in checked]
+            checked.update(unchecked)
+            stored.update(page_number for page_number in unchecked if page_results.contains(page_result_key(page_number)))
+            ocr_numbers = [page_number for page_number in ocr_numbers if page_number not in stored]
+        logger.debug(f"  Pages to OCR: {len(ocr_numbers)}/{len(extracted_numbers)}")
+    ocr_set = set(ocr_numbers)
+    # pages still to be extracted by MuPDF
+    missing = [page_number for page_number in extracted_numbers if raw_pages.get(page_number) is None and page_number not in stored]
+    missing_set = set(missing)
+
+    results = None
+    if workers > 1 and len(missing) > chunk_size:
+        # workers open their own copy of the document
+        if pdf_source is None:
+            pdf_source = worker_documents.pdf_source_of(pdf_document)
+        results = extract_pages_parallel(pdf_source, missing, workers=workers, chunk_size=chunk_size, return_raw=use_cache, timings=timings, ocr_page_numbers=ocr_set, ocr_args=ocr_args, **extract_args)
+    ocr_results = ocr.ocr_pages(pdf_document, ocr_numbers, workers=ocr_workers, pdf_source=pdf_source, **ocr_args) if results is None and ocr_numbers else None
+    image_extractor = None
+    if images == 'extraction':
+        import image_extraction
+        image_extractor = image_extraction.ImageExtractor(pdf_document, image_store, workers=workers, pdf_source=pdf_source)
+
+    try:
+        # Iterate through each page in the PDF
+        for page_number in page_numbers:
+            page = pdf_document[page_number]
+            raw_page = raw_pages.get(page_number)
+            stored_result = None
+            if page_results is not None and (page_number in stored or page_number not in checked):
+                stored_result = page_results.get(page_result_key(page_number))
+            if stored_result is not None:
+                stored_result = json.loads(stored_result)
+                page_data = stored_result["page_data"]
+                page_data["page_number"] = page_number + 1
+                if image_extractor is not None:
+                    # same images, in the same order, but maybe other xrefs in this version,
+                    # and extracted to the store of this request, which may not have them
+                    for image_model, image_info in zip(page_data["images_models_list"], page.get_image_info(xrefs=True)):
+                        image_model["xref"] = image_info['xref']
+                    t0 = time.perf_counter()
+                    image_extractor.add_images(page_data["images_models_list"])
+                    add_timing(timings, 'image_extraction', t0)
+                if annotate:
+                    annotate_page(page, stored_result["annotations"], timings=timings)
+                yield page_data
+                continue
+            fresh = raw_page is None
+            if raw_page is not None:
+                page_data, annotations = extract_page(page, raw_page=raw_page, timings=timings, **extract_args)
+            elif results is not None and page_number in missing_set and use_cache:
+                page_data, annotations, raw_page = next(results)
+            elif results is not None and page_number in missing_set:
+                page_data, annotations = next(results)
+            else:
+                ocr_pdf = None
+                if page_number in ocr_set:
+                    t0 = time.perf_counter()
+                    ocr_pdf = next(ocr_results)
+                    add_timing(timings, 'ocr', t0)
+                elif use_ocr and page_number in stored and ocr.needs_ocr(page):
+                    # evicted from page_results since looked up, and not triaged
+                    t0 = time.perf_counter()
+                    ocr_pdf = ocr.ocr_page(page, **ocr_args)
+                    add_timing(timings, 'ocr', t0)
+                raw_page = RawPage(page, timings=timings, ocr_pdf=ocr_pdf, ocr_args=ocr_args)
+                page_data, annotations = extract_page(page, raw_page=raw_page, timings=timings, **extract_args)
+            if use_cache and fresh:
+                page_cache.put(doc_hash, page_number, raw_page)
+            if image_extractor is not None:
+                t0 = time.perf_counter()
+                image_extractor.add_images(page_data["images_models_list"])
+                add_timing(timings, 'image_extraction', t0)
+            if page_results is not None:
+                import serialization
+                page_results.put(page_result_key(page_number), serialization.dumps({"page_data": page_data, "annotations": annotations}))
+            if annotate:
+                annotate_page(page, annotations, timings=timings)
+            yield page_data
+    finally:
+        if results is not None:
+            results.close()
+        if ocr_results is not None:
+            ocr_results.close()
+        if image_extractor is not None:
+            image_extractor.close()
+
+
+def highlight_sentences_in_pdf(pdf_document, use_clustered_blocks=DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans=DEFAULT_USE_CLUSTERED_SPANS, x_tolerance=DEFAULT_X_TOLERANCE, y_tolerance=DEFAULT_Y_TOLERANCE, reuse_extracted_text=DEFAULT_REUSE_EXTRACTED_TEXT, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, pdf_source=None, pages=DEFAULT_PAGES, page_cache=None, doc_hash=None, timings=None, annotate=DEFAULT_ANNOTATE, images=DEFAULT_IMAGES, image_store=None, use_auto_clustering=DEFAULT_USE_AUTO_CLUSTERING, page_results=None, use_ocr=DEFAULT_USE_OCR, ocr_language=DEFAULT_OCR_LANGUAGE, ocr_dpi=DEFAULT_OCR_DPI, ocr_workers=DEFAULT_OCR_WORKERS):
+
+    pdf_data = list(iter_highlighted_pages(
+        pdf_document,
+        use_clustered_blocks=use_clustered_blocks,
+        use_clustered_spans=use_clustered_spans,
+        x_tolerance=x_tolerance,
+        y_tolerance=y_tolerance,
+        reuse_extracted_text=reuse_extracted_text,
+        workers=workers,
+        chunk_size=chunk_size,
+        pdf_source=pdf_source,
+        pages=pages,
+        page_cache=page_cache,
+        doc_hash=doc_hash,
+        timings=timings,
+        annotate=annotate,
+        images=images,
+        image_store=image_store,
+        use_auto_clustering=use_auto_clustering,
+        page_results=page_results,
+        use_ocr=use_ocr,
+        ocr_language=ocr_language,
+        ocr_dpi=ocr_dpi,
+        ocr_workers=ocr_workers,
+    ))
 
     return pdf_data, pdf_document
 
-def main():
-    # Parse command-line arguments
-    parser = argparse.ArgumentParser(description='Highlight sentences in a PDF file.')
-    parser.add_argument('input_pdf', help='Path to the input PDF file.')
-    parser.add_argument('--output_pdf', help=f'Path to the output PDF file. Defaults to "<input_pdf>{HIGHLIGHTED_SUFFIX}.pdf".')
+def extract_file(input_pdf, output_pdf=None, annotate=DEFAULT_ANNOTATE, compact=False, images=DEFAULT_IMAGES, image_dir=None, page_results_dir=None, pdf_document=None, **highlight_args):
+    """Extract a PDF file, saving its JSON data, and its annotated copy if `annotate`.
 
-    args = parser.parse_args()
+    The outputs are named as the CLI names them: "<output_pdf>.json", with
+    `output_pdf` defaulting to "<input_pdf>_highlighted.pdf".
+
+    Args:
+        pdf_document: the document of `input_pdf`, if already open. It is
+            left open, annotated if `annotate`.
+        highlight_args: keyword arguments of highlight_sentences_in_pdf().
 
+    Returns:
+        The page data, and the dict of the files written: "output_json",
+        "output_pdf" (None unless annotated) and "image_dir" (None unless
+        images='extraction').
+    """
     # Determine the output file name
-    input_pdf = args.input_pdf
-    output_pdf = args.output_pdf or os.path.splitext(input_pdf)[0] + f"{HIGHLIGHTED_SUFFIX}.pdf"
+    annotate = annotate or output_pdf is not None
+    output_pdf = output_pdf or os.path.splitext(input_pdf)[0] + f"{HIGHLIGHTED_SUFFIX}.pdf"
     output_json = os.path.splitext(output_pdf)[0] + ".json"
+    image_dir = image_dir or os.path.splitext(output_pdf)[0] + "_images"
+    image_store = None
+    if images == 'extraction':
+        import image_extraction
+        image_store = image_extraction.ImageStore(image_dir)
+    page_results = None
+    if page_results_dir:
+        from result_cache import ResultCache
+        page_results = ResultCache(directory=page_results_dir)
+    highlight_args.setdefault('pdf_source', input_pdf)
 
     # Highlight the sentences in the PDF
-    pdf_document = fitz.open(input_pdf)
-    json_data, result_pdf_document = highlight_sentences_in_pdf(pdf_document)
+    close = pdf_document is None
+    if pdf_document is None:
+        pdf_document = fitz.open(input_pdf)
+    try:
+        json_data, result_pdf_document = highlight_sentences_in_pdf(pdf_document, annotate=annotate, images=images, image_store=image_store, page_results=page_results, **highlight_args)
 
-    # Save the modified PDF to a new file
-    result_pdf_document.save(output_pdf)
-    result_pdf_document.close()
-
-    print()
-    print(f"use_clustered_blocks: {json_data[-1]['use_clustered_blocks']}")
-    print(f"Highlighted PDF saved as: {output_pdf}")
+        # Save the modified PDF to a new file
+        if annotate:
+            result_pdf_document.save(output_pdf)
+    finally:
+        if close:
+            pdf_document.close()
 
+    output_data = json_data
+    if compact:
+        import compact_output
+        output_data = compact_output.encode(json_data)
     with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(json_data, f, indent=2)
-        print(f"JSON data saved as: {output_json}")
+        json.dump(output_data, f, indent=2)
+
+    return json_data, {"output_json": output_json, "output_pdf": output_pdf if annotate else None, "image_dir": image_dir if image_store is not None else None}
+
+def main():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description='Highlight sentences in a PDF file.')
+    parser.add_argument('input_pdf', help='Path to the input PDF file.')
+    parser.add_argument('--annotate', action='store_true', help=f'Also save a copy of the PDF with the text blocks annotated, as "<input_pdf>{HIGHLIGHTED_SUFFIX}.pdf" unless --output_pdf is given.')
+    parser.add_argument('--output_pdf', help='Path to the annotated PDF file. Implies --annotate.')
+    parser.add_argument('--compact', action='store_true', help='Save the JSON data in the compact columnar format of compact_output.')
+    parser.add_argument('--pages', default=DEFAULT_PAGES, help=f'Pages to process, e.g. "1-3,5,8-". Defaults to "{DEFAULT_PAGES}".')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Number of worker processes extracting pages in parallel. Defaults to {DEFAULT_WORKERS}.')
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE, help=f'Number of pages handed to a worker at once. Defaults to {DEFAULT_CHUNK_SIZE}.')
+    parser.add_argument('--auto_clustering', action='store_true', help='Choose the clustering and tolerances of each page from its text.')
+    parser.add_argument('--page_results', help='Directory where the results of each page are kept by content fingerprint, so that the pages unchanged since a previous run, on this PDF or another version of it, are not extracted again.')
+    parser.add_argument('--ocr', action='store_true', help='OCR the scanned pages with Tesseract.')
+    parser.add_argument('--ocr_language', default=DEFAULT_OCR_LANGUAGE, help=f'Tesseract languages of the OCR, like "eng+deu". Defaults to "{DEFAULT_OCR_LANGUAGE}".')
+    parser.add_argument('--ocr_dpi', type=int, default=DEFAULT_OCR_DPI, help=f'Resolution the scanned pages are OCRed at. Defaults to {DEFAULT_OCR_DPI}.')
+    parser.add_argument('--ocr_workers', type=int, default=DEFAULT_OCR_WORKERS, help=f'Number of worker processes OCRing pages in parallel, when --workers is 1. Defaults to {DEFAULT_OCR_WORKERS}.')
+    parser.add_argument('--images', choices=IMAGE_LEVELS, default=DEFAULT_IMAGES, help=f'Image handling: no image models, their metadata, or metadata and extracted images. Defaults to "{DEFAULT_IMAGES}".')
+    parser.add_argument('--image_dir', help='Directory the extracted images are saved to, as "<sha256>.<ext>". Defaults to "<output_pdf>_images".')
+
+    args = parser.parse_args()
+
+    json_data, outputs = extract_file(
+        args.input_pdf,
+        output_pdf=args.output_pdf,
+        annotate=args.annotate,
+        compact=args.compact,
+        images=args.images,
+        image_dir=args.image_dir,
+        page_results_dir=args.page_results,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        pages=args.pages,
+        use_auto_clustering=args.auto_clustering,
+        use_ocr=args.ocr,
+        ocr_language=args.ocr_language,
+        ocr_dpi=args.ocr_dpi,
+        ocr_workers=args.ocr_workers,
+    )
+
+    print()
+    print(f"use_clustered_blocks: {json_data[-1].get('use_clustered_blocks', False) if json_data else False}")
+    if outputs["output_pdf"]:
+        print(f"Highlighted PDF saved as: {outputs['output_pdf']}")
+    if outputs["image_dir"]:
+        print(f"Images saved in: {outputs['image_dir']}")
+    print(f"JSON data saved as: {outputs['output_json']}")
 
 if __name__ == "__main__":
     main()
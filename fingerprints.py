@@ -0,0 +1,130 @@
+"""Per-page content fingerprints.
+
+The fingerprint of a page is a hash of what MuPDF draws it from: its
+content streams, its resources and every object they refer to (fonts,
+images, forms...), its annotations and their appearance streams, its
+boxes and its rotation. Objects are hashed by content, references
+included, and with the keys of their dictionaries sorted, so the
+fingerprint of a page does not depend on the xref numbers of its objects,
+on the order the writer put their keys in, nor on the other pages: an
+unchanged page keeps its fingerprint in a new version of the document,
+even rewritten with its objects renumbered. The content streams of the
+page are hashed decoded, in one read, as they are its own and many small
+ones would cost a lookup each; the other streams are hashed as stored,
+once per document, so a document saved again with another compression of
+its fonts or images has new fingerprints.
+"""
+import hashlib
+import re
+
+# tokens of the PDF source of an object, as returned by Document.xref_object()
+TOKEN_PATTERN = re.compile(r'<<|>>|\[|\]|\(|<[0-9A-Fa-f\s]*>|/[^\s/<>\[\]()%{}]*|\d+ \d+ R|[^\s/<>\[\]()%{}]+')
+# keys pointing back up the object tree, which would pull in the whole document
+BACK_REFERENCE_KEYS = {'/Parent', '/P'}
+
+
+def _tokens(source):
+    """Yield the tokens of the PDF source of an object, strings included."""
+    pos = 0
+    while True:
+        match = TOKEN_PATTERN.search(source, pos)
+        if match is None:
+            return
+        if match[0] != '(':
+            pos = match.end()
+            yield match[0]
+            continue
+        # literal string: balanced parentheses, with backslash escapes
+        depth, end = 0, match.start()
+        while end < len(source):
+            char = source[end]
+            if char == '\\':
+                end += 1
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+            end += 1
+        pos = end + 1
+        yield source[match.start():pos]
+
+
+def _canonical(doc, tokens, memo):
+    """Return the canonical source of the next object of `tokens`."""
+    token = next(tokens, '')
+    if token == '<<':
+        entries = {}
+        while True:
+            key = next(tokens, '>>')
+            if key == '>>':
+                break
+            value = _canonical(doc, tokens, memo) if key not in BACK_REFERENCE_KEYS else next(tokens, '')
+            if key not in BACK_REFERENCE_KEYS or not value.endswith(' R'):
+                entries[key] = value
+        return '<<' + ''.join(f'{key} {entries[key]}' for key in sorted(entries)) + '>>'
+    if token == '[':
+        items = []
+        while True:
+            item = _canonical(doc, tokens, memo)
+            if item in (']', ''):
+                break
+            items.append(item)
+        return '[' + ' '.join(items) + ']'
+    if token.endswith(' R'):
+        return _object_hash(doc, int(token.split()[0]), memo)
+    return token
+
+
+def _resolve(doc, source, memo):
+    """Return the canonical PDF source of an object, with its references replaced by the hash of the objects they refer to."""
+    return _canonical(doc, _tokens(source), memo)
+
+
+def _object_hash(doc, xref, memo):
+    """Return the hash of an object, with its references replaced by the hash of the objects they refer to."""
+    if xref in memo:
+        return memo[xref] or 'cycle'
+    memo[xref] = None  # in progress
+    source = doc.xref_object(xref, compressed=True)
+    sha256 = hashlib.sha256(_resolve(doc, source, memo).encode())
+    if '/Length' in source:  # a stream
+        sha256.update(doc.xref_stream_raw(xref) or b'')
+    memo[xref] = sha256.hexdigest()
+    return memo[xref]
+
+
+def _inherited_key(doc, xref, key):
+    """Return the (type, value) of a key of a page, looked up in its ancestors if inherited."""
+    while True:
+        kind, value = doc.xref_get_key(xref, key)
+        if kind != 'null':
+            return kind, value
+        kind, parent = doc.xref_get_key(xref, 'Parent')
+        if kind != 'xref':
+            return kind, value
+        xref = int(parent.split()[0])
+
+
+def page_fingerprint(page, memo=None):
+    """Return the content fingerprint of a page, as a hex string.
+
+    Args:
+        memo: dict of the object hashes of the document, shared across the
+            fingerprints of its pages, so that fonts and images used on many
+            pages are hashed once.
+    """
+    doc = page.parent
+    memo = {} if memo is None else memo
+    sha256 = hashlib.sha256()
+    sha256.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+    sha256.update(page.read_contents())
+    kind, resources = _inherited_key(doc, page.xref, 'Resources')
+    sha256.update(_resolve(doc, resources, memo).encode())
+    # text of FreeText annotations and form fields is extracted too; their
+    # /P and /Parent, pointing back to the page and the form, are skipped
+    kind, annots = doc.xref_get_key(page.xref, 'Annots')
+    if kind != 'null':
+        sha256.update(_resolve(doc, annots, memo).encode())
+    return sha256.hexdigest()
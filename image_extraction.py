@@ -0,0 +1,157 @@
+"""Extraction of the images of a PDF, once per xref.
+
+The images MuPDF finds on the pages (see extract_page() with
+images='extraction') are decoded once per xref by an ImageExtractor, so
+that an image shown on many pages, like a logo, is extracted once. They go
+to a content-addressed ImageStore, as "<sha256 of the bytes>.<ext>" files,
+so that the same image in two documents is stored once too.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import worker_documents
+
+logger = logging.getLogger('uvicorn.error')
+
+
+DEFAULT_WORKERS = 1  # no worker processes
+DEFAULT_CHUNK_SIZE = 8  # xrefs handed to a worker at once
+
+IMAGE_ID_PATTERN = re.compile(r'[0-9a-f]{64}\.[0-9a-z]+')
+
+
+def media_type(image_id: str) -> str:
+    """Return the media type of an image, from the extension of its id."""
+    ext = image_id.rsplit('.', 1)[-1]
+    return {'jpx': 'image/jp2', 'jb2': 'image/x-jbig2'}.get(ext) or mimetypes.types_map.get('.' + ext, 'application/octet-stream')
+
+
+class ImageStore:
+    """Content-addressed store of extracted images.
+
+    Images are named "<sha256 of their bytes>.<ext>" and written to
+    `directory`, or kept in memory without one. An image already there is
+    not written again. A store with a directory can be sent to worker
+    processes, which then write to the same directory.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._images = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def path(self, image_id: str) -> str:
+        """Return the path of an image in `directory`.
+
+        Raises:
+            ValueError: if `image_id` is not an image id.
+        """
+        if not IMAGE_ID_PATTERN.fullmatch(image_id):
+            raise ValueError(f"Invalid image id: '{image_id}'")
+        return os.path.join(self.directory, image_id)
+
+    def put(self, data: bytes, ext: str) -> str:
+        """Store an image, returning its id."""
+        image_id = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        if not self.directory:
+            with self._lock:
+                self._images.setdefault(image_id, data)
+            return image_id
+
+        path = self.path(image_id)
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return image_id
+
+    def get(self, image_id: str) -> Optional[bytes]:
+        """Return the bytes of an image, None if not in the store."""
+        if not self.directory:
+            with self._lock:
+                return self._images.get(image_id)
+        try:
+            with open(self.path(image_id), 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+def _extract_xrefs(pdf_document, xrefs):
+    """Return the (xref, bytes, ext) of the images, with None bytes for those MuPDF cannot extract."""
+    images = []
+    for xref in xrefs:
+        try:
+            image = pdf_document.extract_image(xref)
+        except (ValueError, RuntimeError) as e:
+            logger.warning(f"Cannot extract image xref {xref}: {e}")
+            image = None
+        images.append((xref, image['image'], image['ext']) if image else (xref, None, None))
+    return images
+
+
+def _extract_xrefs_worker(xrefs):
+    return _extract_xrefs(worker_documents.document, xrefs)
+
+
+class ImageExtractor:
+    """Extracts the images of a document to an ImageStore, once per xref.
+
+    add_images() is given the image models of the pages in turn, and only
+    extracts the xrefs it has not seen yet. With `workers` > 1, the new
+    xrefs of a page are shared across worker processes, started on first
+    use and opening their own copy of the document. close() stops them.
+    """
+
+    def __init__(self, pdf_document, store: ImageStore, workers: int = DEFAULT_WORKERS, chunk_size: int = DEFAULT_CHUNK_SIZE, pdf_source=None):
+        self.pdf_document = pdf_document
+        self.store = store
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pdf_source = pdf_source
+        self.image_ids = {}  # xref -> image id, None if it cannot be extracted
+        self._executor = None
+
+    def add_images(self, image_models):
+        """Extract the images of `image_models`, setting their "image_id".
+
+        Inline images have no xref, and get a None "image_id".
+        """
+        xrefs = list(dict.fromkeys(image_model["xref"] for image_model in image_models if image_model["xref"] and image_model["xref"] not in self.image_ids))
+        for xref, data, ext in self._extract(xrefs):
+            self.image_ids[xref] = self.store.put(data, ext) if data else None
+        for image_model in image_models:
+            image_model["image_id"] = self.image_ids.get(image_model["xref"])
+
+    def _extract(self, xrefs):
+        if self.workers <= 1 or len(xrefs) <= self.chunk_size:
+            return _extract_xrefs(self.pdf_document, xrefs)
+        if self._executor is None:
+            pdf_source = self.pdf_source if self.pdf_source is not None else worker_documents.pdf_source_of(self.pdf_document)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=worker_documents.init_worker, initargs=(pdf_source,))
+        chunks = [xrefs[i:i + self.chunk_size] for i in range(0, len(xrefs), self.chunk_size)]
+        return [image for images in self._executor.map(_extract_xrefs_worker, chunks) for image in images]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,329 @@
+"""Queue of long-running extraction jobs.
+
+A job is submitted with its source and params, gets an id right away, and
+runs in the background on a JobQueue: a thread pool running a few jobs at
+once, each extracting its pages with its own page-parallel workers. Its
+state, progress and result are kept in a job store:
+
+- MemoryJobStore, lost on restart, with its results bounded in size;
+- SQLiteJobStore, a SQLite database with the uploaded PDFs and the results
+  as files next to it, so that jobs survive restarts: JobQueue.resume()
+  runs again the jobs a restart interrupted.
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger('uvicorn.error')
+
+
+JOB_STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+FINAL_STATES = ('done', 'failed', 'cancelled')
+
+DEFAULT_MAX_JOBS = 2  # jobs running at once
+DEFAULT_PROGRESS_INTERVAL = 0.5  # seconds between progress writes to the store
+DEFAULT_MAX_RESULT_BYTES = 256 * 1024 * 1024  # results kept by MemoryJobStore
+
+
+class JobCancelled(Exception):
+    """Raised by a job runner when its job was cancelled."""
+
+
+class MemoryJobStore:
+    """Jobs, their inputs and results, kept in memory.
+
+    The results are bounded by their total size in bytes: past
+    `max_result_bytes`, the oldest ones are dropped, the latest one is
+    always kept. The job of a dropped result has no result anymore.
+    """
+
+    def __init__(self, max_result_bytes: int = DEFAULT_MAX_RESULT_BYTES):
+        self.max_result_bytes = max_result_bytes
+        self._jobs = {}
+        self._inputs = {}
+        self._results = OrderedDict()
+        self._results_size = 0
+        self._lock = threading.Lock()
+
+    def create(self, job: dict):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def list(self, states=JOB_STATES) -> list:
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job["state"] in states]
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._inputs.pop(job_id, None)
+            self._results_size -= len(self._results.pop(job_id, b''))
+
+    def put_input(self, job_id: str, pdf_source):
+        """Keep the uploaded PDF of a job, given as bytes or as a path."""
+        if isinstance(pdf_source, str):
+            with open(pdf_source, 'rb') as f:
+                pdf_source = f.read()
+        with self._lock:
+            self._inputs[job_id] = pdf_source
+
+    def get_input(self, job_id: str):
+        """Return the uploaded PDF of a job, as bytes or as a path, None if there is none."""
+        with self._lock:
+            return self._inputs.get(job_id)
+
+    def delete_input(self, job_id: str):
+        """Drop the uploaded PDF of a finished job."""
+        with self._lock:
+            self._inputs.pop(job_id, None)
+
+    def put_result(self, job_id: str, data: bytes):
+        with self._lock:
+            self._results_size -= len(self._results.pop(job_id, b''))
+            self._results[job_id] = data
+            self._results_size += len(data)
+            while self._results_size > self.max_result_bytes and len(self._results) > 1:
+                evicted_id, evicted = self._results.popitem(last=False)
+                self._results_size -= len(evicted)
+                logger.info(f"Dropped the result of job {evicted_id}, past {self.max_result_bytes} bytes of results")
+
+    def get_result(self, job_id: str) -> Optional[bytes]:
+        with self._lock:
+            return self._results.get(job_id)
+
+
+class SQLiteJobStore:
+    """Jobs in a SQLite database in `directory`, their inputs and results as files there."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'jobs.sqlite3'), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, state TEXT NOT NULL, created REAL NOT NULL, job TEXT NOT NULL)')
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.directory, f"{uuid.UUID(hex=job_id).hex}.{ext}")
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(data, str):
+                with open(data, 'rb') as source:
+                    shutil.copyfileobj(source, f)
+            else:
+                f.write(data)
+        os.replace(tmp_path, path)
+
+    def create(self, job: dict):
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO jobs VALUES (?, ?, ?, ?)', (job["id"], job["state"], job["created"], json.dumps(job)))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute('SELECT job FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id: str, **fields):
+        with self._lock, self._db:
+            row = self._db.execute('SELECT job FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:  # deleted
+                return
+            job = dict(json.loads(row[0]), **fields)
+            self._db.execute('UPDATE jobs SET state = ?, job = ? WHERE id = ?', (job["state"], json.dumps(job), job_id))
+
+    def list(self, states=JOB_STATES) -> list:
+        with self._lock:
+            rows = self._db.execute(f'SELECT job FROM jobs WHERE state IN ({",".join("?" * len(states))}) ORDER BY created', tuple(states)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, job_id: str):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        for ext in ('pdf', 'result'):
+            try:
+                os.remove(self._path(job_id, ext))
+            except FileNotFoundError:
+                pass
+
+    def put_input(self, job_id: str, pdf_source):
+        self._write(self._path(job_id, 'pdf'), pdf_source)
+
+    def get_input(self, job_id: str):
+        path = self._path(job_id, 'pdf')
+        return path if os.path.isfile(path) else None
+
+    def delete_input(self, job_id: str):
+        try:
+            os.remove(self._path(job_id, 'pdf'))
+        except FileNotFoundError:
+            pass
+
+    def put_result(self, job_id: str, data: bytes):
+        self._write(self._path(job_id, 'result'), data)
+
+    def get_result(self, job_id: str) -> Optional[bytes]:
+        try:
+            with open(self._path(job_id, 'result'), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class JobQueue:
+    """Runs the jobs of a store in the background, `max_jobs` at once.
+
+    `runner(job, pdf_source, progress, cancelled)` does the work of a job
+    and returns its result as bytes. `pdf_source` is the uploaded PDF of
+    the job, None if the runner fetches it from the job "source". The runner
+    reports the pages done with `progress(pages_done, pages_total)`, and
+    raises JobCancelled once the `cancelled` event is set.
+    """
+
+    def __init__(self, store, runner, max_jobs: int = DEFAULT_MAX_JOBS, progress_interval: float = DEFAULT_PROGRESS_INTERVAL):
+        self.store = store
+        self.runner = runner
+        self.progress_interval = progress_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='job')
+        self._cancel_events = {}  # job id -> Event, for the jobs not finished
+        self._progress = {}  # job id -> (pages done, pages total) of the running jobs
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def submit(self, source: str, params: dict, pdf=None) -> dict:
+        """Queue a job, returning it.
+
+        Args:
+            source: where the PDF comes from, like its URL, for the runner.
+            params: params of the job, for the runner.
+            pdf: the uploaded PDF, as bytes or as a path, kept in the store.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "state": "queued",
+            "source": source,
+            "params": params,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "pages_done": 0,
+            "pages_total": None,
+            "error": None,
+        }
+        if pdf is not None:
+            self.store.put_input(job["id"], pdf)
+        self.store.create(job)
+        self._start(job["id"])
+        return job
+
+    def resume(self):
+        """Queue again the jobs left queued or running by a previous process."""
+        for job in self.store.list(states=('queued', 'running')):
+            if job["id"] in self._cancel_events:
+                continue
+            logger.info(f"Resuming job {job['id']}")
+            self.store.update(job["id"], state="queued", pages_done=0)
+            self._start(job["id"])
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a job, with the latest progress of a running one."""
+        job = self.store.get(job_id)
+        if job is not None:
+            with self._lock:
+                progress = self._progress.get(job_id)
+            if progress is not None and job["state"] == "running":
+                job["pages_done"], job["pages_total"] = progress
+        return job
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """Cancel a job: a queued one is not run, a running one stops at its next page."""
+        with self._lock:
+            cancelled = self._cancel_events.get(job_id)
+        if cancelled is not None:
+            cancelled.set()
+            job = self.store.get(job_id)
+            if job is not None and job["state"] == "queued":
+                self._finish(job_id, "cancelled")
+        return self.get(job_id)
+
+    def delete(self, job_id: str):
+        """Cancel a job, and remove it with its result from the store."""
+        self.cancel(job_id)
+        self.store.delete(job_id)
+
+    def _start(self, job_id):
+        with self._lock:
+            self._cancel_events[job_id] = threading.Event()
+        self.executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with self._lock:
+            cancelled = self._cancel_events[job_id]
+        last_write = 0.0
+
+        def progress(pages_done, pages_total):
+            nonlocal last_write
+            with self._lock:
+                self._progress[job_id] = (pages_done, pages_total)
+            now = time.monotonic()
+            if now - last_write >= self.progress_interval or pages_done == pages_total:
+                last_write = now
+                self.store.update(job_id, pages_done=pages_done, pages_total=pages_total)
+
+        try:
+            job = self.store.get(job_id)
+            if job is None or job["state"] != "queued" or cancelled.is_set():
+                return
+            self.store.update(job_id, state="running", started=time.time())
+            logger.debug(f"Running job {job_id}")
+            result = self.runner(job, self.store.get_input(job_id), progress, cancelled)
+            self.store.put_result(job_id, result)
+            self._finish(job_id, "done")
+        except JobCancelled:
+            if not self._stopping:  # left running otherwise, for resume()
+                self._finish(job_id, "cancelled")
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            self._finish(job_id, "failed", error=f"{type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._progress.pop(job_id, None)
+
+    def _finish(self, job_id, state, **fields):
+        """Set the final state of a job, with its latest progress, and drop its input."""
+        with self._lock:
+            progress = self._progress.get(job_id)
+        if progress is not None:
+            fields["pages_done"], fields["pages_total"] = progress
+        self.store.update(job_id, state=state, finished=time.time(), **fields)
+        self.store.delete_input(job_id)
+
+    def shutdown(self):
+        """Stop the running jobs, which stay running in the store for resume()."""
+        with self._lock:
+            self._stopping = True
+            events = list(self._cancel_events.values())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for cancelled in events:
+            cancelled.set()
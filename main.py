@@ -1,31 +1,76 @@
-from fastapi import FastAPI, HTTPException, Query, Body
-from fastapi.responses import JSONResponse, Response, FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi.responses import JSONResponse, Response, FileResponse, StreamingResponse
 from pydantic import BaseModel, HttpUrl
-import requests
-from io import BytesIO
+import httpx
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from starlette.background import BackgroundTask
+import hashlib
+import tempfile
+import threading
+import time
 # from pypdf import PdfReader, PdfWriter, generic, ObjectDeletionFlag
 # import pypdfium2 as pdfium
 import fitz  # PyMuPDF
 import extract_text_info
-from extract_text_info import highlight_sentences_in_pdf
-from PIL import Image
+from extract_text_info import highlight_sentences_in_pdf, iter_highlighted_pages
+import batch
+import compact_output
+import image_extraction
+import jobs
+import metrics
+import ocr
+import pdf_download
+import serialization
+from result_cache import ResultCache, result_key
 import os
 import logging
-from typing import Optional, cast
-import json
+from typing import List, Optional, Union
 
 logger = logging.getLogger('uvicorn.error')
 logger.setLevel(logging.DEBUG)
 
-app = FastAPI()
-
 
 OUTPUT_MEDIA_TYPES = {
     0: 'application/json',
     1: 'application/pdf',
     2: 'text/html',
+    3: 'application/x-ndjson',  # one JSON page_data per line
+    4: 'application/json',  # compact columnar JSON, see compact_output
+    5: 'application/x-msgpack',  # compact columnar MessagePack
 }
 
+# output types always streamed page by page
+STREAMED_OUTPUT_TYPES = {3}
+
+HTML_HEAD = '''
+<html>
+  <head>
+    <meta charset="UTF-8">
+    <style>
+    body {
+      font-family: monospace;
+    }
+    .page {
+      margin-top: 1em;
+      font-size: 1.2em;
+      font-weight: bold;
+    }
+    .text-caption {
+      margin-left: 1em;
+      margin-top: .75em;
+      font-weight: bold;
+    }
+    .text {
+      margin-left: 1em;
+      margin-top:.2em;
+      border:1px solid #1d1;
+    }
+    </style>
+  </head>'''
+
 DEFAULT_OUTPUT_TYPE = 0
 
 HIGHLIGHTED_SUFFIX = extract_text_info.HIGHLIGHTED_SUFFIX
@@ -35,15 +80,263 @@ DEFAULT_USE_CLUSTERED_BLOCKS = extract_text_info.DEFAULT_USE_CLUSTERED_BLOCKS
 DEFAULT_USE_CLUSTERED_SPANS = extract_text_info.DEFAULT_USE_CLUSTERED_SPANS
 DEFAULT_X_TOLERANCE = extract_text_info.DEFAULT_X_TOLERANCE
 DEFAULT_Y_TOLERANCE = extract_text_info.DEFAULT_Y_TOLERANCE
+DEFAULT_USE_AUTO_CLUSTERING = extract_text_info.DEFAULT_USE_AUTO_CLUSTERING
+
+# OCR of the scanned pages, opt-in per request, needs Tesseract on the server
+DEFAULT_USE_OCR = extract_text_info.DEFAULT_USE_OCR
+OCR_LANGUAGE = os.environ.get('PDF_OCR_LANGUAGE', extract_text_info.DEFAULT_OCR_LANGUAGE)  # Tesseract languages, like "eng+deu"
+OCR_DPI = int(os.environ.get('PDF_OCR_DPI', extract_text_info.DEFAULT_OCR_DPI))
+OCR_WORKERS = int(os.environ.get('PDF_OCR_WORKERS', extract_text_info.DEFAULT_OCR_WORKERS))  # worker processes OCRing the pages of a request
+
+# pages to process, as a 1-based page range like "1-3,5,8-"
+DEFAULT_PAGES = extract_text_info.DEFAULT_PAGES
+
+# image handling, one of extract_text_info.IMAGE_LEVELS
+DEFAULT_IMAGES = extract_text_info.DEFAULT_IMAGES
+IMAGE_DIR = os.environ.get('PDF_IMAGE_DIR', os.path.join(tempfile.gettempdir(), 'pdf_images'))  # where extracted images go, served at /images/<image_id>
+
+# page-parallel extraction params
+DEFAULT_WORKERS = int(os.environ.get('PDF_WORKERS', extract_text_info.DEFAULT_WORKERS))
+DEFAULT_CHUNK_SIZE = int(os.environ.get('PDF_CHUNK_SIZE', extract_text_info.DEFAULT_CHUNK_SIZE))
+
+# fetch params
+FETCH_TIMEOUT = float(os.environ.get('PDF_FETCH_TIMEOUT', 30))  # seconds
+MAX_DOWNLOAD_SIZE = int(os.environ.get('PDF_MAX_DOWNLOAD_SIZE', pdf_download.DEFAULT_MAX_SIZE))  # bytes
+
+# input params
+SPOOL_MAX_MEMORY = int(os.environ.get('PDF_SPOOL_MAX_MEMORY', pdf_download.DEFAULT_MAX_MEMORY))  # bytes kept in memory before spooling to disk
+SPOOL_DIR = os.environ.get('PDF_SPOOL_DIR')  # where spooled PDFs go, defaults to the system temp dir
+# directories `file_path` may point into, separated by os.pathsep; local files are refused if unset
+LOCAL_PDF_DIRS = [os.path.realpath(path) for path in os.environ.get('PDF_LOCAL_DIRS', '').split(os.pathsep) if path]
+READ_CHUNK_SIZE = 1024 * 1024
+
+# batch params
+BATCH_WORKERS = int(os.environ.get('PDF_BATCH_WORKERS', batch.DEFAULT_WORKERS))  # worker processes of a batch
+MAX_BATCH_SIZE = int(os.environ.get('PDF_MAX_BATCH_SIZE', 1000))  # documents per batch
+
+# job queue params
+JOB_DIR = os.environ.get('PDF_JOB_DIR')  # jobs are kept in a SQLite database there, and survive restarts; in memory if unset
+MAX_JOBS = int(os.environ.get('PDF_MAX_JOBS', jobs.DEFAULT_MAX_JOBS))  # jobs running at once
+MAX_JOB_WORKERS = int(os.environ.get('PDF_MAX_JOB_WORKERS', os.cpu_count() or 1))  # page-parallel worker processes a job may ask for
+JOB_RESULTS_SIZE = int(os.environ.get('PDF_JOB_RESULTS_SIZE', jobs.DEFAULT_MAX_RESULT_BYTES))  # bytes of job results kept in memory, when JOB_DIR is unset
+
+# extraction pool params
+MAX_CONCURRENCY = int(os.environ.get('PDF_MAX_CONCURRENCY', os.cpu_count() or 1))  # requests admitted at once, their fitz work queued behind one lock
+MAX_QUEUE = int(os.environ.get('PDF_MAX_QUEUE', 8))  # requests waiting, before answering 429
+
+# result cache params
+RESULT_CACHE_SIZE = int(os.environ.get('PDF_RESULT_CACHE_SIZE', 256 * 1024 * 1024))  # bytes kept in memory
+RESULT_CACHE_DIR = os.environ.get('PDF_RESULT_CACHE_DIR')  # optional on-disk tier
+RESULT_CACHE_DISK_SIZE = int(os.environ.get('PDF_RESULT_CACHE_DISK_SIZE', 2 * 1024 * 1024 * 1024))  # bytes kept on disk
+PAGE_CACHE_SIZE = int(os.environ.get('PDF_PAGE_CACHE_SIZE', extract_text_info.DEFAULT_PAGE_CACHE_SIZE))  # raw pages kept in memory
+# results of each page by content fingerprint, reused across versions of a document; 0 disables them
+PAGE_RESULTS_SIZE = int(os.environ.get('PDF_PAGE_RESULTS_SIZE', 64 * 1024 * 1024))  # bytes kept in memory, on disk too under RESULT_CACHE_DIR/pages
+
+# metrics params
+SERVER_TIMING = os.environ.get('PDF_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')  # add a Server-Timing header to the responses
+SPANS_PER_PAGE_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PDF_SIZE_BUCKETS = (10e3, 100e3, 1e6, 5e6, 10e6, 50e6, 100e6, 500e6)  # bytes
+
+
+class ExtractionPool:
+    """Bounded thread pool running the blocking extraction off the event loop.
+
+    A request takes a slot with acquire() before downloading its PDF, and
+    gives it back with release(). Once `max_workers` requests are running
+    and `max_queue` are waiting, acquire() fails with a 429.
+
+    PyMuPDF does not support multithreaded use, even on separate documents,
+    so the fitz work of every thread of the process is done holding `lock`:
+    run() holds it for the whole call, iterate() while producing each item,
+    and the jobs take it too (see run_job()). The slots bound the requests
+    admitted, not the extraction running at once: that queues on the lock,
+    and uses several CPUs only through the worker processes of a request
+    (PDF_WORKERS) or of a batch (PDF_BATCH_WORKERS).
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='extract')
+        self.max_pending = max_workers + max_queue
+        self.pending = 0  # only touched from the event loop
+        self.lock = threading.RLock()
+
+    def acquire(self):
+        if self.pending >= self.max_pending:
+            raise HTTPException(status_code=429, detail="Too many requests, please retry later.", headers={"Retry-After": "1"})
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+
+    def _locked(self, func, *args, **kwargs):
+        with self.lock:
+            return func(*args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        """Run `func` in the pool, holding the lock."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self._locked, func, *args, **kwargs))
+
+    def locked(self, iterator):
+        """Yield the items of a blocking iterator, holding the lock while each is produced."""
+        done = object()
+        try:
+            while True:
+                with self.lock:
+                    item = next(iterator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            with self.lock:
+                iterator.close()
+
+    async def iterate(self, iterator, locked=True):
+        """Consume a blocking iterator in the pool, then release the slot.
+
+        Args:
+            locked: hold the lock while each item is produced, unless the
+                iterator does its fitz work in other processes.
+        """
+        loop = asyncio.get_running_loop()
+        get_next = self._locked if locked else lambda func, *args: func(*args)
+        done = object()
+        try:
+            while True:
+                item = await loop.run_in_executor(self.executor, get_next, next, iterator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            self.release()
+            # closing the iterator closes its document: in the pool, once the item in progress is done
+            try:
+                self.executor.submit(get_next, iterator.close)
+            except RuntimeError:  # shut down
+                iterator.close()
+
+
+extraction_pool = ExtractionPool(MAX_CONCURRENCY, MAX_QUEUE)
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_DIR, RESULT_CACHE_DISK_SIZE)
+page_cache = extract_text_info.PageCache(PAGE_CACHE_SIZE)
+page_results = ResultCache(PAGE_RESULTS_SIZE, os.path.join(RESULT_CACHE_DIR, 'pages') if RESULT_CACHE_DIR else None, RESULT_CACHE_DISK_SIZE) if PAGE_RESULTS_SIZE else None
+image_store = image_extraction.ImageStore(IMAGE_DIR)
+
+# served at /metrics
+metrics_registry = metrics.Registry()
+requests_total = metrics_registry.register(metrics.Counter('pdf_requests_total', 'Extraction requests, by output type, status code and result cache outcome.', ('output_type', 'status', 'cache')))
+request_seconds = metrics_registry.register(metrics.Histogram('pdf_request_duration_seconds', 'Time to answer an extraction request, by output type.', ('output_type',)))
+stage_seconds = metrics_registry.register(metrics.Histogram('pdf_stage_duration_seconds', 'Time spent per request in download, open, each of extract_text_info.STAGES and serialization.', ('stage',)))
+pages_total = metrics_registry.register(metrics.Counter('pdf_pages_processed_total', 'Pages extracted.'))
+spans_per_page = metrics_registry.register(metrics.Histogram('pdf_spans_per_page', 'Text spans of the extracted pages.', buckets=SPANS_PER_PAGE_BUCKETS))
+pdf_size_bytes = metrics_registry.register(metrics.Histogram('pdf_size_bytes', 'Size of the input PDFs.', buckets=PDF_SIZE_BUCKETS))
+metrics_registry.register(metrics.Gauge('pdf_pool_pending', 'Requests running or waiting in the extraction pool.', function=lambda: extraction_pool.pending))
+metrics_registry.register(metrics.Gauge('pdf_pool_max_pending', 'Requests the extraction pool takes before answering 429.', function=lambda: extraction_pool.max_pending))
+
+http_client: Optional[httpx.AsyncClient] = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(FETCH_TIMEOUT),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        follow_redirects=True,
+    )
+    job_queue.resume()
+    yield
+    await http_client.aclose()
+    extraction_pool.executor.shutdown(wait=False, cancel_futures=True)
+    job_queue.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class RequestMetrics:
+    """Timings and outcome of an extraction request, recorded by finish().
+
+    `timings` gets the seconds spent in download, open, each of
+    extract_text_info.STAGES and serialization.
+    """
+
+    def __init__(self, output_type):
+        self.output_type = str(int(output_type)) if output_type in OUTPUT_MEDIA_TYPES else 'invalid'
+        self.timings = {}
+        self.status = 200
+        self.cache = 'MISS'
+        self.t0 = time.perf_counter()
+
+    @contextmanager
+    def stage(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            extract_text_info.add_timing(self.timings, stage, t0)
+
+    def headers(self):
+        """Return the Server-Timing header of the stages timed so far, if SERVER_TIMING."""
+        if not SERVER_TIMING:
+            return {}
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.timings.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.t0) * 1000:.1f}")
+        return {"Server-Timing": ", ".join(entries)}
+
+    def finish(self):
+        requests_total.inc(output_type=self.output_type, status=self.status, cache=self.cache)
+        request_seconds.observe(time.perf_counter() - self.t0, output_type=self.output_type)
+        for stage, seconds in self.timings.items():
+            stage_seconds.observe(seconds, stage=stage)
+
+
+def observe_page(page_data):
+    pages_total.inc()
+    spans_per_page.observe(len(page_data["texts_models_list"]))
+    return page_data
 
 
 class ProcessRequest(BaseModel):
-    file_url: HttpUrl
+    file_url: Optional[HttpUrl] = None
+    file_path: Optional[str] = None
+    use_clustered_blocks: Optional[bool] = False
+    use_clustered_spans: Optional[bool] = False
+    x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE
+    y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE
+    use_auto_clustering: Optional[bool] = DEFAULT_USE_AUTO_CLUSTERING
+    use_ocr: Optional[bool] = DEFAULT_USE_OCR
+    output_type: Optional[float] = DEFAULT_OUTPUT_TYPE
+    pages: Optional[str] = DEFAULT_PAGES
+    images: Optional[str] = DEFAULT_IMAGES
+    stream: Optional[bool] = False
+
+
+class JobRequest(BaseModel):
+    file_url: Optional[HttpUrl] = None
+    file_path: Optional[str] = None
     use_clustered_blocks: Optional[bool] = False
     use_clustered_spans: Optional[bool] = False
     x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE
     y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE
+    use_auto_clustering: Optional[bool] = DEFAULT_USE_AUTO_CLUSTERING
+    use_ocr: Optional[bool] = DEFAULT_USE_OCR
     output_type: Optional[float] = DEFAULT_OUTPUT_TYPE
+    pages: Optional[str] = None  # all pages: jobs are meant for long documents
+    images: Optional[str] = DEFAULT_IMAGES
+    workers: Optional[int] = DEFAULT_WORKERS
+
+
+class BatchRequest(BaseModel):
+    file_urls: List[HttpUrl]
+    use_clustered_blocks: Optional[bool] = False
+    use_clustered_spans: Optional[bool] = False
+    x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE
+    y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE
+    use_auto_clustering: Optional[bool] = DEFAULT_USE_AUTO_CLUSTERING
+    use_ocr: Optional[bool] = DEFAULT_USE_OCR
+    pages: Optional[str] = DEFAULT_PAGES
+    images: Optional[str] = DEFAULT_IMAGES
 
 
 @app.get("/")
@@ -54,128 +347,441 @@ async def root():
 async def test_page():
     return FileResponse('test.html')
 
-def process_pdf(file_url: str, use_clustered_blocks: Optional[bool] = DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans: Optional[bool] = DEFAULT_USE_CLUSTERED_SPANS, x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE, y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE, output_type: Optional[float] = DEFAULT_OUTPUT_TYPE):
+@app.get("/cache/stats")
+async def cache_stats():
+    return dict(result_cache.info(), pages=page_cache.info(), page_results=page_results.info() if page_results else None)
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics_registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/images/{image_id}")
+async def get_image(image_id: str):
+    """Return an image extracted with images='extraction', by the "image_id" of its image models."""
+    try:
+        path = image_store.path(image_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Image not found: '{image_id}'")
+    # content-addressed, so never stale
+    return FileResponse(path, media_type=image_extraction.media_type(image_id), headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+def check_pdf_request(file_url: str, pages: Optional[str] = DEFAULT_PAGES, images: Optional[str] = DEFAULT_IMAGES, use_ocr: Optional[bool] = DEFAULT_USE_OCR):
+    # Check if the input file has a .pdf extension
+    if not str(file_url).lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Input file must have a .pdf extension")
+
+    # Check the page range before fetching anything
+    try:
+        extract_text_info.parse_page_range(pages, 0)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if images not in extract_text_info.IMAGE_LEVELS:
+        raise HTTPException(status_code=400, detail=f"Invalid images level: '{images}', not one of {', '.join(extract_text_info.IMAGE_LEVELS)}")
+
+    if use_ocr and not ocr.available():
+        raise HTTPException(status_code=400, detail="OCR is not available: Tesseract is not installed on the server")
+
+class SpooledPdf(pdf_download.SpooledPdf):
+    """A pdf_download.SpooledPdf of the API, answering 413 when too large."""
+
+    def __init__(self, max_size=MAX_DOWNLOAD_SIZE, max_memory=SPOOL_MAX_MEMORY, directory=SPOOL_DIR):
+        super().__init__(max_size=max_size, max_memory=max_memory, directory=directory)
+
+    def too_large(self):
+        return HTTPException(status_code=413, detail=f"Input file is larger than {self.max_size} bytes")
+
+async def download_pdf(file_url: str, conditional: bool = False):
+    """Fetch the PDF with the shared async client, streaming its body into a SpooledPdf.
+
+    Returns the (content hash, SpooledPdf) of the PDF. If `conditional`, the
+    validators of the last download are sent along, and a 304 answer gives
+    back (content hash, None) without downloading the body again.
+    """
+    file_url = str(file_url)
+    headers = {}
+    source = result_cache.get_source(file_url) if conditional else None
+    if source:
+        if source["etag"]:
+            headers["If-None-Match"] = source["etag"]
+        if source["last_modified"]:
+            headers["If-Modified-Since"] = source["last_modified"]
+
+    spool = SpooledPdf()
+    try:
+        async with http_client.stream('GET', file_url, headers=headers) as response:
+            if source and response.status_code == 304:
+                result_cache.not_modified()
+                return source["hash"], None
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    pdf_hash = spool.pdf_hash
+    result_cache.put_source(file_url, response.headers.get('etag'), response.headers.get('last-modified'), pdf_hash)
+    return pdf_hash, spool
+
+async def receive_upload(upload: UploadFile):
+    """Copy an uploaded PDF into a SpooledPdf, chunk by chunk.
+
+    Returns the (content hash, SpooledPdf) of the PDF.
+    """
+    spool = SpooledPdf()
+    try:
+        while chunk := await upload.read(READ_CHUNK_SIZE):
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    finally:
+        await upload.close()
+    return spool.pdf_hash, spool
+
+def resolve_local_path(file_path: str):
+    """Return the real path of `file_path`, if it is a file in one of LOCAL_PDF_DIRS."""
+    if not LOCAL_PDF_DIRS:
+        raise HTTPException(status_code=403, detail="Local files are not enabled on this server")
+    path = os.path.realpath(file_path)
+    if not any(os.path.commonpath([path, directory]) == directory for directory in LOCAL_PDF_DIRS):
+        raise HTTPException(status_code=403, detail=f"Input file is outside the allowed directories: '{file_path}'")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Input file not found: '{file_path}'")
+    return path
+
+def file_hash(path: str):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(READ_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def fetch_pdf(file_url: str, pdf_source: Union[bytes, str], pages: Optional[str] = DEFAULT_PAGES):
+    file_url = str(file_url) # force-convert to str
+    check_pdf_request(file_url, pages)
+
+    # Create a Pdf Document object from the fetched content, or from its file
+    if isinstance(pdf_source, str):
+        pdf_document = fitz.open(pdf_source)
+    else:
+        pdf_document = fitz.Document(stream=pdf_source)
+
+    # Generate the output filename
+    input_filename = os.path.basename(file_url)
+    # output_filename = os.path.splitext(input_filename)[0] + '_processed.pdf'
+
+    return pdf_document, pdf_source, input_filename
+
+def log_process_params(file_url, use_clustered_blocks, use_clustered_spans, x_tolerance, y_tolerance, output_type, pages, images, use_auto_clustering, use_ocr):
     logger.debug(f"Processing '{file_url}'")
+    logger.debug(f"Use auto clustering: {use_auto_clustering}")
     logger.debug(f"Use clustered blocks: {use_clustered_blocks}")
     logger.debug(f"Use clustered spans: {use_clustered_spans}")
     if use_clustered_blocks or use_clustered_spans:
         logger.debug(f"  x_tolerance: {x_tolerance}")
         logger.debug(f"  y_tolerance: {y_tolerance}")
     logger.debug(f"Output type: '{OUTPUT_MEDIA_TYPES[output_type]}'")
+    logger.debug(f"Pages: '{pages}'")
+    logger.debug(f"Images: '{images}'")
+    logger.debug(f"Use OCR: {use_ocr}")
 
-    # Check if the input file has a .pdf extension
-    file_url = str(file_url) # force-convert to str
-    if not file_url.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Input file must have a .pdf extension")
+def process_pdf(file_url: str, use_clustered_blocks: Optional[bool] = DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans: Optional[bool] = DEFAULT_USE_CLUSTERED_SPANS, x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE, y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE, output_type: Optional[float] = DEFAULT_OUTPUT_TYPE, pages: Optional[str] = DEFAULT_PAGES, images: Optional[str] = DEFAULT_IMAGES, use_auto_clustering: Optional[bool] = DEFAULT_USE_AUTO_CLUSTERING, use_ocr: Optional[bool] = DEFAULT_USE_OCR, workers: int = DEFAULT_WORKERS, chunk_size: int = DEFAULT_CHUNK_SIZE, pdf_source: Optional[Union[bytes, str]] = None, pdf_hash: Optional[str] = None, timings: Optional[dict] = None):
+    log_process_params(file_url, use_clustered_blocks, use_clustered_spans, x_tolerance, y_tolerance, output_type, pages, images, use_auto_clustering, use_ocr)
 
-    # Fetch the PDF file from the URL
-    response = requests.get(file_url)
-    response.raise_for_status()
-    pdf_content = response.content
+    t0 = time.perf_counter()
+    pdf_document, pdf_source, input_filename = fetch_pdf(file_url, pdf_source, pages=pages)
+    extract_text_info.add_timing(timings, 'open', t0)
 
-    # Create a Pdf Document object from the fetched content
-    pdf_document = fitz.Document(stream=BytesIO(pdf_content))
+    json_data, result_pdf_document = highlight_sentences_in_pdf(pdf_document, use_clustered_blocks=use_clustered_blocks, use_clustered_spans=use_clustered_spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance, workers=workers, chunk_size=chunk_size, pdf_source=pdf_source, pages=pages, page_cache=page_cache, doc_hash=pdf_hash, timings=timings, annotate=output_type == 1, images=images, image_store=image_store, use_auto_clustering=use_auto_clustering, page_results=page_results, use_ocr=use_ocr, ocr_language=OCR_LANGUAGE, ocr_dpi=OCR_DPI, ocr_workers=OCR_WORKERS)
+    for page_data in json_data:
+        observe_page(page_data)
 
-    json_data, result_pdf_document = highlight_sentences_in_pdf(pdf_document, use_clustered_blocks=use_clustered_blocks, use_clustered_spans=use_clustered_spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance)
+    return result_pdf_document, json_data, input_filename
 
-    # Generate the output filename
-    input_filename = os.path.basename(file_url)
-    # output_filename = os.path.splitext(input_filename)[0] + '_processed.pdf'
+def stream_pdf(file_url: str, use_clustered_blocks: Optional[bool] = DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans: Optional[bool] = DEFAULT_USE_CLUSTERED_SPANS, x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE, y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE, output_type: Optional[float] = DEFAULT_OUTPUT_TYPE, pages: Optional[str] = DEFAULT_PAGES, images: Optional[str] = DEFAULT_IMAGES, use_auto_clustering: Optional[bool] = DEFAULT_USE_AUTO_CLUSTERING, use_ocr: Optional[bool] = DEFAULT_USE_OCR, workers: int = DEFAULT_WORKERS, chunk_size: int = DEFAULT_CHUNK_SIZE, pdf_source: Optional[Union[bytes, str]] = None, pdf_hash: Optional[str] = None, timings: Optional[dict] = None):
+    """Like process_pdf(), but return a generator of the page_data of each page.
 
-    return result_pdf_document, json_data, input_filename
+    The PDF is fetched right away, so that fetch errors are raised here.
+    """
+    log_process_params(file_url, use_clustered_blocks, use_clustered_spans, x_tolerance, y_tolerance, output_type, pages, images, use_auto_clustering, use_ocr)
+
+    t0 = time.perf_counter()
+    pdf_document, pdf_source, input_filename = fetch_pdf(file_url, pdf_source, pages=pages)
+    extract_text_info.add_timing(timings, 'open', t0)
+
+    def iter_pages():
+        try:
+            for page_data in iter_highlighted_pages(pdf_document, use_clustered_blocks=use_clustered_blocks, use_clustered_spans=use_clustered_spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance, workers=workers, chunk_size=chunk_size, pdf_source=pdf_source, pages=pages, page_cache=page_cache, doc_hash=pdf_hash, timings=timings, images=images, image_store=image_store, use_auto_clustering=use_auto_clustering, page_results=page_results, use_ocr=use_ocr, ocr_language=OCR_LANGUAGE, ocr_dpi=OCR_DPI, ocr_workers=OCR_WORKERS):
+                yield observe_page(page_data)
+        finally:
+            pdf_document.close()
+
+    return iter_pages()
 
 @app.post("/extract_text")
 async def extract_text_post(request: ProcessRequest):
     if not request:
         raise HTTPException(status_code=400, detail="Missing JSON payload. Please provide 'file_url' in the request body.")
-    res = process_request(
+    res = await process_request(
         file_url=request.file_url,
         use_clustered_blocks=request.use_clustered_blocks,
         use_clustered_spans=request.use_clustered_spans,
         x_tolerance=request.x_tolerance,
         y_tolerance=request.y_tolerance,
-        output_type=request.output_type)
+        use_auto_clustering=request.use_auto_clustering,
+        use_ocr=request.use_ocr,
+        output_type=request.output_type,
+        pages=request.pages,
+        images=request.images,
+        stream=request.stream,
+        file_path=request.file_path)
 
     return res
 
 @app.get("/extract_text")
-async def extract_text_get(file_url: str, use_clustered_blocks: Optional[bool] = DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans: Optional[bool] = DEFAULT_USE_CLUSTERED_SPANS, x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE, y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE, output_type: Optional[float] = DEFAULT_OUTPUT_TYPE):
-    if file_url is None:
+async def extract_text_get(file_url: Optional[str] = None, use_clustered_blocks: Optional[bool] = DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans: Optional[bool] = DEFAULT_USE_CLUSTERED_SPANS, x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE, y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE, use_auto_clustering: Optional[bool] = DEFAULT_USE_AUTO_CLUSTERING, use_ocr: Optional[bool] = DEFAULT_USE_OCR, output_type: Optional[float] = DEFAULT_OUTPUT_TYPE, pages: Optional[str] = DEFAULT_PAGES, images: Optional[str] = DEFAULT_IMAGES, stream: Optional[bool] = False, file_path: Optional[str] = None):
+    if file_url is None and file_path is None:
         raise HTTPException(status_code=400, detail="Missing 'file_url' parameter in the query string.")
-    res = process_request(
+    res = await process_request(
         file_url=file_url,
         use_clustered_blocks=use_clustered_blocks,
         use_clustered_spans=use_clustered_spans,
         x_tolerance=x_tolerance,
         y_tolerance=y_tolerance,
-        output_type=output_type)
+        use_auto_clustering=use_auto_clustering,
+        use_ocr=use_ocr,
+        output_type=output_type,
+        pages=pages,
+        images=images,
+        stream=stream,
+        file_path=file_path)
 
     return res
 
-def process_request(file_url: str, use_clustered_blocks: Optional[bool] = DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans: Optional[bool] = DEFAULT_USE_CLUSTERED_SPANS, x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE, y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE, output_type: Optional[float] = DEFAULT_OUTPUT_TYPE):
+@app.post("/extract_text/upload")
+async def extract_text_upload(file: UploadFile = File(...), use_clustered_blocks: Optional[bool] = Form(DEFAULT_USE_CLUSTERED_BLOCKS), use_clustered_spans: Optional[bool] = Form(DEFAULT_USE_CLUSTERED_SPANS), x_tolerance: Optional[float] = Form(DEFAULT_X_TOLERANCE), y_tolerance: Optional[float] = Form(DEFAULT_Y_TOLERANCE), use_auto_clustering: Optional[bool] = Form(DEFAULT_USE_AUTO_CLUSTERING), use_ocr: Optional[bool] = Form(DEFAULT_USE_OCR), output_type: Optional[float] = Form(DEFAULT_OUTPUT_TYPE), pages: Optional[str] = Form(DEFAULT_PAGES), images: Optional[str] = Form(DEFAULT_IMAGES), stream: Optional[bool] = Form(False)):
+    res = await process_request(
+        use_clustered_blocks=use_clustered_blocks,
+        use_clustered_spans=use_clustered_spans,
+        x_tolerance=x_tolerance,
+        y_tolerance=y_tolerance,
+        use_auto_clustering=use_auto_clustering,
+        use_ocr=use_ocr,
+        output_type=output_type,
+        pages=pages,
+        images=images,
+        stream=stream,
+        upload=file)
+
+    return res
+
+@app.post("/extract_text/batch")
+async def extract_text_batch(request: BatchRequest):
+    """Process many PDFs across a pool of worker processes.
+
+    The response is JSONL: one record per document as it completes (see
+    batch.process_document()), an error record for the documents that
+    failed, and a last {"report": ...} line with the batch throughput.
+    """
+    if not request.file_urls:
+        raise HTTPException(status_code=400, detail="Missing 'file_urls' in the request body.")
+    if len(request.file_urls) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Too many documents in the batch: {len(request.file_urls)} > {MAX_BATCH_SIZE}")
+    file_urls = [str(file_url) for file_url in request.file_urls]
+    for file_url in file_urls:
+        check_pdf_request(file_url, request.pages, request.images, request.use_ocr)
+    extract_args = dict(
+        use_clustered_blocks=request.use_clustered_blocks,
+        use_clustered_spans=request.use_clustered_spans,
+        x_tolerance=request.x_tolerance,
+        y_tolerance=request.y_tolerance,
+        use_auto_clustering=request.use_auto_clustering,
+        use_ocr=request.use_ocr,
+        ocr_language=OCR_LANGUAGE,
+        ocr_dpi=OCR_DPI,
+        pages=request.pages,
+        images=request.images,
+        image_store=image_store if request.images == 'extraction' else None,
+    )
+    logger.debug(f"Processing a batch of {len(file_urls)} documents")
+
+    def stream_batch():
+        stats = batch.BatchStats()
+        for record in batch.iter_batch(file_urls, workers=BATCH_WORKERS, max_download_size=MAX_DOWNLOAD_SIZE, **extract_args):
+            stats.add(record)
+            yield serialization.dumps(record) + b'\n'
+        yield serialization.dumps({"report": stats.report()}) + b'\n'
+
+    # the slot is released by iterate() once streamed
+    extraction_pool.acquire()
+    return StreamingResponse(extraction_pool.iterate(stream_batch(), locked=BATCH_WORKERS <= 1), media_type=OUTPUT_MEDIA_TYPES[3])
+
+def stream_output(pages_data, output_type, timings=None):
+    """Yield the output of `output_type` page by page, as bytes.
+
+    The seconds spent serializing are added to timings['serialization'].
+    """
+    if output_type == 3:
+        try:
+            for page in pages_data:
+                t0 = time.perf_counter()
+                chunk = serialization.dumps(page) + b'\n'
+                extract_text_info.add_timing(timings, 'serialization', t0)
+                yield chunk
+        except Exception as e:
+            logger.exception("Streaming failed")
+            yield serialization.dumps({"error": str(e)}) + b'\n'
+    else:
+        yield HTML_HEAD.encode()
+        try:
+            for page in pages_data:
+                t0 = time.perf_counter()
+                chunk = serialization.html_page(page).encode()
+                extract_text_info.add_timing(timings, 'serialization', t0)
+                yield chunk
+        except Exception:
+            logger.exception("Streaming failed")
+        yield b'</html>'
+
+def cache_stream(pages_data, output_type, cache_key, timings=None):
+    """Like stream_output(), but also cache the whole output once all pages went through."""
+    completed = False
+
+    def iter_pages():
+        nonlocal completed
+        yield from pages_data
+        completed = True
+
+    chunks = []
+    for chunk in stream_output(iter_pages(), output_type, timings=timings):
+        chunks.append(chunk)
+        yield chunk
+    if completed:
+        result_cache.put(cache_key, b''.join(chunks))
+
+def serialize_output(output_pdf, output_data, output_type: float, timings: Optional[dict] = None):
+    """Return the output of `output_type` as bytes, from the annotated PDF and page data of process_pdf()."""
+    t0 = time.perf_counter()
+    if output_type == 0:
+        output_data = serialization.dumps(output_data)
+    elif output_type in (2, 3):  # text only, or JSONL when not streamed
+        output_data = b''.join(stream_output(output_data, output_type))
+    elif output_type == 4:
+        output_data = serialization.dumps(compact_output.encode(output_data))
+    elif output_type == 5:
+        output_data = compact_output.to_msgpack(compact_output.encode(output_data))
+    else:
+        output_data = output_pdf.write()
+    extract_text_info.add_timing(timings, 'serialization', t0)
+
+    return output_data
+
+def render_output(file_url: str, pdf_source: Union[bytes, str], output_type: float, timings: Optional[dict] = None, **process_args):
+    output_pdf, output_data, input_filename = process_pdf(file_url, output_type=output_type, pdf_source=pdf_source, timings=timings, **process_args)
+    output_data = serialize_output(output_pdf, output_data, output_type, timings=timings)
+    output_pdf.close()
+
+    return output_data
+
+async def process_request(file_url: Optional[str] = None, use_clustered_blocks: Optional[bool] = DEFAULT_USE_CLUSTERED_BLOCKS, use_clustered_spans: Optional[bool] = DEFAULT_USE_CLUSTERED_SPANS, x_tolerance: Optional[float] = DEFAULT_X_TOLERANCE, y_tolerance: Optional[float] = DEFAULT_Y_TOLERANCE, use_auto_clustering: Optional[bool] = DEFAULT_USE_AUTO_CLUSTERING, use_ocr: Optional[bool] = DEFAULT_USE_OCR, output_type: Optional[float] = DEFAULT_OUTPUT_TYPE, pages: Optional[str] = DEFAULT_PAGES, images: Optional[str] = DEFAULT_IMAGES, stream: Optional[bool] = False, file_path: Optional[str] = None, upload: Optional[UploadFile] = None):
+    """Process the PDF at `file_url`, at the server-side `file_path`, or uploaded as `upload`."""
+    request_metrics = RequestMetrics(output_type)
+    streaming = False
     try:
-        output_pdf, output_data, input_filename = process_pdf(file_url, use_clustered_blocks=use_clustered_blocks, use_clustered_spans=use_clustered_spans, x_tolerance=x_tolerance, y_tolerance=y_tolerance, output_type=output_type)
-
-        if output_type == 0:
-            output_data = json.dumps(
-                output_data,
-                # indent=2
-            )
-        elif output_type == 2:  # text only
-            page_blocks = []
-            for page_idx, page in enumerate(output_data):
-                text_blocks = []
-                page_number = page["page_number"]
-                page_block = {"page": page_number, "texts": text_blocks}
-                for block in page["blocks"]:
-                    text_blocks.append(block["text"])
-                page_blocks.append(page_block)
-
-            output_data = '''
-<html>
-  <head>
-    <meta charset="UTF-8">
-    <style>
-    body {
-      font-family: monospace;
-    }
-    .page {
-      margin-top: 1em;
-      font-size: 1.2em;
-      font-weight: bold;
-    }
-    .text-caption {
-      margin-left: 1em;
-      margin-top: .75em;
-      font-weight: bold;
-    }
-    .text {
-      margin-left: 1em;
-      margin-top:.2em;
-      border:1px solid #1d1;
-    }
-    </style>
-  </head>'''
-            for page_block in page_blocks:
-                output_data += f'<div class="page">Page {page_block["page"]}</div>'
-                for text_idx, text in enumerate(page_block["texts"]):
-                    output_data += f'<div class="text-caption">#{text_idx + 1}</div>'
-                    output_data += f'<div class="text">{text}</div>'
-            output_data += f'</html>'
+        if output_type not in OUTPUT_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Invalid output_type: {output_type}")
+        media_type = OUTPUT_MEDIA_TYPES[output_type]
+        if upload is not None:
+            input_name = upload.filename or ''
+        elif file_path is not None:
+            input_name = file_path
+        elif file_url is not None:
+            input_name = str(file_url)
+        else:
+            raise HTTPException(status_code=400, detail="Missing 'file_url' or 'file_path' parameter.")
+        check_pdf_request(input_name, pages, images, use_ocr)
+        process_args = dict(
+            use_clustered_blocks=use_clustered_blocks,
+            use_clustered_spans=use_clustered_spans,
+            x_tolerance=x_tolerance,
+            y_tolerance=y_tolerance,
+            use_auto_clustering=use_auto_clustering,
+            use_ocr=use_ocr,
+            pages=pages,
+            images=images,
+        )
 
+        def cached_response(output_data):
+            request_metrics.cache = 'HIT'
+            return Response(content=output_data, media_type=media_type, headers={"X-Cache": "HIT", **request_metrics.headers()})
+
+        async def finish_stream(chunks):
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                request_metrics.finish()
+
+        # the slot is held until the output is fully produced
+        extraction_pool.acquire()
+        spool = None
+        try:
+            with request_metrics.stage('download'):
+                if upload is not None:
+                    pdf_hash, spool = await receive_upload(upload)
+                elif file_path is not None:
+                    pdf_source = resolve_local_path(file_path)
+                    pdf_hash = await asyncio.to_thread(file_hash, pdf_source)
+                    pdf_size_bytes.observe(os.path.getsize(pdf_source))
+                else:
+                    # unchanged files are not downloaded again, and need no processing if their output is cached
+                    pdf_hash, spool = await download_pdf(file_url, conditional=True)
+            cache_key = result_key(pdf_hash, output_type=int(output_type), **process_args)
+            output_data = await asyncio.to_thread(result_cache.get, cache_key)
+            if output_data is not None:
+                return cached_response(output_data)
+            if upload is None and file_path is None and spool is None:
+                cached_hash = pdf_hash
+                with request_metrics.stage('download'):
+                    pdf_hash, spool = await download_pdf(file_url)
+                if pdf_hash != cached_hash:  # changed after all
+                    cache_key = result_key(pdf_hash, output_type=int(output_type), **process_args)
+                    output_data = await asyncio.to_thread(result_cache.get, cache_key)
+                    if output_data is not None:
+                        return cached_response(output_data)
+            if spool is not None:
+                pdf_hash, pdf_source = spool.finish()
+                pdf_size_bytes.observe(spool.size)
+
+            if output_type in STREAMED_OUTPUT_TYPES or (stream and output_type == 2):
+                pages_data = await extraction_pool.run(stream_pdf, input_name, output_type=output_type, pdf_source=pdf_source, pdf_hash=pdf_hash, timings=request_metrics.timings, **process_args)
+                streaming = True  # the slot is released by iterate() once streamed, the spool removed and the metrics recorded after the response
+                # Server-Timing only covers what happened before streaming
+                return StreamingResponse(finish_stream(extraction_pool.iterate(cache_stream(pages_data, output_type, cache_key, timings=request_metrics.timings))), media_type=media_type, headers={"X-Cache": "MISS", **request_metrics.headers()}, background=BackgroundTask(spool.close) if spool else None)
+
+            output_data = await extraction_pool.run(render_output, input_name, pdf_source, output_type, pdf_hash=pdf_hash, timings=request_metrics.timings, **process_args)
+            await asyncio.to_thread(result_cache.put, cache_key, output_data)
+        finally:
+            if not streaming:
+                extraction_pool.release()
+                if spool is not None:
+                    spool.close()
 
         # Return the PDF as a downloadable file along with the response message
-        media_type = OUTPUT_MEDIA_TYPES[output_type]
         # output_filename = os.path.splitext(input_filename)[0] + f"{HIGHLIGHTED_SUFFIX}.pdf"
         headers = {
             # "Content-Disposition": f"attachment; filename={output_filename}",
             "Content-Type": media_type,
+            "X-Cache": "MISS",
+            **request_metrics.headers(),
         }
 
         # Prepare the response message
-        # breakpoint()
         response_data = Response(
-            content=output_pdf.write() if 'pdf' in media_type else output_data,
+            content=output_data,
             media_type=media_type,
             headers=headers,
         )
@@ -183,9 +789,147 @@ def process_request(file_url: str, use_clustered_blocks: Optional[bool] = DEFAUL
         return response_data
 
     except HTTPException as he:
+        request_metrics.status = he.status_code
         raise he
     except Exception as e:
+        request_metrics.status = 500
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not streaming:
+            request_metrics.finish()
+
+def run_job(job, pdf_source, progress, cancelled):
+    """Run an extraction job of job_queue, page by page, returning its output."""
+    params = dict(job["params"])
+    output_type = params.pop("output_type")
+    workers = params.pop("workers")
+    if params.pop("input") == 'path':
+        pdf_source = resolve_local_path(job["source"])
+    log_process_params(job["source"], params["use_clustered_blocks"], params["use_clustered_spans"], params["x_tolerance"], params["y_tolerance"], output_type, params["pages"], params["images"], params["use_auto_clustering"], params["use_ocr"])
+
+    spool = None
+    if pdf_source is None:
+        check_pdf_request(job["source"], params["pages"])
+        # capped and spooled like the downloads of the requests, not holding the fitz lock
+        spool = pdf_download.download(job["source"], SpooledPdf(), FETCH_TIMEOUT)
+        _, pdf_source = spool.finish()
+
+    try:
+        # fitz work is done holding the lock of the extraction pool, see ExtractionPool
+        with extraction_pool.lock:
+            pdf_document, pdf_source, input_filename = fetch_pdf(job["source"], pdf_source, pages=params["pages"])
+            pages_total = len(extract_text_info.parse_page_range(params["pages"], pdf_document.page_count))
+        # results of the pages done before a restart are taken from page_results
+        pages = extraction_pool.locked(iter_highlighted_pages(pdf_document, workers=workers, chunk_size=DEFAULT_CHUNK_SIZE, pdf_source=pdf_source, annotate=output_type == 1, image_store=image_store, page_results=page_results, ocr_language=OCR_LANGUAGE, ocr_dpi=OCR_DPI, ocr_workers=OCR_WORKERS, **params))
+        try:
+            progress(0, pages_total)
+            pages_data = []
+            for page_data in pages:
+                pages_data.append(observe_page(page_data))
+                progress(len(pages_data), pages_total)
+                if cancelled.is_set():
+                    raise jobs.JobCancelled()
+            with extraction_pool.lock:
+                return serialize_output(pdf_document, pages_data, output_type)
+        finally:
+            pages.close()
+            with extraction_pool.lock:
+                pdf_document.close()
+    finally:
+        if spool is not None:
+            spool.close()
+
+job_queue = jobs.JobQueue(jobs.SQLiteJobStore(JOB_DIR) if JOB_DIR else jobs.MemoryJobStore(max_result_bytes=JOB_RESULTS_SIZE), run_job, max_jobs=MAX_JOBS)
+
+async def submit_job(input_name: str, output_type: float, workers: Optional[int], file_path: Optional[str] = None, upload: Optional[UploadFile] = None, **process_args):
+    if output_type not in OUTPUT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid output_type: {output_type}")
+    check_pdf_request(input_name, process_args["pages"], process_args["images"], process_args["use_ocr"])
+    params = dict(process_args, output_type=int(output_type), workers=max(1, min(workers or DEFAULT_WORKERS, MAX_JOB_WORKERS)))
+    if upload is not None:
+        _, spool = await receive_upload(upload)
+        try:
+            _, pdf_source = spool.finish()
+            job = await asyncio.to_thread(job_queue.submit, input_name, dict(params, input='upload'), pdf=pdf_source)
+        finally:
+            spool.close()
+    elif file_path is not None:
+        job = await asyncio.to_thread(job_queue.submit, resolve_local_path(file_path), dict(params, input='path'))
+    else:
+        job = await asyncio.to_thread(job_queue.submit, input_name, dict(params, input='url'))
+    logger.debug(f"Queued job {job['id']} for '{input_name}'")
+    return JSONResponse(job, status_code=202)
+
+def get_job_or_404(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: '{job_id}'")
+    return job
+
+@app.post("/jobs")
+async def create_job(request: JobRequest):
+    """Queue the extraction of a PDF, answering with the job right away.
+
+    Its progress is polled at /jobs/{job_id}, and its output fetched at
+    /jobs/{job_id}/result once its state is "done".
+    """
+    if request.file_url is None and request.file_path is None:
+        raise HTTPException(status_code=400, detail="Missing 'file_url' or 'file_path' in the request body.")
+    return await submit_job(
+        str(request.file_url) if request.file_path is None else request.file_path,
+        output_type=request.output_type,
+        workers=request.workers,
+        file_path=request.file_path,
+        use_clustered_blocks=request.use_clustered_blocks,
+        use_clustered_spans=request.use_clustered_spans,
+        x_tolerance=request.x_tolerance,
+        y_tolerance=request.y_tolerance,
+        use_auto_clustering=request.use_auto_clustering,
+        use_ocr=request.use_ocr,
+        pages=request.pages,
+        images=request.images)
+
+@app.post("/jobs/upload")
+async def create_job_upload(file: UploadFile = File(...), use_clustered_blocks: Optional[bool] = Form(DEFAULT_USE_CLUSTERED_BLOCKS), use_clustered_spans: Optional[bool] = Form(DEFAULT_USE_CLUSTERED_SPANS), x_tolerance: Optional[float] = Form(DEFAULT_X_TOLERANCE), y_tolerance: Optional[float] = Form(DEFAULT_Y_TOLERANCE), use_auto_clustering: Optional[bool] = Form(DEFAULT_USE_AUTO_CLUSTERING), use_ocr: Optional[bool] = Form(DEFAULT_USE_OCR), output_type: Optional[float] = Form(DEFAULT_OUTPUT_TYPE), pages: Optional[str] = Form(None), images: Optional[str] = Form(DEFAULT_IMAGES), workers: Optional[int] = Form(DEFAULT_WORKERS)):
+    return await submit_job(
+        file.filename or '',
+        output_type=output_type,
+        workers=workers,
+        upload=file,
+        use_clustered_blocks=use_clustered_blocks,
+        use_clustered_spans=use_clustered_spans,
+        x_tolerance=x_tolerance,
+        y_tolerance=y_tolerance,
+        use_auto_clustering=use_auto_clustering,
+        use_ocr=use_ocr,
+        pages=pages,
+        images=images)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return get_job_or_404(job_id)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job["state"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['state']}" + (f": {job['error']}" if job["error"] else ""))
+    output_data = await asyncio.to_thread(job_queue.store.get_result, job_id)
+    if output_data is None:
+        raise HTTPException(status_code=404, detail=f"Job result not found: '{job_id}'")
+    return Response(content=output_data, media_type=OUTPUT_MEDIA_TYPES[job["params"]["output_type"]])
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    return await asyncio.to_thread(job_queue.cancel, job_id)
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancel a job if not finished, and remove it with its result."""
+    get_job_or_404(job_id)
+    await asyncio.to_thread(job_queue.delete, job_id)
+    return {"id": job_id, "deleted": True}
 
 if __name__ == "__main__":
     import uvicorn
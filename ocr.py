@@ -0,0 +1,135 @@
+"""OCR of the scanned pages of a PDF, with a local Tesseract install.
+
+Pages are triaged first, cheaply: only those without a text layer and
+mostly covered by images, see needs_ocr(), are OCRed. MuPDF renders the
+page and Tesseract turns the pixmap into a one-page PDF with an invisible
+text layer (see ocr_page()), whose bytes can be sent across processes and
+kept in a page cache. text_blocks() reads that text layer back in the
+coordinates of the page, for the whole page or clipped to a rect, so a page
+is OCRed once whatever the clustering does with it.
+"""
+import fitz  # PyMuPDF
+import functools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+import worker_documents
+
+
+DEFAULT_LANGUAGE = 'eng'  # Tesseract languages, like "eng+deu"
+DEFAULT_DPI = 300
+# fraction of the page images must cover for a page without text to be OCRed
+DEFAULT_MIN_IMAGE_COVERAGE = 0.5
+DEFAULT_WORKERS = 1  # no worker processes
+
+# cells per side of the grid image coverage is measured on
+COVERAGE_GRID = 64
+
+
+@functools.lru_cache(maxsize=None)
+def tessdata() -> Optional[str]:
+    """Return the tessdata directory of the Tesseract install, None if there is none."""
+    path = os.environ.get('TESSDATA_PREFIX') or fitz.get_tessdata()
+    return path or None
+
+
+def available() -> bool:
+    """Tell whether Tesseract is installed, and OCR possible."""
+    return tessdata() is not None
+
+
+def image_coverage(page, image_info) -> float:
+    """Return the fraction of the page covered by the images of `image_info`."""
+    rect = page.rect
+    if rect.is_empty:
+        return 0.0
+    covered = np.zeros((COVERAGE_GRID, COVERAGE_GRID), dtype=bool)
+    scale_x, scale_y = COVERAGE_GRID / rect.width, COVERAGE_GRID / rect.height
+    for info in image_info:
+        bbox = fitz.Rect(info['bbox']) & rect
+        if bbox.is_empty:
+            continue
+        covered[round((bbox.y0 - rect.y0) * scale_y):round((bbox.y1 - rect.y0) * scale_y),
+                round((bbox.x0 - rect.x0) * scale_x):round((bbox.x1 - rect.x0) * scale_x)] = True
+    return float(covered.mean())
+
+
+def needs_ocr(page, min_image_coverage: float = DEFAULT_MIN_IMAGE_COVERAGE, image_info=None) -> bool:
+    """Tell whether a page looks scanned: no text layer, and mostly images.
+
+    A page without fonts in its resources has no text layer; that check
+    needs no extraction, so digital pages are told apart at no cost.
+
+    Args:
+        image_info: `page.get_image_info()`, if already there.
+    """
+    if page.get_fonts():
+        return False
+    if image_info is None:
+        image_info = page.get_image_info()
+    return image_coverage(page, image_info) >= min_image_coverage
+
+
+def ocr_page(page, language: str = DEFAULT_LANGUAGE, dpi: int = DEFAULT_DPI) -> bytes:
+    """OCR a page, returning the bytes of a one-page PDF of its image with the recognized text.
+
+    Raises:
+        RuntimeError: if Tesseract is not installed.
+    """
+    if not available():
+        raise RuntimeError("OCR needs Tesseract: install it, or set TESSDATA_PREFIX to its tessdata directory")
+    pix = page.get_pixmap(dpi=dpi, annots=False)
+    return pix.pdfocr_tobytes(compress=True, language=language, tessdata=tessdata())
+
+
+def text_blocks(ocr_document, page, clip=None, flags=None, sort=True):
+    """Return the text blocks of an OCRed page, like `page.get_text("dict", clip=clip)["blocks"]`.
+
+    Args:
+        ocr_document: the PDF returned by ocr_page() for `page`, opened.
+        clip: rect of `page` to restrict the text to.
+    """
+    ocr_page = ocr_document[0]
+    # from the rendered page back to the page coordinates, as page.get_textpage_ocr() does
+    unzoom = page.rect.width / ocr_page.rect.width
+    matrix = fitz.Matrix(unzoom, unzoom) * page.derotation_matrix
+    textpage = ocr_page.get_textpage(clip=clip, flags=fitz.TEXTFLAGS_DICT if flags is None else flags, matrix=matrix)
+    return [block for block in textpage.extractDICT(sort=sort)["blocks"] if block['type'] == 0]
+
+
+def _ocr_page_worker(page_number, ocr_args):
+    return ocr_page(worker_documents.document[page_number], **ocr_args)
+
+
+def ocr_pages(pdf_document, page_numbers, workers: int = DEFAULT_WORKERS, pdf_source=None, **ocr_args):
+    """Yield the ocr_page() of `page_numbers`, in order.
+
+    With `workers` > 1, pages are OCRed by worker processes opening their
+    own copy of the document, from `pdf_source` (path or bytes) if given.
+    At most two pages per worker are in flight, so that the OCR runs ahead
+    of the caller without piling up.
+    """
+    page_numbers = list(page_numbers)
+    if workers <= 1 or len(page_numbers) <= 1:
+        for page_number in page_numbers:
+            yield ocr_page(pdf_document[page_number], **ocr_args)
+        return
+
+    if pdf_source is None:
+        pdf_source = worker_documents.pdf_source_of(pdf_document)
+    with ProcessPoolExecutor(max_workers=min(workers, len(page_numbers)), initializer=worker_documents.init_worker, initargs=(pdf_source,)) as executor:
+        pending = deque()
+        try:
+            for page_number in page_numbers:
+                pending.append(executor.submit(_ocr_page_worker, page_number, ocr_args))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
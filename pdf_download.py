@@ -0,0 +1,102 @@
+"""PDFs received in chunks, capped in size and spooled to disk.
+
+SpooledPdf takes the chunks of a download or an upload, and download()
+fetches a URL into one with requests, for the code which does not run on
+the event loop of the API: the batch workers and the jobs.
+"""
+import hashlib
+import os
+import tempfile
+
+import requests
+
+
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024  # bytes
+DEFAULT_MAX_MEMORY = 8 * 1024 * 1024  # bytes kept in memory before spooling to disk
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class PdfTooLarge(ValueError):
+    """Raised when a PDF is larger than the `max_size` of its SpooledPdf."""
+
+
+class SpooledPdf:
+    """A PDF received in chunks.
+
+    It is kept in memory up to `max_memory` bytes, then in a temporary file,
+    so that large PDFs are opened by MuPDF from disk instead of holding
+    their bytes in memory. Its content hash is computed as chunks arrive.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_memory=DEFAULT_MAX_MEMORY, directory=None):
+        self.max_size = max_size
+        self.max_memory = max_memory
+        self.directory = directory
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._chunks = []
+        self._file = None
+        self.path = None
+
+    @property
+    def pdf_hash(self):
+        return self._hash.hexdigest()
+
+    def too_large(self):
+        """Return the exception raised when the PDF gets larger than `max_size`."""
+        return PdfTooLarge(f"Input file is larger than {self.max_size} bytes")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise self.too_large()
+        self._hash.update(chunk)
+        if self._file is None and self.size > self.max_memory:
+            self._file = tempfile.NamedTemporaryFile(suffix='.pdf', dir=self.directory, delete=False)
+            self.path = self._file.name
+            self._file.writelines(self._chunks)
+            self._chunks = []
+        if self._file is None:
+            self._chunks.append(chunk)
+        else:
+            self._file.write(chunk)
+
+    def finish(self):
+        """Return the (content hash, source) of the PDF, source being the
+        path of the temporary file or the PDF bytes, as fitz.open() and
+        the extraction workers take them."""
+        if self._file is not None:
+            self._file.close()
+            return self.pdf_hash, self.path
+        pdf_content = b''.join(self._chunks)
+        self._chunks = []
+        return self.pdf_hash, pdf_content
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self._file = None
+
+
+def download(url, spool, timeout):
+    """Fetch a PDF with requests, streaming its body into `spool`, a SpooledPdf.
+
+    `timeout` bounds the connection and each read, in seconds. The spool is
+    closed if the download fails.
+
+    Returns:
+        `spool`, to finish() and close() once the PDF is opened.
+    """
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(READ_CHUNK_SIZE):
+                spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger('uvicorn.error')
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_SOURCES = 10000
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def result_key(pdf_hash: str, **params) -> str:
+    """Return the cache key of a result, from the PDF hash and the params it depends on."""
+    return hashlib.sha256(json.dumps([pdf_hash, params], sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed cache of rendered results.
+
+    Results are kept in an in-memory LRU bounded by their total size in bytes,
+    and optionally written through to a directory, bounded too, which serves
+    the results evicted from memory (and survives restarts). The size and
+    recency of the files there are indexed in memory, from a scan of the
+    directory at startup, so that writes evict without listing it again.
+
+    The cache also remembers the ETag / Last-Modified validators and content
+    hash of the source URLs, so that unchanged files need not be downloaded
+    again.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, directory: Optional[str] = None, disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES, max_sources: int = DEFAULT_MAX_SOURCES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.max_sources = max_sources
+        self._entries = OrderedDict()
+        self._sources = OrderedDict()
+        self._size = 0
+        self._disk_entries = OrderedDict()  # key -> size of the files in `directory`, least recently used first
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+            "not_modified": 0,
+        }
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_load()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            if len(value) <= self.max_bytes:
+                self._memory_put(key, value)
+        return value
+
+    def contains(self, key: str) -> bool:
+        """Tell whether a result is cached, without reading it nor counting a hit."""
+        with self._lock:
+            if key in self._entries:
+                return True
+            if key in self._disk_entries:
+                return True
+        return bool(self.directory) and os.path.isfile(self._disk_path(key))
+
+    def put(self, key: str, value: bytes):
+        if len(value) <= self.max_bytes:
+            with self._lock:
+                self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key, value):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _disk_load(self):
+        """Index the files of the directory, oldest first."""
+        with os.scandir(self.directory) as it:
+            files = []
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk_entries[key] = size
+            self._disk_size += size
+
+    def _disk_index(self, key, size):
+        """Record a file as the most recently used one, returning the files to evict, under the lock."""
+        self._disk_size += size - self._disk_entries.pop(key, 0)
+        self._disk_entries[key] = size
+        evicted = []
+        while self._disk_size > self.disk_max_bytes and len(self._disk_entries) > 1:
+            evicted_key, evicted_size = self._disk_entries.popitem(last=False)
+            self._disk_size -= evicted_size
+            evicted.append(evicted_key)
+        return evicted
+
+    def _disk_get(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_size -= self._disk_entries.pop(key, 0)
+            return None
+        os.utime(self._disk_path(key))  # most recently used, after a restart too
+        with self._lock:
+            # files written by another process sharing the directory are indexed when read
+            evicted = self._disk_index(key, len(value))
+        self._disk_evict(evicted)
+        return value
+
+    def _disk_put(self, key, value):
+        if not self.directory or len(value) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            # a temporary file of its own, so that concurrent puts of a key do not mix their writes
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Cannot write result cache entry '{path}': {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+            return
+        with self._lock:
+            evicted = self._disk_index(key, len(value))
+        self._disk_evict(evicted)
+
+    def _disk_evict(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                self.stats["disk_evictions"] += 1
+
+    def get_source(self, url: str) -> Optional[dict]:
+        """Return the {"etag", "last_modified", "hash"} last seen for `url`."""
+        with self._lock:
+            return self._sources.get(url)
+
+    def put_source(self, url: str, etag: Optional[str], last_modified: Optional[str], pdf_hash: str):
+        with self._lock:
+            self._sources.pop(url, None)
+            if etag or last_modified:
+                self._sources[url] = {"etag": etag, "last_modified": last_modified, "hash": pdf_hash}
+                while len(self._sources) > self.max_sources:
+                    self._sources.popitem(last=False)
+
+    def not_modified(self):
+        with self._lock:
+            self.stats["not_modified"] += 1
+
+    def info(self) -> dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._size, max_bytes=self.max_bytes, directory=self.directory, disk_entries=len(self._disk_entries), disk_bytes=self._disk_size)
@@ -0,0 +1,32 @@
+"""Serialization of the extraction output.
+
+dumps() returns JSON as bytes, using orjson when installed and the json
+module otherwise. Both give the same document, orjson without the spaces
+after separators and with non-ASCII characters left unescaped.
+
+html_page() returns the HTML of a page_data, with the text of its blocks
+escaped.
+"""
+import html
+import json
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
+
+def dumps(obj):
+    """Return the JSON of `obj`, as UTF-8 bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def html_page(page):
+    """Return the HTML of the page number and of the text blocks of a page_data."""
+    parts = [f'<div class="page">Page {page["page_number"]}</div>']
+    for text_idx, block in enumerate(page["blocks"]):
+        parts.append(f'<div class="text-caption">#{text_idx + 1}</div>')
+        parts.append(f'<div class="text">{html.escape(block["text"])}</div>')
+    return ''.join(parts)
@@ -0,0 +1,282 @@
+"""Warm worker pool, and its command line client.
+
+Each run of extract_text_info.py pays for starting Python and importing
+PyMuPDF and numpy before the first page is read, which is most of the time
+spent on a small PDF. `serve` starts long-lived worker processes which do
+that once: the server imports the extraction modules and warms them up on
+a blank page, then forks the workers, which share those pages. Each worker
+keeps an LRU of the documents it opened, by content hash, so a file
+extracted again is not parsed again, and a PageCache of their pages.
+
+`extract` sends a file to the server over a local socket, with the options
+of extract_text_info.py, and writes the same outputs. The client imports
+nothing but the standard library, so it starts in a few milliseconds.
+
+Usage:
+    python warm_worker.py serve [--workers 2] [--socket PATH]
+    python warm_worker.py extract input.pdf [--annotate] [--pages 1-] ...
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger('uvicorn.error')
+
+
+DEFAULT_SOCKET = os.environ.get('PDF_WARM_SOCKET', os.path.join(tempfile.gettempdir(), 'pdf_warm_worker.sock'))
+DEFAULT_WORKERS = 2
+DEFAULT_BACKLOG = 64
+DEFAULT_DOCUMENT_CACHE_SIZE = 8  # open documents kept by each worker
+DEFAULT_PAGE_CACHE_SIZE = 256  # pages kept by each worker
+DEFAULT_TIMEOUT = 600  # seconds the client waits for a result
+
+# options of extract_text_info.extract_file() a client may send
+EXTRACT_OPTIONS = (
+    'output_pdf', 'annotate', 'compact', 'pages', 'workers', 'chunk_size',
+    'use_auto_clustering', 'page_results_dir', 'use_ocr', 'ocr_language',
+    'ocr_dpi', 'ocr_workers', 'images', 'image_dir',
+)
+
+
+def _recv_line(conn):
+    """Read a newline-terminated message from a socket, None if closed first."""
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            return json.loads(b''.join(chunks))
+
+
+def _send_line(conn, message):
+    conn.sendall(json.dumps(message).encode() + b'\n')
+
+
+class Worker:
+    """Extracts the files of requests, keeping their documents open across requests."""
+
+    def __init__(self, document_cache_size=DEFAULT_DOCUMENT_CACHE_SIZE, page_cache_size=DEFAULT_PAGE_CACHE_SIZE):
+        import extract_text_info
+        self.extract_text_info = extract_text_info
+        self.documents = extract_text_info.DocumentCache(document_cache_size)
+        self.page_cache = extract_text_info.PageCache(page_cache_size)
+
+    def extract(self, input_pdf, **options):
+        """Extract a file like extract_text_info.extract_file(), returning the response of the request."""
+        import fitz  # PyMuPDF, imported by extract_text_info already
+        t0 = time.perf_counter()
+        with open(input_pdf, 'rb') as f:
+            pdf_bytes = f.read()
+        doc_hash = hashlib.sha256(pdf_bytes).hexdigest()
+
+        # annotations are added to the document: an annotated copy is opened, and not kept
+        annotate = options.get('annotate') or options.get('output_pdf') is not None
+        pdf_document = None if annotate else self.documents.take(doc_hash)
+        if pdf_document is None:
+            pdf_document = fitz.Document(stream=pdf_bytes)
+        try:
+            json_data, outputs = self.extract_text_info.extract_file(input_pdf, pdf_document=pdf_document, page_cache=self.page_cache, doc_hash=doc_hash, **options)
+        except BaseException:
+            pdf_document.close()
+            raise
+        if annotate:
+            pdf_document.close()
+        else:
+            self.documents.put(doc_hash, pdf_document)
+
+        return dict(
+            outputs,
+            pages=len(json_data),
+            use_clustered_blocks=json_data[-1].get('use_clustered_blocks', False) if json_data else False,
+            elapsed=time.perf_counter() - t0,
+            document_cache=self.documents.info(),
+            page_cache=self.page_cache.info(),
+        )
+
+    def handle(self, conn):
+        request = _recv_line(conn)
+        if request is None:
+            return
+        try:
+            options = {key: value for key, value in request.items() if key in EXTRACT_OPTIONS}
+            response = self.extract(request['input_pdf'], **options)
+        except Exception as e:
+            logger.exception(f"Extraction of {request.get('input_pdf')} failed")
+            response = {"error": f"{type(e).__name__}: {e}"}
+        _send_line(conn, response)
+
+    def serve_forever(self, server):
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    self.handle(conn)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Dropped request: {e}")
+
+
+def warm_up():
+    """Run an extraction of a blank page, so that the lazy setup of PyMuPDF is done before forking."""
+    import fitz  # PyMuPDF
+    import extract_text_info
+    pdf_document = fitz.open()
+    page = pdf_document.new_page()
+    page.insert_text((72, 72), 'Warm up.')
+    extract_text_info.highlight_sentences_in_pdf(pdf_document, pages='1-', annotate=True)
+    pdf_document.close()
+
+
+def _fork_worker(server, args):
+    pid = os.fork()
+    if pid:
+        return pid
+    # in the worker
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the server stops the workers
+    try:
+        Worker(args.document_cache_size, args.page_cache_size).serve_forever(server)
+    except BaseException:
+        logger.exception("Worker failed")
+    finally:
+        os._exit(1)
+
+
+def serve(args):
+    """Listen on `args.socket`, with `args.workers` pre-forked workers, restarting those that die."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    t0 = time.perf_counter()
+    warm_up()
+    logger.info(f"Warmed up in {time.perf_counter() - t0:.2f}s")
+
+    if os.path.exists(args.socket):
+        try:
+            socket.socket(socket.AF_UNIX).connect(args.socket)
+        except OSError:
+            os.remove(args.socket)  # left by a server which did not stop cleanly
+        else:
+            sys.exit(f"A server is already listening on {args.socket}")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(args.socket)
+    os.chmod(args.socket, 0o600)
+    server.listen(DEFAULT_BACKLOG)
+
+    def stop(signum, frame):
+        raise SystemExit(0)  # waitpid() is not interrupted otherwise
+
+    signal.signal(signal.SIGTERM, stop)
+    workers = set()
+    try:
+        for _ in range(args.workers):
+            workers.add(_fork_worker(server, args))
+        logger.info(f"Listening on {args.socket} with {len(workers)} workers")
+        while workers:
+            pid, status = os.waitpid(-1, 0)
+            workers.discard(pid)
+            logger.warning(f"Worker {pid} exited with status {status}, restarting it")
+            workers.add(_fork_worker(server, args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Stopping")
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        server.close()
+        os.remove(args.socket)
+
+
+def request(socket_path, input_pdf, timeout=DEFAULT_TIMEOUT, **options):
+    """Have the server on `socket_path` extract a file, returning its response.
+
+    Raises:
+        ConnectionError: if no server listens on `socket_path`.
+    """
+    message = dict(options, input_pdf=os.path.abspath(input_pdf))
+    for key in ('output_pdf', 'image_dir', 'page_results_dir'):
+        if message.get(key) is not None:
+            message[key] = os.path.abspath(message[key])
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        try:
+            conn.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ConnectionError(f"No server on {socket_path}: start one with 'python warm_worker.py serve'") from e
+        _send_line(conn, message)
+        response = _recv_line(conn)
+    if response is None:
+        raise ConnectionError("The server closed the connection")
+    return response
+
+
+def extract(args):
+    options = {key: value for key, value in vars(args).items() if key in EXTRACT_OPTIONS}
+    try:
+        response = request(args.socket, args.input_pdf, **options)
+    except ConnectionError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    if "error" in response:
+        print(f"Extraction failed: {response['error']}", file=sys.stderr)
+        sys.exit(1)
+
+    print()
+    print(f"use_clustered_blocks: {response['use_clustered_blocks']}")
+    if response["output_pdf"]:
+        print(f"Highlighted PDF saved as: {response['output_pdf']}")
+    if response["image_dir"]:
+        print(f"Images saved in: {response['image_dir']}")
+    print(f"JSON data saved as: {response['output_json']}")
+    print(f"Extracted {response['pages']} pages in {response['elapsed']:.3f}s (documents: {response['document_cache']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm worker pool extracting PDF files, and its client.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f'Path of the Unix socket of the server. Defaults to $PDF_WARM_SOCKET or "{DEFAULT_SOCKET}".')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='Start the server.')
+    serve_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Number of worker processes. Defaults to {DEFAULT_WORKERS}.')
+    serve_parser.add_argument('--document_cache_size', type=int, default=DEFAULT_DOCUMENT_CACHE_SIZE, help=f'Open documents kept by each worker. Defaults to {DEFAULT_DOCUMENT_CACHE_SIZE}.')
+    serve_parser.add_argument('--page_cache_size', type=int, default=DEFAULT_PAGE_CACHE_SIZE, help=f'Pages kept by each worker. Defaults to {DEFAULT_PAGE_CACHE_SIZE}.')
+    serve_parser.set_defaults(handler=serve)
+
+    # the options left out are not sent, and get the defaults of extract_text_info.py on the server
+    extract_parser = commands.add_parser('extract', help='Extract a PDF file on the server, like extract_text_info.py does.', argument_default=argparse.SUPPRESS)
+    extract_parser.add_argument('input_pdf', help='Path to the input PDF file.')
+    extract_parser.add_argument('--annotate', action='store_true', help='Also save a copy of the PDF with the text blocks annotated.')
+    extract_parser.add_argument('--output_pdf', help='Path to the annotated PDF file. Implies --annotate.')
+    extract_parser.add_argument('--compact', action='store_true', help='Save the JSON data in the compact columnar format of compact_output.')
+    extract_parser.add_argument('--pages', help='Pages to process, e.g. "1-3,5,8-".')
+    extract_parser.add_argument('--workers', type=int, help='Number of worker processes extracting pages in parallel, besides the warm worker.')
+    extract_parser.add_argument('--chunk_size', type=int, help='Number of pages handed to a worker at once.')
+    extract_parser.add_argument('--auto_clustering', dest='use_auto_clustering', action='store_true', help='Choose the clustering and tolerances of each page from its text.')
+    extract_parser.add_argument('--page_results', dest='page_results_dir', help='Directory where the results of each page are kept by content fingerprint.')
+    extract_parser.add_argument('--ocr', dest='use_ocr', action='store_true', help='OCR the scanned pages with Tesseract.')
+    extract_parser.add_argument('--ocr_language', help='Tesseract languages of the OCR, like "eng+deu".')
+    extract_parser.add_argument('--ocr_dpi', type=int, help='Resolution the scanned pages are OCRed at.')
+    extract_parser.add_argument('--ocr_workers', type=int, help='Number of worker processes OCRing pages in parallel.')
+    extract_parser.add_argument('--images', choices=('none', 'metadata', 'extraction'), help='Image handling: no image models, their metadata, or metadata and extracted images.')
+    extract_parser.add_argument('--image_dir', help='Directory the extracted images are saved to, as "<sha256>.<ext>".')
+    extract_parser.set_defaults(handler=extract)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""The copy of a document opened by worker processes.
+
+Pools of worker processes, extracting pages, images or OCR, open their
+own copy of the document they work on: init_worker() is their initializer,
+given the path or the bytes of the document from pdf_source_of(), and
+their tasks read the `document` it opened.
+"""
+import fitz  # PyMuPDF
+import os
+
+# document opened by the worker process, see init_worker()
+document = None
+
+
+def pdf_source_of(pdf_document):
+    """Return what worker processes open a copy of `pdf_document` from: its path if it is a file, its bytes otherwise."""
+    return pdf_document.name if os.path.isfile(pdf_document.name) else pdf_document.tobytes()
+
+
+def init_worker(pdf_source):
+    """Open the document of a worker process, from a path or from bytes."""
+    global document
+    if isinstance(pdf_source, (bytes, bytearray)):
+        document = fitz.Document(stream=pdf_source)
+    else:
+        document = fitz.open(pdf_source)